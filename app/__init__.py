@@ -1,5 +1,6 @@
 import os
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
@@ -11,8 +12,51 @@ login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
-def create_app(config_class=None):
-    """Create and configure the Flask application"""
+def create_schema():
+    """
+    Create missing tables and the admin user, and move legacy data to the current schema
+    
+    Runs in an application context, from init_db.py and, unless
+    CREATE_SCHEMA_ON_STARTUP is off, from create_app(). Returns True if the
+    admin user was created.
+    """
+    from flask import current_app
+    from app.models import User
+    from app.spell_checker import migrate_legacy_custom_words
+    
+    # Create database tables
+    db.create_all()
+    
+    # Custom dictionaries stored before the user_words table existed
+    migrate_legacy_custom_words()
+    
+    # Create admin user if not exists
+    config = current_app.config
+    if User.query.filter_by(username=config['ADMIN_USERNAME']).first() is not None:
+        return False
+    admin = User(
+        username=config['ADMIN_USERNAME'],
+        email=config['ADMIN_EMAIL'],
+        is_admin=True
+    )
+    admin.set_password(config['ADMIN_PASSWORD'])
+    db.session.add(admin)
+    db.session.commit()
+    return True
+
+def missing_tables():
+    """Return the names of the model tables the database doesn't have, in one catalog query"""
+    existing = set(db.inspect(db.engine).get_table_names())
+    return sorted(name for name in db.metadata.tables if name not in existing)
+
+def create_app(config_class=None, start_indexer=True, check_schema=True):
+    """
+    Create and configure the Flask application
+    
+    Command line scripts pass start_indexer=False: they exit before a
+    background indexer would get anything done. init_db.py, which creates
+    the schema itself, passes check_schema=False.
+    """
     app = Flask(__name__)
     
     # Load configuration
@@ -28,6 +72,14 @@ def create_app(config_class=None):
     
     # Set full path for Whoosh index directory
     app.config['WHOOSH_INDEX_DIR'] = os.path.join(instance_path, app.config['WHOOSH_INDEX_DIR'])
+    # Snapshots go next to it, so their unchanged index files can be hard links
+    app.config['SNAPSHOT_DIR'] = os.path.join(instance_path, app.config['SNAPSHOT_DIR'])
+    app.config['SPELLING_INDEX_PATH'] = os.path.join(instance_path, app.config['SPELLING_INDEX_PATH'])
+    if app.config['TEMPLATE_CACHE_DIR']:
+        app.config['TEMPLATE_CACHE_DIR'] = os.path.join(instance_path, app.config['TEMPLATE_CACHE_DIR'])
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        # Keyed by template name and source checksum, so an edited template is compiled again
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
     
     # Ensure upload directory exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -38,6 +90,12 @@ def create_app(config_class=None):
     csrf.init_app(app)
     login_manager.init_app(app)
     
+    # Size the search result and spell-check caches from the configuration
+    from app.result_cache import result_cache
+    result_cache.max_bytes = app.config['SEARCH_CACHE_MAX_BYTES']
+    from app.spell_checker import spell_checker
+    spell_checker.memo.max_entries = app.config['SPELLING_CACHE_ENTRIES']
+    
     # Import models
     from app.models import User
     
@@ -58,20 +116,20 @@ def create_app(config_class=None):
     from app.documents import bp as documents_bp
     app.register_blueprint(documents_bp, url_prefix='/documents')
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
-        
-        # Create admin user if not exists
-        admin = User.query.filter_by(username=app.config['ADMIN_USERNAME']).first()
-        if not admin:
-            admin = User(
-                username=app.config['ADMIN_USERNAME'],
-                email=app.config['ADMIN_EMAIL'],
-                is_admin=True
-            )
-            admin.set_password(app.config['ADMIN_PASSWORD'])
-            db.session.add(admin)
-            db.session.commit()
+    if check_schema:
+        with app.app_context():
+            if app.config['CREATE_SCHEMA_ON_STARTUP']:
+                create_schema()
+            else:
+                # Startup-optimized mode: init_db.py created the schema; only check that it is complete
+                missing = missing_tables()
+                if missing:
+                    raise RuntimeError(f"The database has no {', '.join(missing)} table(s): run python init_db.py "
+                                       f"(needed after every upgrade with CREATE_SCHEMA_ON_STARTUP off)")
+    
+    # Start the background indexer (it also drains tasks left over from a previous run)
+    if start_indexer and app.config['INDEXING_ASYNC']:
+        from app.indexing import start_indexing_worker
+        start_indexing_worker(app)
     
     return app 
\ No newline at end of file
@@ -2,8 +2,11 @@ from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 from app import db
 from app.admin import bp
-from app.models import User, Document
+from app.models import User, Document, UserDictionaryVersion
 from app.admin.utils import admin_required
+from app.result_cache import result_cache
+from app.search import index_size, index_needs_rebuild, rebuild_status, merge_status, index_segment_stats
+from app.indexing import pending_count, failed_count
 from werkzeug.security import generate_password_hash
 
 @bp.route('/')
@@ -17,7 +20,15 @@ def index():
     return render_template('admin/index.html', 
                          title='Admin Dashboard',
                          users_count=users_count,
-                         documents_count=documents_count)
+                         documents_count=documents_count,
+                         cache_stats=result_cache.stats(),
+                         index_size=index_size(),
+                         index_needs_rebuild=index_needs_rebuild(),
+                         indexing_pending=pending_count(),
+                         indexing_failed=failed_count(),
+                         rebuild=rebuild_status(),
+                         segment_stats=index_segment_stats(),
+                         merge=merge_status())
 
 @bp.route('/users')
 @login_required
@@ -126,6 +137,8 @@ def delete_user(user_id):
         flash('You cannot delete your own account', 'danger')
         return redirect(url_for('admin.manage_users'))
     
+    # Spell checkers holding the user's dictionary must not serve it to a new user given the same id
+    UserDictionaryVersion.bump(user.id)
     db.session.delete(user)
     db.session.commit()
     
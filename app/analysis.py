@@ -0,0 +1,202 @@
+import re
+from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, StemFilter, NgramFilter, Filter, Token
+from whoosh.fields import TEXT
+from whoosh.util.text import utf8encode
+from app.text_window import FileText
+
+class StreamingRegexTokenizer(RegexTokenizer):
+    """
+    RegexTokenizer that also accepts a FileText and tokenizes it chunk by chunk
+
+    Only the current chunk and the unfinished token at its end are held in
+    memory. Positions and character offsets are the same as for the whole
+    text as one string.
+    """
+
+    def __call__(self, value, positions=False, chars=False, keeporiginal=False,
+                 removestops=True, start_pos=0, start_char=0, tokenize=True,
+                 mode='', **kwargs):
+        if isinstance(value, str) or self.gaps or not tokenize:
+            return super().__call__(value, positions=positions, chars=chars, keeporiginal=keeporiginal,
+                                    removestops=removestops, start_pos=start_pos, start_char=start_char,
+                                    tokenize=tokenize, mode=mode, **kwargs)
+        return self._tokenize_chunks(value, positions, chars, keeporiginal, removestops,
+                                     start_pos, start_char, mode, **kwargs)
+
+    def _tokenize_chunks(self, chunks, positions, chars, keeporiginal, removestops,
+                         start_pos, start_char, mode, **kwargs):
+        t = Token(positions, chars, removestops=removestops, mode=mode, **kwargs)
+        pos = start_pos
+        offset = start_char  # Character offset of the start of buffer
+        buffer = ''
+
+        def token(match):
+            t.text = match.group(0)
+            t.boost = 1.0
+            if keeporiginal:
+                t.original = t.text
+            t.stopped = False
+            if positions:
+                t.pos = pos
+            if chars:
+                t.startchar = offset + match.start()
+                t.endchar = offset + match.end()
+            return t
+
+        for chunk in chunks:
+            buffer += chunk
+            last = None
+            for match in self.expression.finditer(buffer):
+                if last is not None:
+                    yield token(last)
+                    pos += 1
+                last = match
+
+            # The last match may continue in the next chunk, so it is matched again
+            # with the next chunk appended; text before it can be dropped
+            cut = last.start() if last is not None else len(buffer)
+            offset += cut
+            buffer = buffer[cut:]
+
+        for match in self.expression.finditer(buffer):
+            yield token(match)
+            pos += 1
+
+class StreamingTEXT(TEXT):
+    """TEXT field that can index a FileText as well as a string"""
+
+    def index(self, value, **kwargs):
+        if not isinstance(value, FileText):
+            return super().index(value, **kwargs)
+
+        kwargs.setdefault("mode", "index")
+        return ((utf8encode(text)[0], freq, weight, vbytes)
+                for text, freq, weight, vbytes in self.format.word_values(value, self.analyzer, **kwargs))
+
+def StreamingStemmingAnalyzer():
+    """Same as whoosh's StemmingAnalyzer() | LowercaseFilter(), accepting a FileText"""
+    return StreamingRegexTokenizer() | LowercaseFilter() | StopFilter() | StemFilter() | LowercaseFilter()
+
+class CharOffsetTokenizer(StreamingRegexTokenizer):
+    """StreamingRegexTokenizer that records character offsets even when the field format doesn't ask for them"""
+
+    def __call__(self, value, chars=False, **kwargs):
+        return super().__call__(value, chars=True, **kwargs)
+
+class GramOffsetFilter(Filter):
+    """
+    Gives each n-gram its character offset in the text as its position
+
+    A positions-only field then tells where every gram starts, which is
+    all that's needed to line grams up into a word and to highlight it,
+    without the start and end offsets the chars format adds to every
+    posting. Goes after the NgramFilter, behind a CharOffsetTokenizer.
+    """
+
+    def __call__(self, tokens):
+        for t in tokens:
+            if t.positions:
+                t.pos = t.startchar
+            yield t
+
+def StreamingNgramWordAnalyzer(size):
+    """
+    Like whoosh's NgramWordAnalyzer with a single gram size, accepting a FileText
+
+    The position of each gram is its character offset (see GramOffsetFilter).
+    """
+    return CharOffsetTokenizer() | LowercaseFilter() | NgramFilter(size, size) | GramOffsetFilter()
+
+def StreamingWordAnalyzer():
+    """Lowercase words without stop words, unstemmed, accepting a FileText"""
+    return StreamingRegexTokenizer() | LowercaseFilter() | StopFilter()
+
+# Identifiers in code and config files: words joined by dots, so a dotted path
+# such as os.path.join is one token (and split again by IdentifierFilter)
+IDENTIFIER_PATTERN = r"\w+(\.\w+)*"
+
+# The parts of an identifier: words in any case style, and runs of digits. The
+# pattern is matched against the shape of the identifier (see identifier_shape),
+# in which A stands for an upper or title case letter, a for any other letter
+# and 0 for a digit, so that it covers every script and not only ASCII
+IDENTIFIER_PART = re.compile(r"A+(?=Aa)|A?a+|A+|0+")
+
+class IdentifierShapes(dict):
+    """str.translate() table from a character to its shape letter, filled in as characters are seen"""
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        if char.isupper() or char.istitle():
+            shape = 'A'
+        elif char.isalpha():
+            shape = 'a'
+        elif char.isdecimal():
+            shape = '0'
+        else:
+            shape = '_'
+        self[codepoint] = shape
+        return shape
+
+_identifier_shapes = IdentifierShapes()
+
+def identifier_shape(text):
+    """Return text with each character replaced by its shape letter, for IDENTIFIER_PART"""
+    return text.translate(_identifier_shapes)
+
+class IdentifierFilter(Filter):
+    """
+    Splits identifiers into their parts, keeping the identifier itself
+
+    getUserById, max_retry_count, os.path.join and utf8Decoder are indexed
+    as the whole token followed by its parts (get, User, By, Id; max, retry,
+    count; ...), with the character offsets of each part. The parts take
+    consecutive positions, the first one that of the whole token, and the
+    tokens after them move along. At query time a compound is replaced by
+    its parts, which the field matches as a phrase (see StreamingCodeTEXT),
+    so searching for any spelling of an identifier or a run of its parts
+    finds it, while os.path.join doesn't match os, path and join used apart.
+    Goes before the LowercaseFilter, which would hide the camelCase
+    boundaries.
+    """
+
+    def __call__(self, tokens):
+        shift = 0  # Positions taken by the parts of the identifiers so far
+        for t in tokens:
+            if t.positions:
+                t.pos += shift
+            text = t.text
+            parts = list(IDENTIFIER_PART.finditer(identifier_shape(text)))
+            if not parts or (len(parts) == 1 and parts[0].end() - parts[0].start() == len(text)):
+                yield t
+                continue
+
+            if t.mode != 'query':
+                yield t
+            chars = t.chars
+            startchar = t.startchar if chars else 0
+            for number, match in enumerate(parts):
+                t.text = text[match.start():match.end()]
+                if chars:
+                    t.startchar = startchar + match.start()
+                    t.endchar = startchar + match.end()
+                if t.positions and number:
+                    t.pos += 1
+                    shift += 1
+                yield t
+
+class StreamingCodeTEXT(StreamingTEXT):
+    """StreamingTEXT for identifiers: a query word that splits into parts matches them as a phrase"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('multitoken_query', 'phrase')
+        super().__init__(**kwargs)
+
+def StreamingCodeAnalyzer():
+    """
+    Analyzer for source code and config files, accepting a FileText
+
+    Splits identifiers with IdentifierFilter and doesn't stem: English
+    stemming would conflate unrelated identifiers (retry/retries, user/users
+    are different names in code) and only applies to prose.
+    """
+    return StreamingRegexTokenizer(IDENTIFIER_PATTERN) | IdentifierFilter() | LowercaseFilter()
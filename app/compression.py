@@ -0,0 +1,201 @@
+import bz2
+import io
+import lzma
+import os
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # Optional: zstd is only offered when the package is installed
+    zstandard = None
+
+# Compressed blobs start with this. A UTF-8 text file (the only kind accepted
+# for upload) can't begin with the byte 0x89, so raw blobs are never mistaken
+# for compressed ones and both kinds can live side by side in the store
+MAGIC = b'\x89DSZ'
+
+# Magic, format version, codec name, uncompressed bytes per frame
+HEADER = struct.Struct('<4sB7sI')
+
+# Uncompressed size, number of frames, magic again; the frame table (the end
+# offset of every frame as a 64-bit integer) comes right before it
+TRAILER = struct.Struct('<QI4s')
+FRAME_END = struct.Struct('<Q')
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+# Codec name -> (compress, decompress), each taking and returning bytes
+CODECS = {
+    'gzip': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'bz2': (lambda data: bz2.compress(data, 9), bz2.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (_zstd_compress, _zstd_decompress)
+
+def available_codecs():
+    """Return the names of the codecs that can be used on this system"""
+    return sorted(CODECS)
+
+def compress_file(source_path, target_path, codec, frame_bytes=64 * 1024):
+    """
+    Write a compressed copy of a file, in independently compressed frames
+
+    Every frame_bytes bytes of the file are compressed on their own and a
+    table of where each frame ends is appended, so a reader can decompress
+    any byte range by reading only the frames it covers (see FramedFile).
+    The file is streamed, one frame in memory at a time.
+
+    Returns the size of the compressed file. Raises ValueError for a codec
+    that isn't available.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown or unavailable compression codec {codec!r} "
+                         f"(available: {', '.join(available_codecs())})")
+    compress = CODECS[codec][0]
+
+    frame_ends = []
+    size = 0
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        target.write(HEADER.pack(MAGIC, 1, codec.encode('ascii'), frame_bytes))
+        for frame in iter(lambda: source.read(frame_bytes), b''):
+            target.write(compress(frame))
+            frame_ends.append(target.tell())
+            size += len(frame)
+        for end in frame_ends:
+            target.write(FRAME_END.pack(end))
+        target.write(TRAILER.pack(size, len(frame_ends), MAGIC))
+        return target.tell()
+
+def is_compressed(path):
+    """True if path is a compressed blob written by compress_file()"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def open_blob(path):
+    """
+    Open a stored file for reading its original bytes
+
+    Returns a seekable binary file object: the file itself for a raw blob,
+    or a FramedFile that decompresses on the fly for a compressed one.
+    """
+    f = open(path, 'rb')
+    if f.read(len(MAGIC)) != MAGIC:
+        f.seek(0)
+        return f
+    return FramedFile(f)
+
+def blob_size(path):
+    """Return the size of the original content of a stored file, compressed or not"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return os.fstat(f.fileno()).st_size
+        f.seek(-TRAILER.size, os.SEEK_END)
+        size, _, _ = TRAILER.unpack(f.read(TRAILER.size))
+        return size
+
+class FramedFile(io.RawIOBase):
+    """
+    Seekable reader over the original bytes of a file written by compress_file()
+
+    Only the frames a read touches are decompressed, and the last one is
+    kept, so the small sequential reads of a snippet window or a streamed
+    download decompress every frame once. Slicing (f[start:stop]) reads a
+    byte range without moving the position, which lets it stand in for the
+    memory map of a raw file.
+    """
+
+    def __init__(self, f):
+        super().__init__()
+        self._file = f
+        f.seek(0)
+        _, _, codec, self.frame_bytes = HEADER.unpack(f.read(HEADER.size))
+        self.codec = codec.rstrip(b'\0').decode('ascii')
+        if self.codec not in CODECS:
+            f.close()
+            raise ValueError(f"Can't read a blob compressed with {self.codec!r}: the codec isn't available")
+        self._decompress = CODECS[self.codec][1]
+
+        f.seek(-TRAILER.size, os.SEEK_END)
+        self.size, frame_count, _ = TRAILER.unpack(f.read(TRAILER.size))
+        f.seek(-TRAILER.size - frame_count * FRAME_END.size, os.SEEK_END)
+        table = f.read(frame_count * FRAME_END.size)
+        self._frame_ends = [end for end, in FRAME_END.iter_unpack(table)]
+
+        self._position = 0
+        self._cached_index = None
+        self._cached_frame = b''
+
+    def _frame(self, index):
+        if index != self._cached_index:
+            start = self._frame_ends[index - 1] if index else HEADER.size
+            self._file.seek(start)
+            self._cached_frame = self._decompress(self._file.read(self._frame_ends[index] - start))
+            self._cached_index = index
+        return self._cached_frame
+
+    def read_range(self, start, stop):
+        """Return the original bytes from start to stop"""
+        start = max(0, start)
+        stop = min(stop, self.size)
+        pieces = []
+        while start < stop:
+            index, offset = divmod(start, self.frame_bytes)
+            piece = self._frame(index)[offset:offset + stop - start]
+            pieces.append(piece)
+            start += len(piece)
+        return b''.join(pieces)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError('FramedFile only supports contiguous slices')
+        start, stop, _ = key.indices(self.size)
+        return self.read_range(start, stop)
+
+    def __len__(self):
+        return self.size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def read(self, size=-1):
+        stop = self.size if size is None or size < 0 else self._position + size
+        data = self.read_range(self._position, stop)
+        self._position += len(data)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def fileno(self):
+        # The decompressed bytes aren't in the file, so don't let callers bypass read()
+        raise io.UnsupportedOperation('fileno')
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
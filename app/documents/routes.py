@@ -1,5 +1,3 @@
-import os
-import uuid
 from flask import render_template, redirect, url_for, flash, current_app, request
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
@@ -7,7 +5,8 @@ from app import db
 from app.documents import bp
 from app.documents.forms import UploadDocumentForm
 from app.models import Document
-from app.search import add_document_to_index, remove_document_from_index
+from app.indexing import enqueue_index, enqueue_remove, notify_indexer, indexing_status
+from app.storage import save_upload, store_blob, release_blob, delete_unused_file
 
 def allowed_file(filename):
     """Check if a file has an allowed extension"""
@@ -91,43 +90,39 @@ def upload():
                     skipped_files.append(f'"{uploaded_file.filename}" (unsupported format)')
                 continue
             
-            # Generate a unique filename to prevent collisions
             original_filename = secure_filename(uploaded_file.filename)
-            unique_filename = f"{uuid.uuid4().hex}_{original_filename}"
             
-            # Save the file
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-            uploaded_file.save(file_path)
-            
-            # Read file content for indexing and preview
+            # Save, hash, validate and preview the file in one pass over the upload
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    # Create a preview of the first 500 characters
-                    content_preview = content[:500] + ('...' if len(content) > 500 else '')
+                upload = save_upload(uploaded_file)
             except Exception as e:
-                error_message = str(e)
-                flash(f'Error reading file "{original_filename}": {error_message}. The file might be binary or use an unsupported encoding.', 'danger')
-                os.remove(file_path)  # Remove the file if we can't read it
+                flash(f'Error reading file "{original_filename}": {str(e)}. The file might be binary or use an unsupported encoding.', 'danger')
                 continue
             
+            # Identical content is stored once and shared between documents
+            blob = store_blob(upload.temp_path, upload.digest, upload.size)
+            
             # Create document record in database
             document = Document(
-                filename=unique_filename,
+                filename=blob.filename,
                 original_filename=original_filename,
                 user_id=current_user.id,
-                content_preview=content_preview
+                content_preview=upload.preview
             )
             db.session.add(document)
-            db.session.commit()
+            db.session.flush()
             
-            # Index the document for search
-            add_document_to_index(document, content)
+            # Queue the document for the background indexer
+            enqueue_index(document)
+            db.session.commit()
             
             upload_count += 1
-    
+        
         if upload_count > 0:
-            flash(f'Successfully uploaded {upload_count} document(s)', 'success')
+            notify_indexer()
+            
+            flash(f'Successfully uploaded {upload_count} document(s). '
+                  f'They will appear in search results once indexing finishes.', 'success')
             
             if skipped_files:
                 flash(f'Skipped {len(skipped_files)} file(s): {", ".join(skipped_files[:3])}' + 
@@ -151,7 +146,9 @@ def upload():
 def my_documents():
     """View user's documents"""
     documents = Document.query.filter_by(user_id=current_user.id).order_by(Document.upload_date.desc()).all()
-    return render_template('documents/my_documents.html', title='My Documents', documents=documents)
+    index_status = indexing_status([document.id for document in documents])
+    return render_template('documents/my_documents.html', title='My Documents', documents=documents,
+                           index_status=index_status)
 
 @bp.route('/delete/<int:doc_id>', methods=['POST'])
 @login_required
@@ -164,21 +161,21 @@ def delete_document(doc_id):
         flash('You do not have permission to delete this document', 'danger')
         return redirect(url_for('documents.my_documents'))
     
+    # Queue removal from the search index and delete the document record in one transaction.
+    # The stored file is shared with other documents that have the same content,
+    # so it is only deleted when this was the last of them
+    unused_file = release_blob(document)
+    enqueue_remove(document.id)
+    db.session.delete(document)
+    db.session.commit()
+    notify_indexer()
+    
     # Delete file from disk
     try:
-        file_path = document.get_file_path()
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        delete_unused_file(unused_file)
     except Exception as e:
         flash(f'Error deleting file: {str(e)}', 'danger')
     
-    # Remove document from search index
-    remove_document_from_index(document.id)
-    
-    # Delete document record from database
-    db.session.delete(document)
-    db.session.commit()
-    
     flash('Document deleted successfully', 'success')
     
     if current_user.is_admin and document.user_id != current_user.id:
@@ -0,0 +1,320 @@
+import hashlib
+import os
+import threading
+import time
+from flask import current_app
+from whoosh.index import LockError
+from app import db
+from app.models import Document, IndexingTask, IndexManifest
+from app.search import index_writer, IndexUpdate, get_searcher, merge_if_needed, optimize_if_due
+from app.text_window import FileText
+from app.compression import open_blob
+
+# Threads of this process take turns at the index writer, so they wait here
+# instead of failing on the index's write lock
+_writer_lock = threading.Lock()
+
+def enqueue_index(document):
+    """Queue a document to be (re)indexed by the background indexer"""
+    db.session.add(IndexingTask(document_id=document.id, action='index'))
+
+def enqueue_remove(document_id):
+    """Queue a document to be removed from the index by the background indexer"""
+    db.session.add(IndexingTask(document_id=document_id, action='remove'))
+
+def notify_indexer():
+    """
+    Tell the indexer that new tasks were committed
+
+    Without a background worker (INDEXING_ASYNC off) the queue is drained
+    right away in the current request. Concurrent requests don't each
+    commit: whichever gets the writer applies everything queued so far, and
+    the others find their tasks already done.
+    """
+    worker = current_app.extensions.get('indexing_worker')
+    if worker is not None:
+        worker.notify()
+    else:
+        drain_queue(current_app.config['INDEXING_BATCH_SIZE'], timeout=current_app.config['INDEXING_LOCK_TIMEOUT'])
+
+def pending_count():
+    """Return the number of tasks waiting to be applied"""
+    return IndexingTask.query.filter(IndexingTask.error.is_(None)).count()
+
+def failed_count():
+    """Return the number of tasks that failed"""
+    return IndexingTask.query.filter(IndexingTask.error.isnot(None)).count()
+
+def indexing_status(document_ids):
+    """Return a dict of document id -> 'pending', 'failed' or 'indexed'"""
+    status = {document_id: 'indexed' for document_id in document_ids}
+    if not document_ids:
+        return status
+
+    tasks = IndexingTask.query.filter(IndexingTask.document_id.in_(document_ids)).all()
+    for task in tasks:
+        if task.error is not None:
+            status[task.document_id] = 'failed'
+        elif status[task.document_id] != 'failed':
+            status[task.document_id] = 'pending'
+    return status
+
+def indexing_source(document):
+    """
+    Return (content hash, manifest state, read function) for indexing a document
+
+    Blobs are named after their hash, so only files stored before blobs
+    existed have to be read to find it. Blobs are handed to the index as a
+    FileText, which is tokenized as a stream.
+    """
+    content_hash = document.content_hash
+    if content_hash is None:
+        content, state = document.read_for_indexing()
+        return state['content_hash'], state, lambda: content
+
+    stat = os.stat(document.get_file_path())
+    state = {'content_hash': content_hash, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    return content_hash, state, lambda: FileText(document.get_file_path())
+
+def process_pending(batch_size):
+    """
+    Apply up to batch_size queued tasks to the index in a single commit
+
+    Tasks are applied in order and only the last task for each document
+    counts, so a document uploaded and deleted in the same batch costs
+    nothing. Tasks are deleted only after the index commit, so a crash
+    leaves them queued and they are replayed on the next start; replaying
+    is harmless because indexing deletes any previous entry first. The
+    database is only written after the index commit, so uploads running
+    meanwhile aren't kept waiting on SQLite's write lock.
+
+    Returns the number of tasks consumed (0 when the queue is empty), or
+    None if another process holds the index write lock.
+    """
+    tasks = (IndexingTask.query.filter(IndexingTask.error.is_(None))
+             .order_by(IndexingTask.id).limit(batch_size).all())
+    if not tasks:
+        return 0
+
+    latest = {}
+    for task in tasks:
+        latest[task.document_id] = task
+
+    failed = {}
+    removed = []
+    indexed = {}
+    try:
+        with index_writer(merge=False) as writer:
+            update = IndexUpdate(writer)
+            for document_id, task in latest.items():
+                document = Document.query.get(document_id) if task.action == 'index' else None
+                if document is None:
+                    update.remove(document_id)
+                    removed.append(document_id)
+                    continue
+
+                # Content already in the index (a duplicate upload) is not read again;
+                # other files are read only when it's their turn, so a batch holds one file in memory
+                try:
+                    content_hash, state, read_content = indexing_source(document)
+                    update.add(document, content_hash, read_content)
+                except Exception as e:
+                    failed[task.id] = str(e)
+                    continue
+
+                indexed[document_id] = state
+            update.finish()
+    except LockError:
+        # Another process is writing; it or our next attempt will pick these up
+        db.session.rollback()
+        return None
+
+    if removed:
+        IndexManifest.query.filter(IndexManifest.document_id.in_(removed)).delete()
+    for document_id, state in indexed.items():
+        IndexManifest.record(document_id, state)
+    for task in tasks:
+        if task.id in failed:
+            task.error = failed[task.id]
+            task.attempts = (task.attempts or 0) + 1
+        else:
+            db.session.delete(task)
+    db.session.commit()
+
+    return len(tasks)
+
+def drain_queue(batch_size, timeout=None, retry_delay=0.1):
+    """
+    Apply queued tasks until the queue is empty
+
+    Each batch takes everything queued at that moment, including tasks that
+    other threads and processes queued while the previous batch was being
+    written, so simultaneous uploads share commits instead of competing for
+    the write lock. Threads of this process wait their turn on a local lock.
+    When another process holds the index write lock, the drain retries every
+    retry_delay seconds (that process may have read the queue before our
+    tasks arrived) and gives up after timeout seconds, leaving the rest
+    queued for the next drain. Once the queue is empty, segments are merged
+    if needed (see merge_if_needed), so batches don't wait for merges.
+
+    Returns the number of tasks applied.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    applied = 0
+    while True:
+        with _writer_lock:
+            consumed = process_pending(batch_size)
+        if consumed is None:
+            if deadline is not None and time.time() >= deadline:
+                break
+            time.sleep(retry_delay)
+        elif consumed:
+            applied += consumed
+        else:
+            break
+    if applied:
+        with _writer_lock:
+            merge_if_needed()
+    return applied
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 of a file's content (decompressed for a compressed blob), reading it in chunks"""
+    digest = hashlib.sha256()
+    with open_blob(path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def indexed_document_ids():
+    """Return the set of document ids that have a live entry in the search index"""
+    with get_searcher() as searcher:
+        reader = searcher.reader()
+        if not reader.has_deletions():
+            # Fast path: the term list is exact when no entry has been deleted
+            return {int(doc_id) for doc_id in reader.field_terms('doc_id')}
+        return {int(fields['doc_id']) for fields in reader.all_stored_fields() if 'doc_id' in fields}
+
+def sync_index(apply=True):
+    """
+    Bring the search index in line with the database and the upload folder
+
+    Each document's file is compared with its manifest entry. Files whose
+    size and mtime are unchanged are skipped without being read; the others
+    are hashed and only reindexed if the hash differs. Index entries for
+    deleted rows or missing files are removed. Changes are queued for the
+    indexer like any other update.
+
+    With apply=False nothing is changed and only the report is produced.
+
+    Returns:
+        dict: Document ids per outcome ('new', 'changed', 'touched',
+        'missing', 'orphaned'), the number of 'unchanged' documents and the
+        elapsed 'seconds'
+    """
+    started = time.time()
+    report = {'new': [], 'changed': [], 'touched': [], 'missing': [], 'orphaned': [], 'unchanged': 0}
+
+    manifest = {entry.document_id: entry for entry in IndexManifest.query.all()}
+    indexed_ids = indexed_document_ids()
+    # Tasks still in the queue will be applied anyway
+    queued_ids = {task.document_id for task in IndexingTask.query.filter(IndexingTask.error.is_(None))}
+    document_ids = set()
+
+    for document in Document.query.all():
+        document_ids.add(document.id)
+        if document.id in queued_ids:
+            continue
+
+        entry = manifest.get(document.id)
+        try:
+            stat = os.stat(document.get_file_path())
+        except OSError:
+            if document.id in indexed_ids or entry is not None:
+                report['missing'].append(document.id)
+                if apply:
+                    enqueue_remove(document.id)
+            continue
+
+        if entry is None or document.id not in indexed_ids:
+            report['new'].append(document.id)
+            if apply:
+                enqueue_index(document)
+        elif entry.matches_stat(stat):
+            report['unchanged'] += 1
+        elif file_hash(document.get_file_path()) == entry.content_hash:
+            # Only the mtime changed (e.g. the file was copied or restored)
+            report['touched'].append(document.id)
+            if apply:
+                entry.size = stat.st_size
+                entry.mtime = stat.st_mtime
+        else:
+            report['changed'].append(document.id)
+            if apply:
+                enqueue_index(document)
+
+    # Index entries and manifest rows whose document row is gone
+    for document_id in sorted((indexed_ids | set(manifest)) - document_ids - queued_ids):
+        report['orphaned'].append(document_id)
+        if apply:
+            enqueue_remove(document_id)
+
+    if apply:
+        db.session.commit()
+
+    report['seconds'] = time.time() - started
+    return report
+
+class IndexingWorker:
+    """
+    Background thread that drains the indexing queue in batches
+
+    Uploads commit their tasks and call notify(). The worker then waits up
+    to INDEXING_BATCH_LATENCY seconds for more tasks (unless a full batch is
+    already queued) and applies them with one index writer, so a bulk upload
+    produces a few large segments instead of one tiny segment per file. The
+    queue lives in the database, so tasks left over from a previous run are
+    processed when the worker starts. Between batches it also runs the
+    nightly merge of the index (see optimize_if_due).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='indexing-worker', daemon=True)
+        self._thread.start()
+        # Pick up anything left in the queue by a previous run
+        self._wakeup.set()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        config = self.app.config
+        while True:
+            self._wakeup.wait(config['INDEXING_POLL_INTERVAL'])
+            self._wakeup.clear()
+
+            with self.app.app_context():
+                try:
+                    pending = pending_count()
+                    if pending:
+                        if pending < config['INDEXING_BATCH_SIZE']:
+                            # Give a bulk upload a moment to queue the rest of its files
+                            time.sleep(config['INDEXING_BATCH_LATENCY'])
+                        drain_queue(config['INDEXING_BATCH_SIZE'], retry_delay=config['INDEXING_BATCH_LATENCY'])
+                    optimize_if_due()
+                except Exception as e:
+                    current_app.logger.error(f"Background indexing error: {str(e)}")
+                    db.session.rollback()
+
+def start_indexing_worker(app):
+    """Start the background indexer for app"""
+    worker = IndexingWorker(app)
+    app.extensions['indexing_worker'] = worker
+    worker.start()
+    return worker
@@ -1,8 +1,12 @@
-from flask import render_template, request, jsonify, current_app, send_file, flash, redirect, url_for
+from flask import render_template, request, jsonify, current_app, send_file, flash, redirect, url_for, Response
 from app.main import bp
-from app.search import search_documents, rebuild_index
-from app.models import Document
+from app.search import search_documents, rebuild_status, start_background_rebuild, index_document_counts, \
+    merge_status, start_background_merge, index_segment_stats
+from app.models import Document, User, UserWord, UserDictionaryVersion
+from app.indexing import sync_index, notify_indexer
+from app.compression import open_blob, is_compressed
 from app.spell_checker import spell_checker
+from app.suggestions import check_query, check_query_within
 from flask_login import current_user, login_required
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, BooleanField
@@ -25,9 +29,8 @@ def index():
     """Home page with search functionality"""
     search_form = SearchForm()
     
-    # Get document count for display
-    total_docs = Document.query.count()
-    user_docs = Document.query.filter_by(user_id=current_user.id).count() if current_user.is_authenticated else 0
+    # Get document counts for display from the search index rather than counting rows
+    total_docs, user_docs = index_document_counts(current_user.id if current_user.is_authenticated else None)
     
     return render_template('index.html', 
                            title='Document Search Engine', 
@@ -62,6 +65,14 @@ def search():
         global_search = request.args.get('global_search', 'true').lower() == 'true'
         multiple_results = request.args.get('multiple_results', 'true').lower() == 'true'
     
+    # Page number (POST submissions always start from the first page)
+    page = request.args.get('page', 1, type=int) if request.method == 'GET' else 1
+    
+    # Admins can restrict the search to the documents of any uploader
+    is_admin = current_user.is_authenticated and current_user.is_admin
+    uploader = request.values.get('uploader', type=int) if is_admin else None
+    uploaders = User.query.order_by(User.username).all() if is_admin else []
+    
     if not query:
         return render_template('search_results.html', 
                              title='Search Results',
@@ -71,20 +82,22 @@ def search():
                              case_sensitive=case_sensitive,
                              global_search=global_search,
                              multiple_results=multiple_results,
+                             page=page,
+                             uploader=uploader,
+                             uploaders=uploaders,
                              form=search_form)
     
-    # Check for spelling errors
-    user_id = current_user.id if current_user.is_authenticated else None
-    spelling_errors = spell_checker.check_text(query, user_id)
-    
     # Determine if we should filter by user_id
     search_user_id = None if global_search or not current_user.is_authenticated else current_user.id
+    if uploader is not None:
+        search_user_id = uploader
     
     # Perform search with enhanced options
     try:
         results = search_documents(
             query_string=query,
-            limit=100,  # Significantly increased limit to show more comprehensive results
+            limit=current_app.config['SEARCH_RESULTS_PER_PAGE'],
+            page=page,
             user_id=search_user_id,
             partial_match=partial_match,
             case_sensitive=case_sensitive,
@@ -98,15 +111,38 @@ def search():
         # Return empty results
         results = []
     
+    # Spell-check only queries that find little, on the first page, within a time budget.
+    # A check that doesn't finish in time is requested by the results page instead
+    spelling_errors, suggested_query, spelling_deferred = {}, None, False
+    total_hits = results[0]['total_unique_docs'] if results else 0
+    below_hits = current_app.config['SPELLING_CHECK_BELOW_HITS']
+    if page == 1 and (below_hits is None or total_hits < below_hits):
+        user_id = current_user.id if current_user.is_authenticated else None
+        try:
+            checked = check_query_within(current_app.config['SPELLING_TIME_BUDGET'], query, user_id, search_user_id)
+        except Exception as e:
+            current_app.logger.error(f"Spell check error: {str(e)}")
+            checked = ({}, None)
+        if checked is None:
+            spelling_deferred = True
+        else:
+            spelling_errors, suggested_query = checked
+    
     return render_template('search_results.html', 
                          title='Search Results',
                          query=query,
                          results=results,
                          spelling_errors=spelling_errors,
+                         suggested_query=suggested_query,
+                         spelling_deferred=spelling_deferred,
+                         search_user_id=search_user_id,
                          partial_match=partial_match,
                          case_sensitive=case_sensitive,
                          global_search=global_search,
                          multiple_results=multiple_results,
+                         page=page,
+                         uploader=uploader,
+                         uploaders=uploaders,
                          form=search_form)
 
 @bp.route('/view/<int:doc_id>')
@@ -121,10 +157,9 @@ def view_document(doc_id):
                              title='Error',
                              message='Document file not found')
     
-    # Read file content
+    # Read file content (compressed blobs are decompressed)
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = document.read_content(errors='strict')
     except Exception as e:
         return render_template('error.html', 
                              title='Error',
@@ -147,7 +182,11 @@ def download_document(doc_id):
                              title='Error',
                              message='Document file not found')
     
-    # Send file for download
+    # Send file for download; a compressed blob is streamed through its decompressor
+    if is_compressed(file_path):
+        return send_file(open_blob(file_path),
+                         as_attachment=True,
+                         download_name=document.original_filename)
     return send_file(file_path, 
                      as_attachment=True,
                      download_name=document.original_filename)
@@ -163,9 +202,22 @@ def api_spell_check():
     
     if not text:
         return jsonify({'errors': {}})
+    # A query such as 404 may arrive as a JSON number
+    text = str(text)
     
     # Check spelling
     user_id = current_user.id if current_user.is_authenticated else None
+    
+    # The results page asks for the checks of its query it didn't wait for, including
+    # a corrected query for the documents it searched (all, the user's or, for admins, anyone's)
+    if request.json.get('suggest_query'):
+        search_user_id = request.json.get('search_user_id')
+        if search_user_id is not None and not (current_user.is_authenticated and
+                                               (current_user.is_admin or search_user_id == current_user.id)):
+            return jsonify({'errors': {}, 'message': 'Not allowed to search these documents'}), 403
+        spelling_errors, suggested_query = check_query(text, user_id, search_user_id)
+        return jsonify({'errors': spelling_errors, 'suggested_query': suggested_query})
+    
     spelling_errors = spell_checker.check_text(text, user_id)
     
     return jsonify({'errors': spelling_errors})
@@ -193,6 +245,53 @@ def api_add_to_dictionary():
     else:
         return jsonify({'success': False, 'message': 'Failed to add word to dictionary'})
 
+@bp.route('/api/dictionary', methods=['GET'])
+def api_export_dictionary():
+    """API endpoint to export the user's custom dictionary (JSON, or one word per line with ?format=text)"""
+    if not current_user.is_authenticated:
+        return jsonify({'success': False, 'message': 'You must be logged in'}), 401
+    
+    words = UserWord.words_of(current_user.id)
+    
+    if request.args.get('format') == 'text':
+        return Response(''.join(word + '\n' for word in words),
+                        mimetype='text/plain',
+                        headers={'Content-Disposition': 'attachment; filename=dictionary.txt'})
+    
+    return jsonify({'words': words, 'version': UserDictionaryVersion.current(current_user.id)})
+
+@bp.route('/api/dictionary/import', methods=['POST'])
+def api_import_dictionary():
+    """
+    API endpoint to add a word list to the user's custom dictionary
+    
+    Accepts JSON {"words": [...]}, an uploaded text file ("file") or a
+    text/plain body, with words separated by new lines, commas or spaces.
+    Words already in the dictionary are skipped.
+    """
+    if not current_user.is_authenticated:
+        return jsonify({'success': False, 'message': 'You must be logged in'}), 401
+    
+    if request.is_json:
+        words = request.json.get('words')
+        if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+            return jsonify({'success': False, 'message': 'words must be a list of strings'}), 400
+    elif 'file' in request.files:
+        words = request.files['file'].read().decode('utf-8', errors='replace').splitlines()
+    elif request.mimetype == 'text/plain':
+        words = request.get_data(as_text=True).splitlines()
+    else:
+        return jsonify({'success': False, 'message': 'Send JSON, a text file or a text/plain body'}), 400
+    
+    added = spell_checker.add_words(words, current_user.id)
+    if added is None:
+        return jsonify({'success': False, 'message': 'Failed to add words to dictionary'})
+    
+    return jsonify({'success': True,
+                    'added': added,
+                    'version': UserDictionaryVersion.current(current_user.id),
+                    'message': f'Added {added} new words to your dictionary'})
+
 @bp.route('/admin/rebuild-index', methods=['POST'])
 @login_required
 def admin_rebuild_index():
@@ -201,11 +300,59 @@ def admin_rebuild_index():
         flash('You do not have permission to perform this action', 'danger')
         return redirect(url_for('main.index'))
     
-    try:
-        indexed_count = rebuild_index()
-        flash(f'Successfully rebuilt search index with {indexed_count} documents', 'success')
+    status = rebuild_status()
+    if status and status['state'] == 'running':
+        flash('An index rebuild is already running', 'info')
+        return redirect(url_for('admin.index'))
+    
+    # The live index keeps serving searches while the new one is built
+    start_background_rebuild(current_app._get_current_object())
+    flash('Index rebuild started. Search keeps working while the new index is built; '
+          'progress is shown below.', 'success')
+    return redirect(url_for('admin.index'))
+
+@bp.route('/admin/merge-index', methods=['POST'])
+@login_required
+def admin_merge_index():
+    """Admin function to merge the index segments into one"""
+    if not current_user.is_admin:
+        flash('You do not have permission to perform this action', 'danger')
+        return redirect(url_for('main.index'))
+    
+    status = merge_status()
+    if status and status['state'] == 'running':
+        flash('A segment merge is already running', 'info')
         return redirect(url_for('admin.index'))
+    
+    stats = index_segment_stats()
+    if stats['segments'] <= 1 and not stats['deleted']:
+        flash('The index is already a single segment with no deleted entries', 'info')
+        return redirect(url_for('admin.index'))
+    
+    # Searches use the current segments until the merged one is committed
+    start_background_merge(current_app._get_current_object())
+    flash(f'Merging {stats["segments"]} segments and dropping {stats["deleted"]} deleted entries '
+          'in the background.', 'success')
+    return redirect(url_for('admin.index'))
+
+@bp.route('/admin/sync-index', methods=['POST'])
+@login_required
+def admin_sync_index():
+    """Admin function to reindex only the documents that changed since they were indexed"""
+    if not current_user.is_admin:
+        flash('You do not have permission to perform this action', 'danger')
+        return redirect(url_for('main.index'))
+    
+    try:
+        report = sync_index()
+        notify_indexer()
+        queued = len(report['new']) + len(report['changed'])
+        removed = len(report['missing']) + len(report['orphaned'])
+        flash(f'Index sync checked {queued + removed + len(report["touched"]) + report["unchanged"]} documents '
+              f'in {report["seconds"]:.1f}s: {len(report["new"])} new and {len(report["changed"])} changed queued for indexing, '
+              f'{removed} removed ({len(report["missing"])} missing files, {len(report["orphaned"])} deleted documents), '
+              f'{report["unchanged"] + len(report["touched"])} unchanged', 'success')
     except Exception as e:
-        current_app.logger.error(f"Index rebuild error: {str(e)}")
-        flash(f'Error rebuilding index: {str(e)}', 'danger')
-        return redirect(url_for('admin.index')) 
\ No newline at end of file
+        current_app.logger.error(f"Index sync error: {str(e)}")
+        flash(f'Error syncing index: {str(e)}', 'danger')
+    return redirect(url_for('admin.index'))
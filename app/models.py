@@ -3,6 +3,7 @@ from datetime import datetime
 import pytz
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
+import hashlib
 from app import db
 
 def get_pakistan_time():
@@ -21,10 +22,12 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(128), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=get_pakistan_time)
-    custom_words = db.Column(db.Text, default='')  # Store custom dictionary words as comma-separated string
+    custom_words = db.Column(db.Text, default='')  # Legacy comma-separated dictionary, moved to user_words on startup
     
     # Relationship with documents
     documents = db.relationship('Document', backref='uploader', lazy='dynamic')
+    # Custom dictionary words, one row each
+    dictionary_words = db.relationship('UserWord', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -33,20 +36,12 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
         
     def add_custom_word(self, word):
-        """Add a word to the user's custom dictionary"""
-        if not self.custom_words:
-            self.custom_words = word
-        else:
-            words = self.custom_words.split(',')
-            if word not in words:
-                words.append(word)
-                self.custom_words = ','.join(words)
-
+        """Add a word to the user's custom dictionary; True if it wasn't there yet"""
+        return UserWord.add(self.id, [word.strip().lower()]) == 1
+    
     def get_custom_words(self):
         """Return the user's custom dictionary as a list"""
-        if not self.custom_words:
-            return []
-        return self.custom_words.split(',')
+        return UserWord.words_of(self.id)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -61,10 +56,206 @@ class Document(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     content_preview = db.Column(db.Text)  # Store a preview of the content for quick display
     
+    @property
+    def content_hash(self):
+        """SHA-256 of the document's content, or None for uploads stored before blobs existed"""
+        return Blob.digest_from_filename(self.filename)
+    
     def get_file_path(self):
         """Return the full path to the document file"""
         from flask import current_app
         return os.path.join(current_app.config['UPLOAD_FOLDER'], self.filename)
     
+    def read_content(self, errors='replace'):
+        """Read the document file as text, decompressing a compressed blob"""
+        from app.compression import open_blob
+        # Decoding the bytes (no newline translation) keeps the character offsets
+        # in the index in line with the file on disk
+        with open_blob(self.get_file_path()) as f:
+            return f.read().decode('utf-8', errors=errors)
+    
+    def read_for_indexing(self):
+        """
+        Read the document file for indexing along with the state to record in the index manifest
+        
+        Returns (content, state) where state is a dict with the content hash,
+        size and mtime of the bytes that were read.
+        """
+        with open(self.get_file_path(), 'rb') as f:
+            stat = os.fstat(f.fileno())
+            data = f.read()
+        # Decoding the raw bytes matches read_content(): no newline translation
+        state = {
+            'content_hash': hashlib.sha256(data).hexdigest(),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+        return data.decode('utf-8', errors='replace'), state
+    
+    def __repr__(self):
+        return f'<Document {self.original_filename}>'
+
+class Blob(db.Model):
+    """
+    Uploaded content stored once under its SHA-256 and shared by every document with that content
+    
+    ref_count is the number of documents using the blob; the file is deleted
+    when the last one is, and the row, left at 0 until then, with it.
+    """
+    __tablename__ = 'blobs'
+    
+    # Blobs live in UPLOAD_FOLDER/blobs/<first two hex digits>/<digest>
+    DIRECTORY = 'blobs'
+    
+    digest = db.Column(db.String(64), primary_key=True)  # SHA-256 of the content
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=get_pakistan_time)
+    
+    @staticmethod
+    def filename_for(digest):
+        """Return the path of a blob relative to UPLOAD_FOLDER (what Document.filename holds)"""
+        return f"{Blob.DIRECTORY}/{digest[:2]}/{digest}"
+    
+    @staticmethod
+    def digest_from_filename(filename):
+        """Return the digest of a blob path, or None if filename isn't a blob"""
+        parts = filename.split('/')
+        if len(parts) == 3 and parts[0] == Blob.DIRECTORY and len(parts[2]) == 64:
+            return parts[2]
+        return None
+    
+    @property
+    def filename(self):
+        return Blob.filename_for(self.digest)
+    
+    def __repr__(self):
+        return f'<Blob {self.digest[:12]} x{self.ref_count}>'
+
+class IndexingTask(db.Model):
+    """A pending change to the search index, applied in batches by the background indexer"""
+    __tablename__ = 'indexing_tasks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: removal tasks outlive the document row
+    document_id = db.Column(db.Integer, nullable=False, index=True)
+    action = db.Column(db.String(16), nullable=False)  # 'index' or 'remove'
+    created_at = db.Column(db.DateTime, default=get_pakistan_time)
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)  # Set when the task failed; failed tasks are not retried
+    
+    def __repr__(self):
+        return f'<IndexingTask {self.action} {self.document_id}>'
+
+class IndexManifest(db.Model):
+    """The state of a document's file when it was last indexed, used by the incremental index sync"""
+    __tablename__ = 'index_manifest'
+    
+    # No foreign key: entries for deleted documents are cleaned up by the sync
+    document_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the indexed bytes
+    size = db.Column(db.Integer, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+    indexed_at = db.Column(db.DateTime, default=get_pakistan_time)
+    
+    @staticmethod
+    def record(document_id, state):
+        """Add or update the entry for a document that was just indexed"""
+        entry = IndexManifest.query.get(document_id)
+        if entry is None:
+            entry = IndexManifest(document_id=document_id)
+            db.session.add(entry)
+        entry.content_hash = state['content_hash']
+        entry.size = state['size']
+        entry.mtime = state['mtime']
+        entry.indexed_at = get_pakistan_time()
+        return entry
+    
+    def matches_stat(self, stat):
+        """True if the file looks untouched since it was indexed (same size and mtime)"""
+        return self.size == stat.st_size and self.mtime == stat.st_mtime
+    
+    def __repr__(self):
+        return f'<IndexManifest {self.document_id}>'
+
+class UserWord(db.Model):
+    """A word of a user's custom dictionary"""
+    __tablename__ = 'user_words'
+    # Also the index for reading a user's words
+    __table_args__ = (db.UniqueConstraint('user_id', 'word', name='uq_user_words_user_word'),)
+    
+    MAX_LENGTH = 64
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    word = db.Column(db.String(MAX_LENGTH), nullable=False)  # Lowercase, as the spell checker compares
+    created_at = db.Column(db.DateTime, default=get_pakistan_time)
+    
+    @staticmethod
+    def words_of(user_id):
+        """Return a user's words, in one query"""
+        return list(db.session.execute(db.select(UserWord.word).where(UserWord.user_id == user_id)
+                                       .order_by(UserWord.word)).scalars())
+    
+    @staticmethod
+    def add(user_id, words):
+        """
+        Add words to a user's dictionary, skipping those it has; returns the number added
+        
+        Each word costs a probe of the unique index rather than a read of the
+        whole dictionary, and the new words are inserted in one executemany.
+        The user's dictionary version is bumped if any word was added. The
+        caller commits.
+        """
+        words = {word for word in words if word}
+        existing = set()
+        pending = sorted(words)
+        # Chunked to stay under SQLite's limit on bound parameters
+        for start in range(0, len(pending), 500):
+            existing.update(db.session.execute(
+                db.select(UserWord.word).where(UserWord.user_id == user_id,
+                                               UserWord.word.in_(pending[start:start + 500]))).scalars())
+        
+        new_words = [word for word in pending if word not in existing]
+        if new_words:
+            now = get_pakistan_time()
+            db.session.execute(db.insert(UserWord),
+                               [{'user_id': user_id, 'word': word, 'created_at': now} for word in new_words])
+            UserDictionaryVersion.bump(user_id)
+        return len(new_words)
+    
+    def __repr__(self):
+        return f'<UserWord {self.word}>'
+
+class UserDictionaryVersion(db.Model):
+    """
+    Change counter of a user's custom dictionary
+    
+    Spell checkers cache dictionaries per worker process and compare this
+    (a primary key lookup) to know when theirs is stale.
+    """
+    __tablename__ = 'user_dictionary_versions'
+    
+    # No foreign key: the counter outlives the user, so an id reused by a new user keeps counting up
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    @staticmethod
+    def current(user_id):
+        """Return the version of a user's dictionary, 0 if it never changed"""
+        return db.session.execute(db.select(UserDictionaryVersion.version)
+                                  .where(UserDictionaryVersion.user_id == user_id)).scalar() or 0
+    
+    @staticmethod
+    def bump(user_id):
+        """Count a change to a user's dictionary; returns the new version. The caller commits."""
+        updated = db.session.execute(db.update(UserDictionaryVersion)
+                                     .where(UserDictionaryVersion.user_id == user_id)
+                                     .values(version=UserDictionaryVersion.version + 1)).rowcount
+        if not updated:
+            db.session.add(UserDictionaryVersion(user_id=user_id, version=1))
+            db.session.flush()
+        return UserDictionaryVersion.current(user_id)
+    
     def __repr__(self):
-        return f'<Document {self.original_filename}>' 
\ No newline at end of file
+        return f'<UserDictionaryVersion {self.user_id} v{self.version}>'
@@ -0,0 +1,98 @@
+import sys
+import threading
+from collections import OrderedDict
+
+class SearchResultCache:
+    """
+    LRU cache of rendered search result pages
+
+    Every entry is tagged with the index version it was computed from. A lookup
+    made against a newer version is a miss, so any commit to the index (from
+    this worker or another one) invalidates the cached pages without an
+    explicit flush. Memory use is kept under max_bytes by evicting the least
+    recently used pages.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (index version, results, size)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query_string, **options):
+        """Build a cache key from the normalized query and the search options"""
+        normalized = ' '.join(query_string.split())
+        if options.get('partial_match'):
+            # Partial match terms are lowercased by the n-gram analyzer anyway
+            normalized = normalized.lower()
+        return (normalized,) + tuple(sorted(options.items()))
+
+    @staticmethod
+    def _estimate_size(results):
+        """Rough size in bytes of a list of result dicts"""
+        size = sys.getsizeof(results)
+        for result in results:
+            size += sys.getsizeof(result)
+            for value in result.values():
+                size += sys.getsizeof(value)
+        return size
+
+    def get(self, key, version):
+        """Return the cached results for key, or None if missing or stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, results):
+        """Cache results computed at the given index version"""
+        if self.max_bytes <= 0:
+            return
+
+        size = self._estimate_size(results)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._entries[key] = (version, results, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every cached page"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return hit/miss counters and memory use for the admin dashboard"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+# Shared by every request in this worker process
+result_cache = SearchResultCache()
@@ -1,30 +1,107 @@
 import os
 import re
-from whoosh.index import create_in, open_dir, exists_in
-from whoosh.fields import Schema, TEXT, ID, DATETIME, STORED, KEYWORD
+import json
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, Counter, defaultdict
+from contextlib import contextmanager
+from whoosh.index import create_in, open_dir, exists_in, clean_files, LockError, TOC
+from whoosh.filedb.filestore import FileStorage
+from whoosh.fields import Schema, TEXT, ID, DATETIME, STORED, KEYWORD, NGRAMWORDS, NUMERIC
 from whoosh.qparser import QueryParser, OrGroup, MultifieldParser, WildcardPlugin, FuzzyTermPlugin
-from whoosh.analysis import StemmingAnalyzer, LowercaseFilter, StandardAnalyzer
-from whoosh.highlight import Highlighter, ContextFragmenter
+from whoosh.analysis import StemmingAnalyzer, LowercaseFilter, StandardAnalyzer, RegexTokenizer, Token
+from whoosh.highlight import Highlighter, ContextFragmenter, PinpointFragmenter, BasicFragmentScorer, top_fragments, FIRST
 from whoosh.query import Wildcard, Prefix, And, Or, Term
+from whoosh.query.spans import SpanQuery, SpanWrappingMatcher, Span
+from whoosh.matching import NullMatcher, IntersectionMatcher
+from whoosh.util import make_binary_tree
+from whoosh.idsets import BitSet
+from whoosh.collectors import WrappingCollector, CollapseCollector
+from whoosh.sorting import FacetType, ColumnCategorizer
+from whoosh.reading import SegmentReader
+from whoosh.writing import OPTIMIZE, NO_MERGE, SegmentWriter
 from flask import current_app
+from markupsafe import escape
+from app.result_cache import result_cache
+from app.text_window import FileTextWindow, FileText, build_checkpoints, passage_ranges
+from app.compression import blob_size
+from app.analysis import StreamingTEXT, StreamingStemmingAnalyzer, StreamingNgramWordAnalyzer, \
+    StreamingCodeTEXT, StreamingCodeAnalyzer, StreamingWordAnalyzer
 from datetime import datetime
 import pytz
 
 # Define a custom analyzer that includes stemming and lowercase handling
 custom_analyzer = StemmingAnalyzer() | LowercaseFilter()
 
+# The same analysis for the content fields, which also accept a FileText so
+# that large files are tokenized as a stream instead of one string
+content_analyzer = StreamingStemmingAnalyzer()
+
+# N-gram size for the infix fields used by partial matching. Query terms
+# shorter than NGRAM_SIZE fall back to a wildcard scan of the lexicon; longer
+# ones are looked up as their overlapping grams (see InfixQuery)
+NGRAM_SIZE = 3
+
+# Plain word analyzer used to find the words containing a partial match term
+# when building snippets (the same words the n-gram fields were built from)
+substring_analyzer = RegexTokenizer() | LowercaseFilter()
+
 # Define the schema for our index
-# Make sure fields that are intended for searching have proper analyzers
+# Make sure fields that are intended for searching have proper analyzers.
+# Each distinct content is indexed once as a 'content' entry. Each document
+# gets a small 'document' entry (name, owner, date) that points at its
+# content by hash. A duplicate upload therefore only adds a document entry,
+# and the document entries are the content -> owners mapping used by search.
+# A content larger than INDEX_PASSAGE_BYTES is indexed as one entry per passage
+# of the file, so scoring, highlighting and memory depend on the passage size
+# rather than the file size
 schema = Schema(
+    kind=ID(stored=True),  # 'content' or 'document'
+    content_hash=ID(stored=True),  # SHA-256 of the content, on both kinds
     doc_id=ID(stored=True),
-    filename=TEXT(analyzer=custom_analyzer, stored=True),
+    filename=TEXT(analyzer=custom_analyzer, stored=True),  # Stored file of a content entry
     original_filename=TEXT(analyzer=custom_analyzer, stored=True),
-    content=TEXT(analyzer=custom_analyzer, stored=True),
+    # chars=True records the character offsets of every term so snippets are
+    # cut around the match positions instead of re-analyzing the text. The text
+    # itself isn't stored: snippet windows are read from the uploaded file
+    content=StreamingTEXT(analyzer=content_analyzer, chars=True),
+    # The text of source code and config files goes here instead of into
+    # content: identifiers are split into their parts and nothing is stemmed
+    code=StreamingCodeTEXT(analyzer=StreamingCodeAnalyzer(), chars=True),
+    content_length=STORED,  # Length of the content (passage) in characters
+    content_checkpoints=STORED,  # Character to byte offset table for non-ASCII files
+    # The content hash again, on content entries only: the key passages are collapsed on in results
+    passage_of=ID(sortable=True),
+    passage_start=NUMERIC(stored=True, bits=64),  # Byte offset of the passage in the file
+    passage_end=STORED,  # Byte offset just past the passage
     upload_date=STORED,  # Changed back to STORED to avoid datetime parsing issues
     upload_date_iso=STORED,  # ISO format for client-side date processing
-    user_id=KEYWORD(stored=True)  # Change from STORED to KEYWORD for searchability
+    user_id=KEYWORD(stored=True),  # Change from STORED to KEYWORD for searchability
+    # Infix fields: every word is split into n-grams at index time so that
+    # substring queries are a direct term lookup instead of a *term* wildcard.
+    # The position of a content gram is its character offset, which is enough
+    # to line grams up and highlight them without the chars format
+    content_ngrams=StreamingTEXT(analyzer=StreamingNgramWordAnalyzer(NGRAM_SIZE)),
+    filename_ngrams=NGRAMWORDS(minsize=NGRAM_SIZE, maxsize=NGRAM_SIZE),
+    # The words of the text as written (content is stemmed), without positions: not searched,
+    # its lexicon and document frequencies are the vocabulary of "did you mean" suggestions
+    words=StreamingTEXT(analyzer=StreamingWordAnalyzer(), phrase=False)
 )
 
+# Fields searched by a partial match term, paired with their n-gram field
+PARTIAL_MATCH_FIELDS = {
+    'content': 'content_ngrams',
+    'original_filename': 'filename_ngrams',
+}
+
+# Fields holding the text of a content entry, one per kind of file (see text_field_for)
+TEXT_FIELDS = ('content', 'code')
+
+# Fields whose postings carry character offsets into the content text (see has_char_offsets)
+SNIPPET_FIELDS = TEXT_FIELDS + ('content_ngrams',)
+
 def format_date_pakistan_time(date_obj):
     """Format date in Pakistan Standard Time with more user-friendly format"""
     if isinstance(date_obj, str):
@@ -42,10 +119,8 @@ def format_date_pakistan_time(date_obj):
     pk_time = date_obj.astimezone(pk_timezone)
     return pk_time.strftime('%b %d, %Y %I:%M %p') + ' (PKT)'
 
-def init_index():
-    """Initialize the search index if it doesn't exist"""
-    index_dir = current_app.config['WHOOSH_INDEX_DIR']
-    
+def open_or_create_index(index_dir):
+    """Open the index in index_dir, creating the directory and index if needed"""
     if not os.path.exists(index_dir):
         os.makedirs(index_dir)
     
@@ -54,44 +129,815 @@ def init_index():
     else:
         return open_dir(index_dir)
 
-def add_document_to_index(document, content):
+class IndexManager:
+    """
+    Keeps index handles and a pool of searchers open for the life of the worker
+    
+    Whoosh searchers must not be shared between threads, so each request checks
+    one out of the pool and hands it back when done. A pooled searcher is only
+    refreshed when a newer index generation has been committed, which is a
+    directory listing rather than a full reopen of the index.
+    """
+    
+    def __init__(self, max_idle_searchers=8, max_filter_sets=256):
+        self.max_idle_searchers = max_idle_searchers
+        self.max_filter_sets = max_filter_sets
+        self._lock = threading.Lock()
+        self._indexes = {}  # index_dir -> open Index
+        self._idle_searchers = {}  # index_dir -> list of idle searchers
+        self._filter_sets = {}  # index_dir -> (generation, OrderedDict of (field, value) -> BitSet)
+    
+    def get_index(self, index_dir):
+        """Return the open index for index_dir, opening it on first use"""
+        index = self._indexes.get(index_dir)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(index_dir)
+                if index is None:
+                    index = open_or_create_index(index_dir)
+                    self._indexes[index_dir] = index
+        return index
+    
+    @contextmanager
+    def searcher(self, index_dir):
+        """Check out an up-to-date searcher for index_dir"""
+        index = self.get_index(index_dir)
+        
+        with self._lock:
+            idle = self._idle_searchers.get(index_dir)
+            searcher = idle.pop() if idle else None
+        
+        if searcher is None:
+            searcher = index.searcher()
+        elif not searcher.up_to_date():
+            # Reuses the segment readers that are still part of the index
+            searcher = searcher.refresh()
+        
+        try:
+            yield searcher
+        finally:
+            with self._lock:
+                idle = self._idle_searchers.setdefault(index_dir, [])
+                if len(idle) < self.max_idle_searchers:
+                    idle.append(searcher)
+                    searcher = None
+            if searcher is not None:
+                searcher.close()
+    
+    def filter_set(self, index_dir, searcher, fieldname, value):
+        """
+        Return the set of document numbers where fieldname == value, as a BitSet
+        
+        The sets are cached per index generation: every searcher at the same
+        generation numbers documents the same way, so a set is built once and
+        then reused until a commit lands and searchers are refreshed.
+        """
+        return self._cached_set(index_dir, searcher, (fieldname, value),
+                                lambda: searcher.docs_for_query(Term(fieldname, value)))
+    
+    def owner_set(self, index_dir, searcher, user_id):
+        """
+        Return the document numbers of the entries visible to user_id, as a BitSet
+        
+        That is the user's document entries plus the content entries they
+        point at. Ownership lives in the index, so the set is cached per
+        generation like the other filter sets.
+        """
+        def build():
+            documents = self.filter_set(index_dir, searcher, "user_id", str(user_id))
+            if "kind" not in searcher.schema:
+                # Index built before content was deduplicated: one entry per document
+                return documents
+            hashes = {searcher.stored_fields(docnum)['content_hash'] for docnum in documents}
+            contents = set()
+            if hashes:
+                contents = searcher.docs_for_query(And([Term("kind", "content"),
+                                                        Or([Term("content_hash", h) for h in hashes])]))
+            return set(documents) | set(contents)
+        
+        return self._cached_set(index_dir, searcher, ("owner", str(user_id)), build)
+    
+    def owner_counts(self, index_dir, searcher, user_id=None):
+        """
+        Return how many documents share each content, as a Counter by content_hash
+        
+        Only the documents visible to user_id are counted, or every document if
+        it is None. A hit on a content is listed once for each of them, so
+        search totals and pages are counted from this; it is cached per
+        generation like the filter sets.
+        """
+        def build():
+            if user_id is None:
+                documents = self.filter_set(index_dir, searcher, "kind", "document")
+            else:
+                documents = self.filter_set(index_dir, searcher, "user_id", str(user_id))
+            return Counter(searcher.stored_fields(docnum)['content_hash'] for docnum in documents)
+        
+        return self._cached(index_dir, searcher, ("owner_counts", str(user_id)), build)
+    
+    def _cached_set(self, index_dir, searcher, key, build):
+        """Return the BitSet for key at the searcher's generation, building it with build() if needed"""
+        return self._cached(index_dir, searcher, key,
+                            lambda: BitSet(build(), size=searcher.doc_count_all()))
+    
+    def _cached(self, index_dir, searcher, key, build):
+        """Return the value for key at the searcher's generation, building it with build() if needed"""
+        generation = searcher.reader().generation()
+        
+        with self._lock:
+            cached_generation, sets = self._filter_sets.get(index_dir, (None, None))
+            if sets is not None and cached_generation == generation and key in sets:
+                sets.move_to_end(key)
+                return sets[key]
+        
+        docset = build()
+        
+        # An empty index has no generation to cache against
+        if generation is None:
+            return docset
+        
+        with self._lock:
+            cached_generation, sets = self._filter_sets.get(index_dir, (None, None))
+            if sets is None or generation > cached_generation:
+                sets = OrderedDict()
+                self._filter_sets[index_dir] = (generation, sets)
+            elif generation < cached_generation:
+                # A searcher that hasn't been refreshed yet; don't cache its numbering
+                return docset
+            sets[key] = docset
+            while len(sets) > self.max_filter_sets:
+                sets.popitem(last=False)
+        
+        return docset
+    
+    def version(self, index_dir):
+        """
+        Return a cheap token for the latest committed state of the index
+        
+        Every commit writes a new TOC generation, so the token changes whenever
+        any worker commits. The TOC timestamp tells apart a rebuilt index whose
+        generation numbers started over.
+        """
+        index = self.get_index(index_dir)
+        return (index_dir, index.latest_generation(), index.last_modified())
+
+# Index handles are shared by every request in this worker process
+index_manager = IndexManager()
+
+def init_index():
+    """Return the search index, creating it if it doesn't exist"""
+    return index_manager.get_index(current_app.config['WHOOSH_INDEX_DIR'])
+
+def get_searcher():
+    """Check out a pooled searcher for the search index (use as a context manager)"""
+    return index_manager.searcher(current_app.config['WHOOSH_INDEX_DIR'])
+
+def text_field_for(original_filename):
+    """Return the field the text of a file is indexed in: 'code' for CODE_EXTENSIONS, else 'content'"""
+    extension = original_filename.rsplit('.', 1)[-1].lower() if '.' in original_filename else ''
+    return 'code' if extension in current_app.config['CODE_EXTENSIONS'] else 'content'
+
+def content_fields(content_hash, filename, content, text_field='content'):
+    """
+    Build the index fields for a distinct content or one passage of it
+    
+    content is a string or a FileText; a FileText limited to a byte range
+    of the file is indexed as the passage at that range. The text goes into
+    text_field ('content' or 'code').
+    """
+    if isinstance(content, FileText):
+        content_length, content_checkpoints = content.measure()
+        passage_start = content.start
+        passage_end = content.end if content.end is not None else blob_size(content.path)
+    else:
+        content_length, content_checkpoints = len(content), build_checkpoints(content)
+        passage_start, passage_end = 0, len(content.encode('utf-8'))
+    
+    fields = dict(
+        kind='content',
+        content_hash=content_hash,
+        filename=filename,
+        content_length=content_length,
+        content_checkpoints=content_checkpoints,
+        passage_of=content_hash,
+        passage_start=passage_start,
+        passage_end=passage_end,
+        content_ngrams=content,
+        words=content
+    )
+    fields[text_field] = content
+    return fields
+
+def content_entries(content_hash, filename, content, passage_bytes=0, text_field='content'):
+    """
+    Yield the index fields for each passage of a content
+    
+    A FileText is split into passages of at most passage_bytes bytes (see
+    passage_ranges); a string, or passage_bytes 0, gives a single entry.
+    """
+    if not isinstance(content, FileText) or not passage_bytes:
+        yield content_fields(content_hash, filename, content, text_field)
+        return
+    
+    for start, end in passage_ranges(content.path, passage_bytes):
+        yield content_fields(content_hash, filename, FileText(content.path, start, end, content.errors), text_field)
+
+def document_fields(document, content_hash):
+    """Build the index fields for a document that owns the given content"""
+    # Format the date for display
+    formatted_date = format_date_pakistan_time(document.upload_date)
+    
+    return dict(
+        kind='document',
+        content_hash=content_hash,
+        doc_id=str(document.id),
+        original_filename=document.original_filename,
+        upload_date=formatted_date,
+        upload_date_iso=document.upload_date.isoformat() if hasattr(document.upload_date, 'isoformat') else '',
+        user_id=str(document.user_id),
+        filename_ngrams=document.original_filename
+    )
+
+def index_writer(timeout=5.0, merge=True):
+    """
+    Open a writer on the search index, waiting up to timeout seconds for the write lock
+    
+    Its commit merges segments with TieredMergePolicy rather than Whoosh's
+    default policy, or not at all without merge: indexing batches leave
+    merging to merge_if_needed() so that they don't wait for it.
+    """
+    config = current_app.config
+    writer = MergeRecordingWriter(init_index(), timeout=timeout, limitmb=config['INDEX_WRITER_MEMORY_MB'])
+    if merge:
+        writer.mergetype = tiered_merge_policy()
+    else:
+        writer.mergetype = NO_MERGE
+    return writer
+
+def tiered_merge_policy():
+    """Return the TieredMergePolicy for the current index and settings"""
+    config = current_app.config
+    return TieredMergePolicy(config['WHOOSH_INDEX_DIR'], config['INDEX_MERGE_FACTOR'],
+                             config['INDEX_MERGE_MAX_DELETED'])
+
+class TieredMergePolicy:
+    """
+    Whoosh merge policy that merges segments of similar size in tiers
+    
+    Segments are grouped into tiers by entry count (1-9, 10-99, 100-999, ...
+    for a factor of 10). Once a tier holds factor segments they are merged
+    into one segment of the next tier, so the number of segments grows with
+    the logarithm of the index size and an entry is rewritten about once per
+    tier. A segment whose share of deleted entries reaches max_deleted is
+    rewritten to drop them. The writer calls it at commit with the current
+    segments; it returns the segments to keep. The merge is only recorded
+    (record()) once the commit has succeeded.
+    """
+    
+    def __init__(self, index_dir, factor=10, max_deleted=0.25):
+        self.index_dir = index_dir
+        self.factor = max(2, factor)
+        self.max_deleted = max_deleted
+        self.merged = None  # Status of the merge of the commit in progress
+    
+    def tier(self, segment):
+        entries = segment.doc_count_all()
+        tier = 0
+        while entries >= self.factor:
+            entries //= self.factor
+            tier += 1
+        return tier
+    
+    def plan(self, segments):
+        """Split segments into (segments to merge, segments to keep)"""
+        tiers = {}
+        to_merge = []
+        for segment in segments:
+            if segment.deleted_count() and segment.deleted_count() >= segment.doc_count_all() * self.max_deleted:
+                to_merge.append(segment)
+            else:
+                tiers.setdefault(self.tier(segment), []).append(segment)
+        
+        keep = []
+        for tier_segments in tiers.values():
+            if len(tier_segments) >= self.factor:
+                to_merge.extend(tier_segments)
+            else:
+                keep.extend(tier_segments)
+        return to_merge, keep
+    
+    def __call__(self, writer, segments):
+        started = time.time()
+        to_merge, keep = self.plan(segments)
+        if not to_merge:
+            return segments
+        
+        for segment in to_merge:
+            reader = SegmentReader(writer.storage, writer.schema, segment)
+            writer.add_reader(reader)
+            reader.close()
+        
+        self.merged = dict(started_at=started, segments_before=len(segments), segments_after=len(keep) + 1,
+                           deleted_before=sum(segment.deleted_count() for segment in segments),
+                           deleted_after=sum(segment.deleted_count() for segment in keep))
+        return keep
+    
+    def record(self):
+        """Record the merge of the commit that just succeeded, if it merged anything"""
+        if self.merged is not None:
+            write_merge_status(self.index_dir, state='finished', kind='tiered', finished_at=time.time(),
+                               **self.merged)
+            self.merged = None
+
+class MergeRecordingWriter(SegmentWriter):
+    """SegmentWriter that records the tiered merge of its commit once the commit has succeeded"""
+    
+    def commit(self, *args, **kwargs):
+        super().commit(*args, **kwargs)
+        if isinstance(self.mergetype, TieredMergePolicy):
+            self.mergetype.record()
+
+class IndexUpdate:
+    """
+    Adds and removes documents through one writer, indexing each distinct content once
+    
+    Content that is already in the index (or was added earlier in the same
+    update) is not read or analyzed again; only the document entry is
+    written. finish() deletes content entries whose last owner was removed.
+    """
+    
+    def __init__(self, writer, passage_bytes=None):
+        self.writer = writer
+        self.passage_bytes = current_app.config['INDEX_PASSAGE_BYTES'] if passage_bytes is None else passage_bytes
+        # The index as it was before this update; the writer's own additions aren't visible to it
+        self.before = writer.searcher()
+        self.added_content = set()
+        self.owners_added = set()  # Hashes that gained a document in this update
+        self.touched = set()  # Hashes that lost a document in this update
+        self.removed = set()  # Document ids whose previous entry was deleted
+    
+    def has_content(self, content_hash):
+        """True if the content is in the index"""
+        return (content_hash in self.added_content
+                or self.before.document_number(kind='content', content_hash=content_hash) is not None)
+    
+    def remove(self, document_id):
+        """Delete the entry of a document"""
+        previous = self.before.document(kind='document', doc_id=str(document_id))
+        if previous is not None:
+            self.touched.add(previous['content_hash'])
+        self.writer.delete_by_term('doc_id', str(document_id))
+        self.removed.add(str(document_id))
+    
+    def add(self, document, content_hash, read_content):
+        """
+        Add or replace the entry of a document with the given content
+        
+        read_content is only called if the content isn't indexed yet. If it
+        raises, the index is left unchanged for this document. The same
+        content uploaded under another extension shares the entry analyzed
+        for the first document's file type.
+        """
+        if not self.has_content(content_hash):
+            content = read_content()
+            for fields in content_entries(content_hash, document.filename, content, self.passage_bytes,
+                                          text_field_for(document.original_filename)):
+                self.writer.add_document(**fields)
+            self.added_content.add(content_hash)
+        
+        self.remove(document.id)
+        self.writer.add_document(**document_fields(document, content_hash))
+        self.owners_added.add(content_hash)
+    
+    def finish(self):
+        """Delete the content entries that no document uses any more"""
+        for content_hash in self.touched - self.owners_added:
+            owners = {fields['doc_id'] for fields in self.before.documents(kind='document', content_hash=content_hash)}
+            if not owners - self.removed:
+                self.writer.delete_by_query(And([Term('kind', 'content'), Term('content_hash', content_hash)]))
+        self.before.close()
+
+def add_document_to_index(document, content_hash, read_content):
     """Add or update a document in the search index"""
-    index = init_index()
-    
-    with index.writer() as writer:
-        # First, try to delete any existing document with the same ID
-        writer.delete_by_term('doc_id', str(document.id))
-        
-        # Format the date for display
-        formatted_date = format_date_pakistan_time(document.upload_date)
-        
-        # Then add the document to the index
-        writer.add_document(
-            doc_id=str(document.id),
-            filename=document.filename,
-            original_filename=document.original_filename,
-            content=content,
-            upload_date=formatted_date,
-            upload_date_iso=document.upload_date.isoformat() if hasattr(document.upload_date, 'isoformat') else '',
-            user_id=str(document.user_id)
-        )
+    with index_writer() as writer:
+        update = IndexUpdate(writer)
+        update.add(document, content_hash, read_content)
+        update.finish()
 
 def remove_document_from_index(document_id):
     """Remove a document from the index"""
-    index = init_index()
+    with index_writer() as writer:
+        update = IndexUpdate(writer)
+        update.remove(document_id)
+        update.finish()
+
+def build_partial_match_query(schema, term):
+    """
+    Build a substring query for a term from the n-gram fields
+    
+    Each word of the term must be contained in a single word of the field
+    (see InfixQuery). Returns None if the term has no word long enough to
+    produce an n-gram, in which case the caller should fall back to a
+    wildcard query.
+    """
+    words = [token.text for token in substring_analyzer(term) if len(token.text) >= NGRAM_SIZE]
+    if not words:
+        return None
     
-    with index.writer() as writer:
-        writer.delete_by_term('doc_id', str(document_id))
+    subqueries = []
+    for fieldname, ngram_field in PARTIAL_MATCH_FIELDS.items():
+        # Without character offsets in the postings, matches are checked against the stored field
+        stored_field = None if has_char_offsets(schema, ngram_field) else fieldname
+        subqueries.append(And([InfixQuery(ngram_field, word, stored_field) if len(word) > NGRAM_SIZE
+                               else Term(ngram_field, word) for word in words]))
+    
+    return Or(subqueries)
+
+class InfixQuery(SpanQuery):
+    """
+    Matches the documents where a word longer than NGRAM_SIZE is part of a single word
+    
+    The word is looked up as the And of its n-grams, which also matches
+    documents where the grams come from different words ("hello" in "the
+    shell and the cello"). Each candidate is therefore checked for the grams
+    lining up into the whole word: from the character offsets in the
+    postings, or, for n-gram fields without them, by looking for the word in
+    stored_field.
+    """
+    
+    def __init__(self, fieldname, word, stored_field=None):
+        self.fieldname = fieldname
+        self.word = word
+        self.stored_field = stored_field
+        # (offset in the word, gram) of every gram of the word, the same ones the field indexed
+        self.grams = [(offset, word[offset:offset + NGRAM_SIZE])
+                      for offset in range(len(word) - NGRAM_SIZE + 1)]
+        self.q = And([Term(fieldname, gram) for gram in sorted({gram for _, gram in self.grams})])
+    
+    def __repr__(self):
+        return "%s(%r, %r, %r)" % (self.__class__.__name__, self.fieldname, self.word, self.stored_field)
+    
+    def __eq__(self, other):
+        return (other and self.__class__ is other.__class__ and self.fieldname == other.fieldname
+                and self.word == other.word and self.stored_field == other.stored_field)
+    
+    def __hash__(self):
+        return hash((self.__class__.__name__, self.fieldname, self.word, self.stored_field))
+    
+    def is_leaf(self):
+        return False
+    
+    def children(self):
+        return self.q.children()
+    
+    def field(self):
+        return self.fieldname
+    
+    def estimate_size(self, ixreader):
+        return self.q.estimate_size(ixreader)
+    
+    def estimate_min_size(self, ixreader):
+        return self.q.estimate_min_size(ixreader)
+    
+    def matcher(self, searcher, context=None):
+        terms = {}
+        for term in self.q.children():
+            matcher = term.matcher(searcher, context)
+            if not matcher.is_active():
+                return NullMatcher()
+            terms[term.text] = matcher
+        if self.stored_field is not None:
+            return StoredInfixMatcher(terms, searcher, self.stored_field, self.word)
+        return InfixMatcher(terms, self.grams, len(self.word))
+
+def span_startchar(span):
+    """Return the character offset of a span of an n-gram field (see has_char_offsets)"""
+    return span.start if span.startchar is None else span.startchar
+
+class InfixMatcher(SpanWrappingMatcher):
+    """Matches where the character offsets of the grams line up into the word"""
+    
+    def __init__(self, terms, grams, length):
+        self.terms = terms
+        self.grams = grams
+        self.length = length
+        SpanWrappingMatcher.__init__(self, make_binary_tree(IntersectionMatcher, list(terms.values())))
+    
+    def copy(self):
+        return self.__class__({text: matcher.copy() for text, matcher in self.terms.items()},
+                              self.grams, self.length)
+    
+    def replace(self, minquality=0):
+        if not self.is_active():
+            return NullMatcher()
+        return self
+    
+    def supports_block_quality(self):
+        # Skipping blocks would hand out documents that weren't checked
+        return False
+    
+    def _get_spans(self):
+        # Character offsets at which the word could start, narrowed down gram by gram
+        starts = None
+        for offset, gram in self.grams:
+            gram_starts = {span_startchar(span) - offset for span in self.terms[gram].spans()}
+            starts = gram_starts if starts is None else starts & gram_starts
+            if not starts:
+                return []
+        return [Span(0, startchar=start, endchar=start + self.length) for start in sorted(starts)]
+
+class StoredInfixMatcher(InfixMatcher):
+    """Matches where the stored text of the field contains the word"""
+    
+    def __init__(self, terms, searcher, stored_field, word):
+        self.searcher = searcher
+        self.stored_field = stored_field
+        self.word = word
+        InfixMatcher.__init__(self, terms, [], len(word))
+    
+    def copy(self):
+        return self.__class__({text: matcher.copy() for text, matcher in self.terms.items()},
+                              self.searcher, self.stored_field, self.word)
+    
+    def _get_spans(self):
+        text = self.searcher.stored_fields(self.id()).get(self.stored_field, '').lower()
+        start = text.find(self.word)
+        if start == -1:
+            return []
+        return [Span(0, startchar=start, endchar=start + self.length)]
+
+def highlight_partial_matches(text, substrings, fragmenter, formatter, top=5):
+    """Highlight every word in text that contains one of the substrings"""
+    def mark_matches(tokens):
+        for token in tokens:
+            token.matched = any(substring in token.text for substring in substrings)
+            yield token
+    
+    tokens = mark_matches(substring_analyzer(text, chars=True, mode="query", removestops=False))
+    fragments = fragmenter.fragment_tokens(text, tokens)
+    fragments = top_fragments(fragments, top, BasicFragmentScorer(), FIRST)
+    return formatter(text, fragments)
+
+def document_entry_count(index_dir, searcher):
+    """Return the number of documents in the index (not counting the content entries)"""
+    if "kind" not in searcher.schema:
+        return searcher.doc_count()
+    return len(index_manager.filter_set(index_dir, searcher, "kind", "document"))
+
+def index_document_counts(user_id=None):
+    """
+    Return (documents in the index, documents uploaded by user_id) from the index reader
+    
+    Both numbers are cheap: they come from the cached filter sets for the
+    current index generation.
+    """
+    index_dir = current_app.config['WHOOSH_INDEX_DIR']
+    with get_searcher() as searcher:
+        total = document_entry_count(index_dir, searcher)
+        user_count = 0
+        if user_id is not None:
+            user_count = len(index_manager.filter_set(index_dir, searcher, "user_id", str(user_id)))
+    return total, user_count
+
+def open_document_text(hit):
+    """
+    Return the text of a hit for building snippets
+    
+    Indexes built before the content stopped being stored return the stored
+    text; otherwise a window reader over the uploaded file (or over the
+    passage the hit is) is returned. Returns an empty string if the file is gone.
+    """
+    if 'content' in hit:
+        return hit['content']
+    
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], hit['filename'])
+    try:
+        return FileTextWindow(file_path, hit.get('content_length', 0), hit.get('content_checkpoints'),
+                              start=hit.get('passage_start', 0), end=hit.get('passage_end'))
+    except OSError:
+        return ''
+
+def index_size(index_dir=None):
+    """Return the total size in bytes of the search index files"""
+    index_dir = index_dir or current_app.config['WHOOSH_INDEX_DIR']
+    if not os.path.exists(index_dir):
+        return 0
+    return sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir)
+               if os.path.isfile(os.path.join(index_dir, name)))
+
+def index_needs_rebuild():
+    """Check if the index was built with an older schema and should be rebuilt"""
+    with get_searcher() as searcher:
+        if set(searcher.schema.names()) != set(schema.names()) or searcher.schema['content'].stored:
+            return True
+        # N-grams of several sizes, each with its character offsets in the chars format
+        if searcher.schema['content_ngrams'].supports("characters"):
+            return True
+        # Identifier parts indexed at one position, matched with AND instead of as a phrase
+        return searcher.schema['code'].multitoken_query != schema['code'].multitoken_query
+
+def has_char_offsets(schema, fieldname):
+    """
+    Whether the postings of a field give the character offsets of its terms
+    
+    The text fields have them in the chars format. The content n-gram field
+    has each gram's offset as its position (see GramOffsetFilter), or in the
+    chars format in indexes built before that.
+    """
+    field = schema[fieldname]
+    if field.supports("characters"):
+        return True
+    return fieldname == 'content_ngrams' and field.supports("positions")
+
+def collect_match_spans(searcher, hit):
+    """
+    Return the character spans of the terms that matched a hit, read from the postings
+    
+    Returns a (term spans, n-gram runs) pair. Overlapping n-gram matches are
+    merged into runs; the caller checks which runs really contain a partial
+    match term.
+    """
+    spans = {fieldname: [] for fieldname in SNIPPET_FIELDS}
+    for fieldname, btext in hit.matched_terms():
+        if fieldname not in spans or not has_char_offsets(searcher.schema, fieldname):
+            continue
+        postings = searcher.postings(fieldname, btext)
+        postings.skip_to(hit.docnum)
+        if not postings.is_active() or postings.id() != hit.docnum:
+            continue
+        if searcher.schema[fieldname].supports("characters"):
+            spans[fieldname].extend((startchar, endchar)
+                                    for _, startchar, endchar in postings.value_as("characters"))
+        else:
+            # An n-gram's position is its character offset (see GramOffsetFilter)
+            length = len(btext.decode('utf-8'))
+            spans[fieldname].extend((pos, pos + length) for pos in postings.value_as("positions"))
+    
+    return [span for fieldname in TEXT_FIELDS for span in spans[fieldname]], merge_spans(spans['content_ngrams'])
+
+def merge_spans(spans):
+    """Merge overlapping or touching (startchar, endchar) spans"""
+    merged = []
+    for startchar, endchar in sorted(spans):
+        if merged and startchar <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], endchar)
+        else:
+            merged.append([startchar, endchar])
+    return merged
+
+def matching_passages(searcher, query, hit, limit):
+    """
+    Return the best passages of the content of hit that match query, in file order
+    
+    Results keep only the top passage of each content, so the others that
+    also match are found with a search restricted to that content's passages.
+    """
+    content_hash = hit['content_hash']
+    if searcher.doc_frequency('passage_of', content_hash) <= 1:
+        return [hit]
+    
+    passages = list(searcher.search(query, limit=limit, terms=True, filter=Term('passage_of', content_hash)))
+    if not passages:
+        return [hit]
+    return sorted(passages, key=lambda passage: passage['passage_start'])
+
+class PassageHits(WrappingCollector):
+    """
+    Goes under a CollapseCollector: applies the user filter and counts the hits the collapse takes back
+    
+    Whoosh's FilterCollector hands documents past a CollapseCollector, so
+    the filter is applied to the matches here instead. When a better passage
+    of a content turns up, the collapse removes the one it kept before, but
+    the wrapped collector still counts both; removed is the difference.
+    """
+    
+    def __init__(self, child, allow=None):
+        WrappingCollector.__init__(self, child)
+        self.allow = allow
+    
+    def prepare(self, top_searcher, q, context):
+        WrappingCollector.prepare(self, top_searcher, q, context)
+        self.removed = 0
+    
+    def matches(self):
+        if self.allow is None:
+            return self.child.matches()
+        return (sub_docnum for sub_docnum in self.child.matches() if self.offset + sub_docnum in self.allow)
+    
+    def remove(self, global_docnum):
+        self.removed += 1
+        return self.child.remove(global_docnum)
+
+class ContentFacet(FacetType):
+    """
+    Collapse key shared by every entry of a content: its passages and the documents that own it
+    
+    Collapsing on it keeps one hit per content, so a document whose name and
+    text both match isn't listed twice. Content entries are keyed from the
+    passage_of column; the few document entries that match (on their name)
+    from their stored content_hash.
+    """
+    
+    def categorizer(self, global_searcher):
+        return ContentCategorizer(global_searcher)
+
+class ContentCategorizer(ColumnCategorizer):
+    def __init__(self, global_searcher):
+        ColumnCategorizer.__init__(self, global_searcher, 'passage_of')
+    
+    def set_searcher(self, segment_searcher, docoffset):
+        ColumnCategorizer.set_searcher(self, segment_searcher, docoffset)
+        self.segment_searcher = segment_searcher
+    
+    def key_for(self, matcher, segment_docnum):
+        key = self._creader.sort_key(segment_docnum)
+        if not key:
+            # Entries from before content was deduplicated have no content_hash and are never collapsed
+            key = self.segment_searcher.stored_fields(segment_docnum).get('content_hash', '').encode('utf-8')
+        return key
+
+def content_owners(searcher, content_hash, user_filter=None):
+    """Return the stored fields of the document entries for a content, limited to user_filter if given"""
+    return [searcher.stored_fields(docnum)
+            for docnum in searcher.document_numbers(kind='document', content_hash=content_hash)
+            if user_filter is None or docnum in user_filter]
+
+def matching_entries(searcher, query, content_hashes, user_filter=None):
+    """
+    Return the entries of each content that match query, as lists of hits by content_hash
+    
+    A content whose best hit is a document entry stands for every document
+    with the content when its text matches too, otherwise only for the
+    documents matching by name; one search over those contents tells which.
+    """
+    entries = defaultdict(list)
+    if not content_hashes:
+        return entries
+    hits = searcher.search(query, limit=None, terms=True,
+                           filter=Or([Term('content_hash', content_hash) for content_hash in content_hashes]))
+    for hit in hits:
+        if user_filter is None or hit.docnum in user_filter:
+            entries[hit['content_hash']].append(hit)
+    return entries
+
+def hit_owner_count(content_hash, name_entries, owner_counts):
+    """Return how many documents a hit on a content is listed for (see matching_entries)"""
+    entries = name_entries.get(content_hash)
+    if entries and all('doc_id' in entry for entry in entries):
+        return len(entries)
+    return owner_counts[content_hash]
+
+def pinpoint_highlight(searcher, hit, text, partial_terms, fragmenter, formatter, top=5):
+    """
+    Build a snippet from the stored match offsets of a hit
+    
+    Only the windows around the matches are sliced out of text, which can be
+    any object supporting len() and slicing.
+    """
+    term_spans, ngram_spans = collect_match_spans(searcher, hit)
+    
+    tokens = [Token(startchar=startchar, endchar=endchar, boost=1.0, matched=True)
+              for startchar, endchar in term_spans]
+    for startchar, endchar in ngram_spans:
+        run = text[startchar:endchar].lower()
+        for term in partial_terms:
+            offset = run.find(term)
+            while offset != -1:
+                tokens.append(Token(startchar=startchar + offset, endchar=startchar + offset + len(term),
+                                    boost=1.0, matched=True))
+                offset = run.find(term, offset + 1)
+    
+    if not tokens:
+        return ''
+    
+    # Keep the longest match at each position so nested spans aren't highlighted twice
+    tokens.sort(key=lambda token: (token.startchar, -token.endchar))
+    merged = []
+    for token in tokens:
+        if merged and token.startchar < merged[-1].endchar:
+            merged[-1].endchar = max(merged[-1].endchar, token.endchar)
+        else:
+            merged.append(token)
+    
+    fragments = fragmenter.fragment_matches(text, merged)
+    fragments = top_fragments(fragments, top, BasicFragmentScorer(), FIRST)
+    return formatter.format(fragments)
 
 def search_documents(query_string, limit=20, user_id=None, partial_match=True, case_sensitive=False, 
-                    allow_multiple_results_per_doc=True, max_snippets_per_doc=5):
+                    allow_multiple_results_per_doc=True, max_snippets_per_doc=5, page=1):
     """
     Search for documents matching the query string
     
+    Only the top page * limit hits are collected, and only the hits on the
+    requested page are highlighted, so the cost of a page doesn't grow with the
+    number of matching documents. Results are cached per index version, so
+    repeated searches are served from memory until the next commit.
+    
     Args:
         query_string (str): The search query
-        limit (int): Maximum number of results to return
-        user_id (int): Optional filter by user ID. If None, searches all documents
+        limit (int): Number of results per page
+        page (int): Page number to return, starting at 1
+        user_id (int): Optional filter by uploader user ID. If None, searches all documents
         partial_match (bool): Whether to allow partial matches (default True)
         case_sensitive (bool): Whether the search is case sensitive (default False)
         allow_multiple_results_per_doc (bool): Whether to return multiple entries for a document (default True)
@@ -103,44 +949,130 @@ def search_documents(query_string, limit=20, user_id=None, partial_match=True, c
     if not query_string:
         return []
     
-    # Get the index but don't try to force commit - let Whoosh handle its own commits
-    index = init_index()
+    key = result_cache.make_key(query_string, limit=limit, user_id=user_id, partial_match=partial_match,
+                                allow_multiple_results_per_doc=allow_multiple_results_per_doc,
+                                max_snippets_per_doc=max_snippets_per_doc, page=page)
+    version = index_manager.version(current_app.config['WHOOSH_INDEX_DIR'])
+    
+    documents = result_cache.get(key, version)
+    if documents is None:
+        documents = _search_documents(query_string, limit, user_id, partial_match,
+                                      allow_multiple_results_per_doc, max_snippets_per_doc, page)
+        result_cache.put(key, version, documents)
     
-    with index.searcher() as searcher:
+    return documents
+
+def _search_documents(query_string, limit, user_id, partial_match, allow_multiple_results_per_doc,
+                      max_snippets_per_doc, page):
+    """Run a search against the index (see search_documents)"""
+    # Use a pooled searcher; it is refreshed only if a new commit has landed
+    with get_searcher() as searcher:
+        # The searcher's schema comes from its reader, so this doesn't re-read the TOC
+        schema = searcher.schema
+        
         # Set up the query parser to search only in fields that have text formats
         # Only search in content and original_filename fields, not in STORED fields
-        searchable_fields = ["content", "original_filename", "filename"]
-        parser = MultifieldParser(searchable_fields, index.schema, group=OrGroup)
+        # (indexes built before the code field existed don't have it)
+        searchable_fields = [field for field in TEXT_FIELDS + ("original_filename", "filename") if field in schema]
+        parser = MultifieldParser(searchable_fields, schema, group=OrGroup)
         
         # Add plugins for fuzzy and wildcard searching if partial matching is enabled
+        partial_terms = []
         if partial_match:
             parser.add_plugin(FuzzyTermPlugin())
             parser.add_plugin(WildcardPlugin())
             
-            # Add wildcards to search terms for partial matching if they don't already have them
+            # Indexes built before the n-gram fields existed still use wildcards
+            use_infix = all(field in schema for field in PARTIAL_MATCH_FIELDS.values())
+            
             terms = query_string.split()
+            subqueries = []
             enhanced_terms = []
             
+            # Identifiers and their parts in code files are whole terms of the code
+            # field, so get_user_by_id also finds getUserById through a phrase of its parts
+            code_parser = QueryParser("code", schema) if "code" in schema else None
+            
             for term in terms:
                 if not any(char in term for char in ['*', '?', '~']):
-                    # Add wildcard before and after term for partial matching
-                    enhanced_terms.append(f"*{term}*")
+                    if code_parser is not None:
+                        subqueries.append(code_parser.parse(term))
+                    infix_query = build_partial_match_query(schema, term) if use_infix else None
+                    if infix_query is not None:
+                        # Resolve the substring through the n-gram fields
+                        subqueries.append(infix_query)
+                        partial_terms.extend(token.text for token in substring_analyzer(term)
+                                             if len(token.text) >= NGRAM_SIZE)
+                    else:
+                        # Add wildcard before and after term for partial matching
+                        enhanced_terms.append(f"*{term}*")
                 else:
                     enhanced_terms.append(term)
             
-            query_string = " OR ".join(enhanced_terms)
+            if enhanced_terms:
+                subqueries.append(parser.parse(" OR ".join(enhanced_terms)))
+            query = Or(subqueries)
+        else:
+            # Parse the query
+            query = parser.parse(query_string)
         
-        # Parse the query
-        query = parser.parse(query_string)
-        
-        # If user_id is provided, filter results by user_id
+        # If user_id is provided, filter results to the user's documents and their
+        # content using the cached set for that user instead of intersecting postings each time
+        index_dir = current_app.config['WHOOSH_INDEX_DIR']
+        user_filter = None
         if user_id is not None:
-            user_filter = Term("user_id", str(user_id))
-            query = And([query, user_filter])
+            user_filter = index_manager.owner_set(index_dir, searcher, user_id)
+            # Whoosh ignores an empty filter, so stop here when the user has no documents
+            if not user_filter:
+                return []
+        
+        # Collect only the top hits up to the end of the requested page; every hit
+        # lists at least one document, so page * limit hits are always enough
+        page = max(1, page)
+        offset = (page - 1) * limit
+        # terms=True records which terms matched each hit, for pinpoint snippets
+        passages = 'passage_of' in schema
+        if passages:
+            # Keep only the best passage or document entry of each content so that hits are contents
+            filtered = PassageHits(searcher.collector(limit=offset + limit, terms=True), allow=user_filter)
+            collector = CollapseCollector(filtered, ContentFacet())
+            searcher.search_with_collector(query, collector)
+            results = collector.results()
+        else:
+            results = searcher.search(query, limit=offset + limit, terms=True, filter=user_filter)
         
-        # Execute search with a very high limit to ensure we get all matching documents
-        # We'll manage the per-document snippets ourselves
-        results = searcher.search(query, limit=1000)  # Set a very high limit to capture all matches
+        # Use the collector's count when it has one; when the collector skipped
+        # low-scoring blocks, fall back to the estimate from the posting lists
+        # rather than walking every matching document
+        total_is_exact = results.has_exact_length()
+        total_hits = len(results) if total_is_exact else max(results.estimated_length(), results.scored_length())
+        if passages:
+            # Collapsed passages are left out of the count but not out of the estimate
+            collapsed = filtered.removed
+            if not total_is_exact:
+                collapsed += sum(results.collapsed_counts.values())
+            total_hits = max(total_hits - collapsed, results.scored_length())
+        
+        # A hit on a content is listed for every document with that content the
+        # user may see, so pages and the total count documents. The documents
+        # behind each hit come from the owner counts cached per generation, so
+        # the total and the page boundaries are the same on every page
+        owner_counts = index_manager.owner_counts(index_dir, searcher, user_id) if 'kind' in schema else None
+        name_entries = {}
+        if passages:
+            best = {content_hash: entries[0][1] for content_hash, entries in collector.lists.items()}
+            document_entries = index_manager.filter_set(index_dir, searcher, "kind", "document")
+            name_entries = matching_entries(searcher, query, [content_hash for content_hash, docnum in best.items()
+                                                              if docnum in document_entries], user_filter)
+            # Entries from before content was deduplicated have no key and count once
+            total_hits = (max(total_hits, len(best)) - len(best)
+                          + sum(hit_owner_count(content_hash, name_entries, owner_counts) for content_hash in best))
+        elif owner_counts is not None:
+            # Without collapsing only the collected content entries can be expanded
+            extra_owners = sum(owner_counts[result['content_hash']] - 1 for result in results if 'doc_id' not in result)
+            total_hits += extra_owners
+            total_is_exact = total_is_exact and (not extra_owners or results.scored_length() == len(results))
+        page_count = max(1, (total_hits + limit - 1) // limit)
         
         # Configure highlighter for context snippets - use larger context and better formatting
         from whoosh.highlight import HtmlFormatter
@@ -150,92 +1082,501 @@ def search_documents(query_string, limit=20, user_id=None, partial_match=True, c
         fragmenter = ContextFragmenter(surround=60)  # Increase context size around matches
         results.fragmenter = fragmenter
         
+        # Indexes with character offsets build snippets from the match positions;
+        # older indexes fall back to re-tokenizing the stored content
+        pinpoint = all(has_char_offsets(schema, field) for field in SNIPPET_FIELDS if field in schema)
+        pinpoint_fragmenter = PinpointFragmenter(maxchars=200, surround=60, autotrim=True, charlimit=None)
+        
         documents = []
         doc_counter = {}  # Track how many times we've seen each document
-        unique_docs = set()  # Track unique document IDs
+        position = 0  # Documents listed for the hits before this one
         
         for result in results:
-            doc_id = result['doc_id']
-            unique_docs.add(doc_id)  # Keep track of unique document IDs
-            
-            # If we don't want multiple results per document, check if we've already seen this one
-            if not allow_multiple_results_per_doc and doc_id in doc_counter:
+            if position >= offset + limit:
+                break
+            if passages and 'content_hash' in result:
+                owner_count = hit_owner_count(result['content_hash'], name_entries, owner_counts)
+            elif owner_counts is not None and 'doc_id' not in result:
+                owner_count = owner_counts[result['content_hash']]
+            else:
+                owner_count = 1
+            # Skip the hits listed on earlier pages; a hit can span two pages
+            first_owner = max(0, offset - position)
+            position += owner_count
+            if position <= offset:
                 continue
             
-            # If we want multiple results but have reached the max for this document, skip
-            if doc_id in doc_counter and doc_counter[doc_id] >= max_snippets_per_doc:
-                continue
+            if 'doc_id' in result:
+                # A document entry (matched on its name), or an entry from an
+                # index built before content was deduplicated
+                owners = [result.fields()]
+                content_hit = None
+                if passages and 'content_hash' in result:
+                    # The other entries of this content were collapsed into this hit
+                    entries = name_entries[result['content_hash']]
+                    content_hits = [entry for entry in entries if 'doc_id' not in entry]
+                    if content_hits:
+                        owners = content_owners(searcher, result['content_hash'], user_filter)
+                        content_hit = content_hits[0]
+                    else:
+                        owners = [entry.fields() for entry in entries]
+                    # The opening of the file, for the snippet
+                    content = searcher.document(kind='content', content_hash=result['content_hash'], passage_start=0)
+                elif 'content_hash' in result:
+                    content = searcher.document(kind='content', content_hash=result['content_hash'])
+                else:
+                    content = result.fields()
+                    # Only content entries have match positions to build snippets from
+                    content_hit = result if 'kind' not in schema else None
+            else:
+                # A content match: report it for every document with this content
+                # that the user may see
+                owners = content_owners(searcher, result['content_hash'], user_filter)
+                content = result.fields()
+                content_hit = result
             
-            # Increment the counter for this document
-            doc_counter[doc_id] = doc_counter.get(doc_id, 0) + 1
+            owners = owners[first_owner:first_owner + limit - len(documents)]
+            owners = [owner for owner in owners if owner['doc_id'] not in doc_counter]
+            if not owners:
+                continue
             
-            # Get the highlights for this document
+            # Get the highlights for this content
             # The top parameter controls the number of separate fragments to extract
             # Set it higher to get more fragments
             highlight_count = max_snippets_per_doc  # Always try to get maximum number of snippets
-            snippet = result.highlights("content", top=highlight_count)
+            if content_hit is None:
+                passage_hits = []
+            elif passages:
+                passage_hits = matching_passages(searcher, query, content_hit, highlight_count)
+            else:
+                passage_hits = [content_hit]
+            # When several passages match, each contributes its best fragment
+            top = highlight_count if len(passage_hits) == 1 else 1
+            
+            snippets = []
+            for passage_hit in passage_hits:
+                text = open_document_text(passage_hit.fields())
+                try:
+                    if pinpoint:
+                        snippet = pinpoint_highlight(searcher, passage_hit, text, partial_terms,
+                                                     pinpoint_fragmenter, formatter, top=top)
+                    else:
+                        snippet = ''
+                        if partial_terms:
+                            snippet = highlight_partial_matches(text, partial_terms,
+                                                                fragmenter, formatter, top=top)
+                        if not snippet:
+                            snippet = passage_hit.highlights("content", text=text, top=top)
+                finally:
+                    if isinstance(text, FileTextWindow):
+                        text.close()
+                if snippet:
+                    snippets.append(snippet)
+            snippet = formatter.between.join(snippets)
             
             if not snippet:
                 # If no highlight, take the beginning of the content
-                snippet = result["content"][:350] + "..."
+                text = open_document_text(content) if content is not None else ''
+                try:
+                    snippet = escape(text[:350]) + "..."
+                finally:
+                    if isinstance(text, FileTextWindow):
+                        text.close()
             
-            # Create a result entry for this document/snippet
-            documents.append({
-                'id': doc_id,
-                'filename': result['original_filename'],
-                'snippet': snippet,
-                'score': result.score,
-                'upload_date': result['upload_date'],
-                'occurrence_number': doc_counter[doc_id],  # Add occurrence number
-                'match_terms': query_string  # Include the search terms for reference
-            })
-            
-            # Only limit total results if we're not trying to show all matching documents
-            if len(documents) >= limit * 2 and not allow_multiple_results_per_doc:
-                break
+            for owner in owners:
+                doc_id = owner['doc_id']
+                doc_counter[doc_id] = 1
+                
+                # Create a result entry for this document/snippet
+                documents.append({
+                    'id': doc_id,
+                    'filename': owner['original_filename'],
+                    'snippet': snippet,
+                    'score': result.score,
+                    'upload_date': owner['upload_date'],
+                    'occurrence_number': doc_counter[doc_id],  # Add occurrence number
+                    'match_terms': query_string  # Include the search terms for reference
+                })
+        else:
+            # The hits ran out on this page, so every matching document has been
+            # counted and the total is exact rather than an estimate
+            if results.scored_length() < offset + limit:
+                total_hits = position
+                total_is_exact = True
+                page_count = page
         
-        # Add a summary of total matches at the top-level
-        total_docs_in_system = len(Document.query.all()) if 'Document' in globals() else 0
+        # Add a summary of total matches at the top-level. The number of documents
+        # searched comes from the cached document sets, not the database
+        if user_id is not None:
+            total_docs_in_system = len(index_manager.filter_set(index_dir, searcher, "user_id", str(user_id)))
+        else:
+            total_docs_in_system = document_entry_count(index_dir, searcher)
         
         for doc in documents:
             doc['total_matches_in_doc'] = doc_counter.get(doc['id'], 0)
-            doc['total_unique_docs'] = len(unique_docs)
+            doc['total_unique_docs'] = total_hits
+            doc['total_is_exact'] = total_is_exact
+            doc['page'] = page
+            doc['page_count'] = page_count
             doc['total_docs_in_system'] = total_docs_in_system
         
         return documents
 
-def rebuild_index():
-    """Rebuild the entire search index (admin function)"""
-    from app.models import Document
+def rebuild_status_path(index_dir):
+    """Return the path of the JSON file that tracks rebuild progress"""
+    return index_dir.rstrip(os.sep) + '.rebuild.json'
+
+def write_status_file(path, status):
+    """Record the progress of an index maintenance job where every worker process can read it"""
+    status['pid'] = os.getpid()
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(temp_path, path)
+
+def read_status_file(path):
+    """Return the status recorded by write_status_file, or None if there is none"""
+    try:
+        with open(path) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if status.get('state') == 'running':
+        # A job whose process died (e.g. a server restart) will never finish
+        try:
+            os.kill(status['pid'], 0)
+        except ProcessLookupError:
+            status['state'] = 'interrupted'
+        except (KeyError, OSError):
+            pass
+    return status
+
+def write_rebuild_status(index_dir, **status):
+    """Record rebuild progress where every worker process can read it"""
+    write_status_file(rebuild_status_path(index_dir), status)
+
+def rebuild_status():
+    """Return the progress of the current or last rebuild, or None if there never was one"""
+    return read_status_file(rebuild_status_path(current_app.config['WHOOSH_INDEX_DIR']))
+
+def acquire_write_lock(index, timeout=60.0):
+    """
+    Take the write lock of an index, waiting up to timeout seconds for the current writer
+    
+    While it is held no writer can commit, so the index stays as it is; the
+    caller releases it. Raises LockError if it can't be taken in time.
+    """
+    writelock = index.lock("WRITELOCK")
+    deadline = time.time() + timeout
+    while not writelock.acquire(blocking=False):
+        if time.time() > deadline:
+            raise LockError("The search index is locked by another writer (is a rebuild already running?)")
+        time.sleep(0.5)
+    return writelock
+
+def swap_in_index(index_dir, shadow_dir):
+    """
+    Replace the live index with the one built in shadow_dir
+    
+    The shadow segments are moved into the live directory and a new TOC
+    generation listing only them is written. Writing the TOC is an atomic
+    rename, so readers either see the old index or the new one, and
+    searchers that are already open keep working until they refresh. Must
+    be called while holding the live index write lock.
+    """
+    live = index_manager.get_index(index_dir)
+    shadow_toc = TOC.read(FileStorage(shadow_dir), live.indexname)
+    segment_pattern = TOC._segment_pattern(live.indexname)
+    
+    for filename in os.listdir(shadow_dir):
+        if segment_pattern.match(filename):
+            os.replace(os.path.join(shadow_dir, filename), os.path.join(index_dir, filename))
+    
+    generation = live.latest_generation() + 1
+    TOC(shadow_toc.schema, shadow_toc.segments, generation).write(live.storage, live.indexname)
+    clean_files(live.storage, live.indexname, generation, shadow_toc.segments)
+    shutil.rmtree(shadow_dir, ignore_errors=True)
+
+def rebuild_index(procs=None, read_threads=None):
+    """
+    Rebuild the entire search index (admin function)
+    
+    The new index is built in a shadow directory while the live index keeps
+    serving searches. Files are read by a thread pool and analyzed by a
+    multiprocess writer, once per distinct content. The finished index is
+    swapped in atomically. The live write lock is held throughout, so queued
+    indexing tasks wait and are applied on top of the new index once it is
+    in place. Uploads stored before content-addressed storage are moved into
+    the blob store first.
+    
+    Returns:
+        int: Number of documents indexed
+    """
     from app import db
+    from app.models import Document, IndexManifest
+    from app.storage import migrate_legacy_uploads
     
-    # Delete the existing index
-    index_dir = current_app.config['WHOOSH_INDEX_DIR']
-    if os.path.exists(index_dir):
-        import shutil
-        shutil.rmtree(index_dir)
+    config = current_app.config
+    index_dir = config['WHOOSH_INDEX_DIR']
+    shadow_dir = index_dir.rstrip(os.sep) + '.rebuild'
+    procs = procs or config['REBUILD_PROCS']
+    read_threads = read_threads or config['REBUILD_READ_THREADS']
+    passage_bytes = config['INDEX_PASSAGE_BYTES']
     
-    # Create a new index
-    index = init_index()
+    live = index_manager.get_index(index_dir)
+    # Wait for an in-progress indexing batch to finish
+    writelock = acquire_write_lock(live)
     
-    # Get all documents from the database
-    documents = Document.query.all()
+    started = time.time()
+    size_before = index_size(index_dir)
+    total = Document.query.count()
     indexed_count = 0
+    states = {}
     
-    for document in documents:
+    try:
+        write_rebuild_status(index_dir, state='running', done=0, total=total, started_at=started,
+                             size_before=size_before)
+        
+        migrate_legacy_uploads()
+        
+        # Documents sharing a stored file are read and analyzed once
+        shared_files = OrderedDict()
+        for document in Document.query.all():
+            shared_files.setdefault(document.filename, []).append(document)
+        total = sum(len(owners) for owners in shared_files.values())
+        
+        shutil.rmtree(shadow_dir, ignore_errors=True)
+        os.makedirs(shadow_dir)
+        shadow = create_in(shadow_dir, schema)
+        
+        app = current_app._get_current_object()
+        
+        def prepare(owners):
+            # Runs in a pool thread, which has no application context of its own.
+            # Measuring the file here leaves only the analysis to the writer
+            with app.app_context():
+                document = owners[0]
+                content_hash = document.content_hash
+                if content_hash is None:
+                    # Its file was missing when uploads were moved into the blob store
+                    return owners, None, None
+                try:
+                    stat = os.stat(document.get_file_path())
+                    entries = list(content_entries(content_hash, document.filename,
+                                                   FileText(document.get_file_path()), passage_bytes,
+                                                   text_field_for(document.original_filename)))
+                except Exception as e:
+                    app.logger.error(f"Error reading document {document.id}: {str(e)}")
+                    return owners, None, None
+                state = {'content_hash': content_hash, 'size': stat.st_size, 'mtime': stat.st_mtime}
+                return owners, entries, state
+        
+        limitmb = config['INDEX_WRITER_MEMORY_MB']
+        writer = shadow.writer(procs=procs, multisegment=True, limitmb=limitmb) if procs > 1 \
+            else shadow.writer(limitmb=limitmb)
         try:
-            # Get the file path
-            file_path = document.get_file_path()
-            
-            # Read the content
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                    content = f.read()
-                
-                # Add to index
-                add_document_to_index(document, content)
-                indexed_count += 1
-        except Exception as e:
-            current_app.logger.error(f"Error indexing document {document.id}: {str(e)}")
+            with ThreadPoolExecutor(max_workers=read_threads) as pool:
+                # Submit in chunks so progress can be reported as the rebuild goes
+                chunk_size = read_threads * 4
+                groups = list(shared_files.values())
+                added_content = set()
+                done = 0
+                for start in range(0, len(groups), chunk_size):
+                    for owners, entries, state in pool.map(prepare, groups[start:start + chunk_size]):
+                        done += len(owners)
+                        if entries is None:
+                            continue
+                        content_hash = state['content_hash']
+                        if content_hash not in added_content:
+                            for fields in entries:
+                                writer.add_document(**fields)
+                            added_content.add(content_hash)
+                        for document in owners:
+                            writer.add_document(**document_fields(document, content_hash))
+                            states[document.id] = state
+                            indexed_count += 1
+                    
+                    write_rebuild_status(index_dir, state='running', done=done,
+                                         total=total, started_at=started, size_before=size_before)
+            writer.commit()
+        except Exception:
+            writer.cancel()
+            raise
+        
+        swap_in_index(index_dir, shadow_dir)
+        result_cache.clear()
+        
+        # The manifest now describes exactly what the new index contains
+        IndexManifest.query.delete()
+        for document_id, state in states.items():
+            db.session.add(IndexManifest(document_id=document_id, **state))
+        db.session.commit()
+        
+        elapsed = time.time() - started
+        write_rebuild_status(index_dir, state='finished', done=total, total=total, indexed=indexed_count,
+                             started_at=started, finished_at=time.time(), size_before=size_before,
+                             size_after=index_size(index_dir),
+                             docs_per_sec=indexed_count / elapsed if elapsed else 0.0)
+    except Exception as e:
+        shutil.rmtree(shadow_dir, ignore_errors=True)
+        write_rebuild_status(index_dir, state='failed', done=indexed_count, total=total, started_at=started,
+                             finished_at=time.time(), size_before=size_before, error=str(e))
+        raise
+    finally:
+        writelock.release()
+    
+    return indexed_count
+
+def start_background_rebuild(app):
+    """Run rebuild_index() in a background thread so the admin request returns right away"""
+    def run():
+        with app.app_context():
+            try:
+                rebuild_index()
+            except Exception as e:
+                app.logger.error(f"Index rebuild error: {str(e)}")
+    
+    thread = threading.Thread(target=run, name='index-rebuild', daemon=True)
+    thread.start()
+    return thread
+
+def merge_status_path(index_dir, kind='optimize'):
+    """Return the path of the JSON file that records the last segment merge of a kind ('optimize' or 'tiered')"""
+    return index_dir.rstrip(os.sep) + ('.merge.json' if kind == 'optimize' else '.tiered-merge.json')
+
+def write_merge_status(index_dir, **status):
+    """
+    Record a segment merge where every worker process can read it
+    
+    Tiered merges, which any commit may run, are recorded apart from full
+    merges, so they don't hide when the index was last optimized.
+    """
+    write_status_file(merge_status_path(index_dir, status.get('kind', 'optimize')), status)
+
+def merge_status(kind=None):
+    """
+    Return the current or last segment merge of a kind, or None if there never was one
+    
+    Without kind, a running merge of either kind, else the one started last.
+    """
+    index_dir = current_app.config['WHOOSH_INDEX_DIR']
+    statuses = [status for status in (read_status_file(merge_status_path(index_dir, merge_kind))
+                                      for merge_kind in ([kind] if kind else ['optimize', 'tiered']))
+                if status]
+    if not statuses:
+        return None
+    status = max(statuses, key=lambda status: (status.get('state') == 'running', status.get('started_at', 0)))
+    if status.get('finished_at'):
+        status['finished'] = format_date_pakistan_time(datetime.fromtimestamp(status['finished_at'], pytz.UTC))
+    return status
+
+def index_segment_stats(index_dir=None):
+    """
+    Return the segment count, entry count and deleted entries of the search index
+    
+    Read from the latest TOC, so it reflects every commit, including other workers'.
+    """
+    index_dir = index_dir or current_app.config['WHOOSH_INDEX_DIR']
+    index = index_manager.get_index(index_dir)
+    segments = TOC.read(index.storage, index.indexname).segments
+    entries = sum(segment.doc_count_all() for segment in segments)
+    deleted = sum(segment.deleted_count() for segment in segments)
+    return {
+        'segments': len(segments),
+        'entries': entries,
+        'deleted': deleted,
+        'deleted_ratio': deleted / entries if entries else 0.0,
+    }
+
+def merge_index(optimize=True, timeout=60.0):
+    """
+    Merge the segments of the search index now (admin function and nightly job)
+    
+    With optimize, every segment is merged into one and all deleted entries
+    are dropped; otherwise the tiered policy runs (see merge_if_needed).
+    Searches keep using the old segments until the merge is committed. Does
+    nothing if the index is already a single segment without deletions, or
+    without optimize, if the tiered policy finds nothing to merge.
+    
+    Returns:
+        dict: Segment statistics after the merge
+    """
+    index_dir = current_app.config['WHOOSH_INDEX_DIR']
+    before = index_segment_stats(index_dir)
+    if before['segments'] <= 1 and not before['deleted']:
+        return before
+    
+    kind = 'optimize' if optimize else 'tiered'
+    # Raises LockError if another writer (e.g. a rebuild) doesn't finish in time
+    writer = index_writer(timeout=timeout)
+    if not optimize and not writer.mergetype.plan(writer.segments)[0]:
+        # An empty commit would still be a new generation and empty the search caches
+        writer.cancel()
+        return before
+    started = time.time()
+    write_merge_status(index_dir, state='running', kind=kind, started_at=started,
+                       segments_before=before['segments'], deleted_before=before['deleted'])
+    try:
+        writer.commit(mergetype=OPTIMIZE if optimize else None)
+    except Exception as e:
+        write_merge_status(index_dir, state='failed', kind=kind, started_at=started, finished_at=time.time(),
+                           segments_before=before['segments'], deleted_before=before['deleted'], error=str(e))
+        raise
+    
+    after = index_segment_stats(index_dir)
+    write_merge_status(index_dir, state='finished', kind=kind, started_at=started, finished_at=time.time(),
+                       segments_before=before['segments'], segments_after=after['segments'],
+                       deleted_before=before['deleted'], deleted_after=after['deleted'])
+    return after
+
+def start_background_merge(app):
+    """Run merge_index() in a background thread so the admin request returns right away"""
+    def run():
+        with app.app_context():
+            try:
+                merge_index()
+            except Exception as e:
+                app.logger.error(f"Index merge error: {str(e)}")
+    
+    thread = threading.Thread(target=run, name='index-merge', daemon=True)
+    thread.start()
+    return thread
+
+def merge_if_needed():
+    """
+    Run the tiered merge as a commit of its own, if segments of a tier have piled up
+    
+    Indexing batches commit without merging (see index_writer), so the queue
+    calls this once it has been drained, and a burst of uploads doesn't wait
+    for merges between its batches. Skipped if another process is writing
+    to the index.
+    """
+    try:
+        merge_index(optimize=False, timeout=0)
+    except LockError:
+        return False
+    return True
+
+def optimize_if_due():
+    """
+    Merge the whole index once a night, during the INDEX_OPTIMIZE_HOUR hour
+    
+    Called by the indexing worker between batches. Skipped if an optimize
+    already ran in the last 12 hours, if the index has nothing to merge, or
+    if another process is writing to the index.
+    """
+    hour = current_app.config['INDEX_OPTIMIZE_HOUR']
+    if hour is None or datetime.now().hour != hour:
+        return False
+    
+    status = merge_status('optimize')
+    if (status and status.get('state') in ('running', 'finished')
+            and status.get('started_at', 0) > time.time() - 12 * 3600):
+        return False
     
-    return indexed_count 
\ No newline at end of file
+    try:
+        merge_index(optimize=True, timeout=0)
+    except LockError:
+        return False
+    return True
@@ -0,0 +1,255 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from flask import current_app
+from whoosh.index import TOC, clean_files
+from whoosh.filedb.filestore import FileStorage
+from app import db
+from app.search import init_index, acquire_write_lock
+from app.result_cache import result_cache
+
+# Written last into a snapshot directory; a directory without it is an unfinished snapshot
+SNAPSHOT_INFO = 'snapshot.json'
+
+def snapshot_root():
+    """Return the directory snapshots are kept in"""
+    return current_app.config['SNAPSHOT_DIR']
+
+def index_files(index):
+    """
+    Return (generation, file names) of the current state of an index
+
+    These are the TOC of the latest generation and the files of the segments
+    it lists; older generations and merged-away segments are left out.
+    """
+    toc = TOC.read(index.storage, index.indexname)
+    segment_ids = {segment.segment_id() for segment in toc.segments}
+    toc_pattern = TOC._pattern(index.indexname)
+    segment_pattern = TOC._segment_pattern(index.indexname)
+
+    filenames = []
+    for filename in index.storage.list():
+        toc_match = toc_pattern.match(filename)
+        segment_match = segment_pattern.match(filename)
+        if toc_match and int(toc_match.group(1)) == toc.generation:
+            filenames.append(filename)
+        elif segment_match and segment_match.group(1) in segment_ids:
+            filenames.append(filename)
+    return toc.generation, filenames
+
+def link_or_copy(source, target):
+    """
+    Hard-link source to target, or copy it when they are on different file systems
+
+    Index segment files are written once and never modified (a merge writes
+    new ones), so a link is as good as a copy and costs neither time nor space.
+    Returns True if the file was linked.
+    """
+    try:
+        os.link(source, target)
+        return True
+    except OSError:
+        shutil.copy2(source, target)
+        return False
+
+def sqlite_database_path():
+    """Return the path of the SQLite database file, or None if the database isn't SQLite"""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    return url.database
+
+def backup_database(target_path):
+    """
+    Write a consistent copy of the SQLite database to target_path with SQLite's online backup
+
+    Other connections can keep reading and writing; the copy is the
+    database as of one transaction. Returns False (and copies nothing) for
+    other databases, which should be backed up with their own tools.
+    """
+    if sqlite_database_path() is None:
+        return False
+
+    connection = db.engine.raw_connection()
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            connection.driver_connection.backup(target)
+        finally:
+            target.close()
+    finally:
+        connection.close()
+    return True
+
+def restore_database(source_path):
+    """Overwrite the live SQLite database with the one at source_path, through SQLite's backup API"""
+    db.session.remove()
+    connection = db.engine.raw_connection()
+    try:
+        source = sqlite3.connect(source_path)
+        try:
+            source.backup(connection.driver_connection)
+        finally:
+            source.close()
+    finally:
+        connection.close()
+    # Pooled connections may hold pages cached from the old database
+    db.engine.dispose()
+
+def list_snapshots():
+    """Return the info of every finished snapshot, newest first"""
+    root = snapshot_root()
+    if not os.path.isdir(root):
+        return []
+
+    snapshots = []
+    for name in os.listdir(root):
+        try:
+            with open(os.path.join(root, name, SNAPSHOT_INFO)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(snapshots, key=lambda info: info['created_at'], reverse=True)
+
+def create_snapshot(keep=None, timeout=60.0):
+    """
+    Take a point-in-time snapshot of the search index and the database
+
+    Writes are fenced by holding the index write lock: indexing batches
+    wait (uploads keep being queued), the files of the current index
+    generation are linked into the snapshot and the database is copied with
+    SQLite's online backup. Because tasks are only dequeued after their
+    index commit, every change missing from the index copy is still queued
+    in the database copy and is applied after a restore. The lock is
+    usually held for well under a second, since only new segment files
+    would ever need copying.
+
+    Uploaded files are not part of the snapshot: blobs are immutable and
+    named by their hash, so the upload folder can be copied or synced on
+    its own at any time.
+
+    Older snapshots beyond the newest keep (SNAPSHOT_KEEP if None) are
+    deleted. Returns the info recorded with the snapshot.
+    """
+    config = current_app.config
+    keep = config['SNAPSHOT_KEEP'] if keep is None else keep
+    root = snapshot_root()
+
+    name = datetime.now().strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(os.path.join(root, name)):
+        suffix += 1
+        name = datetime.now().strftime('%Y%m%d-%H%M%S') + f'-{suffix}'
+    target = os.path.join(root, name)
+    partial = target + '.partial'
+    index_target = os.path.join(partial, 'index')
+    os.makedirs(index_target)
+
+    # Segments already in the previous snapshot are linked from there (same file system)
+    previous = list_snapshots()
+    previous_index = os.path.join(root, previous[0]['name'], 'index') if previous else None
+
+    index = init_index()
+    started = time.time()
+    writelock = acquire_write_lock(index, timeout)
+    try:
+        generation, filenames = index_files(index)
+        linked = 0
+        for filename in filenames:
+            source = os.path.join(config['WHOOSH_INDEX_DIR'], filename)
+            if previous_index and os.path.exists(os.path.join(previous_index, filename)):
+                source = os.path.join(previous_index, filename)
+            linked += link_or_copy(source, os.path.join(index_target, filename))
+        has_database = backup_database(os.path.join(partial, 'database.sqlite'))
+        fenced_seconds = time.time() - started
+    except Exception:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    finally:
+        writelock.release()
+
+    info = {
+        'name': name,
+        'created_at': started,
+        'generation': generation,
+        'index_files': len(filenames),
+        'linked_files': linked,
+        'index_bytes': sum(os.path.getsize(os.path.join(index_target, filename)) for filename in filenames),
+        'database': has_database,
+        'fenced_seconds': fenced_seconds,
+    }
+    with open(os.path.join(partial, SNAPSHOT_INFO), 'w') as f:
+        json.dump(info, f)
+    os.rename(partial, target)
+
+    for old in list_snapshots()[max(keep, 1):]:
+        shutil.rmtree(os.path.join(root, old['name']), ignore_errors=True)
+
+    return info
+
+def restore_snapshot(name=None, with_database=True, catch_up=True, timeout=60.0):
+    """
+    Make a snapshot the live index (and database), then catch up with what changed since
+
+    The snapshot's segments are linked into the live index directory and a
+    new TOC generation listing only them is written, the same atomic swap a
+    rebuild ends with, so a running server switches over at its next search.
+    With with_database the database is restored too; do that with the
+    server stopped, or on a new node before it starts. Without it, the
+    index is restored under the current database.
+
+    With catch_up, the index sync then queues whatever the database and the
+    upload folder have that the snapshot lacks (documents uploaded or
+    deleted since, or tasks that were still queued) and the queue is
+    drained, so only those documents are indexed instead of the whole
+    collection.
+
+    name defaults to the newest snapshot. Returns a dict with the snapshot
+    info, the sync report (or None) and the number of index updates applied.
+    """
+    from app.indexing import sync_index, drain_queue
+
+    config = current_app.config
+    snapshots = list_snapshots()
+    if name is not None:
+        snapshots = [info for info in snapshots if info['name'] == name]
+    if not snapshots:
+        raise ValueError(f"No snapshot named {name}" if name else "There are no snapshots")
+    info = snapshots[0]
+    source = os.path.join(snapshot_root(), info['name'])
+    source_index = os.path.join(source, 'index')
+
+    index = init_index()
+    writelock = acquire_write_lock(index, timeout)
+    try:
+        if with_database:
+            if not info['database']:
+                raise ValueError(f"Snapshot {info['name']} has no database copy")
+            if sqlite_database_path() is None:
+                raise ValueError("The database isn't SQLite; restore it with its own tools and pass with_database=False")
+            restore_database(os.path.join(source, 'database.sqlite'))
+
+        toc = TOC.read(FileStorage(source_index), index.indexname)
+        segment_pattern = TOC._segment_pattern(index.indexname)
+        for filename in os.listdir(source_index):
+            target = os.path.join(config['WHOOSH_INDEX_DIR'], filename)
+            if segment_pattern.match(filename) and not os.path.exists(target):
+                link_or_copy(os.path.join(source_index, filename), target)
+
+        generation = index.latest_generation() + 1
+        TOC(toc.schema, toc.segments, generation).write(index.storage, index.indexname)
+        clean_files(index.storage, index.indexname, generation, toc.segments)
+    finally:
+        writelock.release()
+    result_cache.clear()
+
+    report = None
+    applied = 0
+    if catch_up:
+        report = sync_index(apply=True)
+        applied = drain_queue(config['INDEXING_BATCH_SIZE'], timeout=config['INDEXING_LOCK_TIMEOUT'])
+
+    return {'snapshot': info, 'sync': report, 'applied': applied}
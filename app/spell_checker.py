@@ -1,29 +1,212 @@
-from spellchecker import SpellChecker
-from flask import session
-from app.models import User
+import itertools
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from flask import session, current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import User, UserWord, UserDictionaryVersion
+from app.symspell import SpellingIndex, edit_distance
+
+def dictionary_source():
+    """Name of the dictionary the spelling index is built from; an index built from another is rebuilt"""
+    from importlib.metadata import version
+    return f"pyspellchecker-{version('pyspellchecker')}-en"
+
+def _bigrams(word):
+    """The distinct pairs of adjacent characters of a word, with its start and end marked"""
+    padded = f'^{word}$'
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+# Versions of loaded user dictionaries, unique within the process; 0 is the base dictionary alone
+_dictionary_versions = itertools.count(1)
+
+class UserDictionary:
+    """
+    A user's custom words, looked up alongside the shared dictionary
+    
+    Overlays are never merged into the shared dictionary, so one user's
+    words don't change anyone else's suggestions. version changes with
+    every change to the words and keys the memoized results of the overlay.
+    stamp is the user's UserDictionaryVersion the words were loaded at.
+    """
+    
+    def __init__(self, words, stamp=0):
+        self.words = frozenset(word.lower() for word in words if word)
+        self.version = next(_dictionary_versions) if self.words else 0
+        self.stamp = stamp
+        self._by_bigram = None  # bigram -> words, built on first lookup
+        self._by_length = None  # length -> words
+    
+    def with_words(self, words, stamp):
+        return UserDictionary(self.words | set(words), stamp)
+    
+    def near(self, word, limit):
+        """
+        Return the words that may be within limit edits of word, for edit_distance to check
+        
+        An edit changes at most three of a word's bigrams (a transposition),
+        so a word within limit edits has all but 3 * limit of them. Words
+        sharing enough bigrams are counted from an index, so dictionaries of
+        tens of thousands of words aren't scanned; only for words too short
+        for that to rule anything out are the words of similar length
+        scanned, on their letters.
+        """
+        if self._by_bigram is None:
+            by_bigram = {}
+            by_length = {}
+            for custom_word in self.words:
+                for bigram in _bigrams(custom_word):
+                    by_bigram.setdefault(bigram, []).append(custom_word)
+                by_length.setdefault(len(custom_word), []).append(custom_word)
+            self._by_length = by_length
+            self._by_bigram = by_bigram
+        
+        bigrams = _bigrams(word)
+        needed = len(bigrams) - 3 * limit
+        if needed <= 0:
+            # Each edit removes at most one of the word's letters
+            letters = set(word)
+            return [custom_word for length in range(len(word) - limit, len(word) + limit + 1)
+                    for custom_word in self._by_length.get(length, ())
+                    if len(letters.intersection(custom_word)) >= len(letters) - limit]
+        shared = Counter()
+        for bigram in bigrams:
+            shared.update(self._by_bigram.get(bigram, ()))
+        return [custom_word for custom_word, count in shared.items() if count >= needed]
+
+# Results for tokens checked without a user dictionary
+BASE_DICTIONARY = UserDictionary(())
+
+class SpellingMemo:
+    """
+    LRU cache of (user dictionary version, token) -> corrections
+    
+    The spell-check API is called as the user types, so the same tokens are
+    checked over and over. Keys include the version of the user dictionary
+    the result was computed with: a user's results are never served to
+    another user, and adding a word makes the user's old results
+    unreachable (they age out) instead of needing a flush.
+    """
+    
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        """Return (True, corrections) for a cached key, (False, None) otherwise"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+    
+    def put(self, key, corrections):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = corrections
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
 class CustomSpellChecker:
     def __init__(self):
-        self.spell = SpellChecker()
-        self.user_custom_words = {}  # Cache for user custom dictionaries
+        self.index = None  # SpellingIndex, opened (and built if needed) on first use
+        self._index_lock = threading.Lock()
+        self.user_custom_words = {}  # Cache of UserDictionary by user id, checked against the database version
+        self.memo = SpellingMemo()
+    
+    def get_index(self):
+        """
+        Return the spelling index, building it from the pyspellchecker dictionary if needed
+        
+        The index file (SPELLING_INDEX_PATH) is built once, in a few
+        seconds, by init_db.py or on first use, and then only memory-mapped
+        by every process that starts.
+        It is rebuilt when the dictionary it was built from changes.
+        """
+        if self.index is None:
+            with self._index_lock:
+                if self.index is None:
+                    path = current_app.config['SPELLING_INDEX_PATH']
+                    index = SpellingIndex(path) if os.path.exists(path) else None
+                    if index is None or index.source != dictionary_source():
+                        if index is not None:
+                            index.close()
+                        # pyspellchecker itself is only loaded to build the index
+                        from spellchecker import SpellChecker
+                        current_app.logger.info(f"Building the spelling index {path}")
+                        SpellingIndex.build(path, SpellChecker().word_frequency.dictionary, source=dictionary_source())
+                        index = SpellingIndex(path)
+                    self.index = index
+        return self.index
     
     def load_user_dictionary(self, user_id):
-        """Load a user's custom dictionary into the spell checker"""
-        # Return cached dictionary if available
-        if user_id in self.user_custom_words:
-            return self.user_custom_words[user_id]
-            
-        # Get user's custom words from database
-        from app import db
-        user = User.query.get(user_id)
+        """
+        Return a user's custom dictionary as a UserDictionary
         
-        if user:
-            custom_words = user.get_custom_words()
-            self.user_custom_words[user_id] = custom_words
-            return custom_words
+        The cached dictionary is used while the user's dictionary version in
+        the database (one primary key lookup) is the one it was loaded at, so
+        words added through any worker process reach all of them on their
+        next check.
+        """
+        stamp = UserDictionaryVersion.current(user_id)
         
-        return []
+        # Return cached dictionary if it is current
+        dictionary = self.user_custom_words.get(user_id)
+        if dictionary is not None and dictionary.stamp == stamp:
+            return dictionary
+            
+        # Get user's custom words from database
+        dictionary = UserDictionary(UserWord.words_of(user_id), stamp)
+        self.user_custom_words[user_id] = dictionary
+        return dictionary
+    
+    def known(self, word, dictionary=BASE_DICTIONARY):
+        """True if word is in the shared dictionary or the given user dictionary"""
+        return word in dictionary.words or word in self.get_index()
+    
+    def candidates(self, word, dictionary=BASE_DICTIONARY):
+        """
+        Return the closest known words to a misspelled word, most frequent first
         
+        Like pyspellchecker's candidates(): the words one edit away if there
+        are any, else those two edits away, else an empty list. Words of the
+        user dictionary count like words of the shared one.
+        """
+        suggestions = self.get_index().lookup(word)
+        best = edit_distance(word, suggestions[0], 2) if suggestions else 2
+        for custom_word in dictionary.near(word, best):
+            distance = edit_distance(word, custom_word, best)
+            if 0 < distance < best:
+                best = distance
+                suggestions = [custom_word]
+            elif 0 < distance == best and custom_word not in suggestions:
+                suggestions.append(custom_word)
+        return suggestions
+    
+    def corrections(self, word, dictionary=BASE_DICTIONARY):
+        """Return the suggestions for a misspelled word, or None if it is known or there are none"""
+        key = (dictionary.version, word)
+        found, corrections = self.memo.get(key)
+        if not found:
+            corrections = None
+            if not self.known(word, dictionary):
+                corrections = self.candidates(word, dictionary) or None
+            self.memo.put(key, corrections)
+        return corrections
+    
     def check_text(self, text, user_id=None):
         """
         Check spelling in a piece of text
@@ -35,11 +218,8 @@ class CustomSpellChecker:
         # Split text into words
         words = self._tokenize_text(text)
         
-        # Add user custom words if available
-        if user_id:
-            custom_words = self.load_user_dictionary(user_id)
-            for word in custom_words:
-                self.spell.word_frequency.add(word)
+        # Look up user custom words alongside the shared dictionary
+        dictionary = self.load_user_dictionary(user_id) if user_id else BASE_DICTIONARY
         
         # Find misspelled words
         misspelled = {}
@@ -47,40 +227,74 @@ class CustomSpellChecker:
             if not self._is_valid_word(word):
                 continue
                 
-            if not self.spell.known([word]):
-                # Get correction suggestions
-                corrections = self.spell.candidates(word)
-                if corrections:
-                    misspelled[word] = list(corrections)
-        
+            corrections = self.corrections(word, dictionary)
+            if corrections:
+                misspelled[word] = list(corrections)
+                
         return misspelled
     
     def add_to_dictionary(self, word, user_id):
-        """Add a word to the user's custom dictionary"""
-        if not word or not user_id:
+        """
+        Add a word to the user's custom dictionary
+        
+        Words that are never flagged (one character, or with digits) need no
+        entry but are accepted as before. Returns False if there is no such
+        user or the word is longer than UserWord.MAX_LENGTH.
+        """
+        if not word or not user_id or self.unstorable_words([word]):
             return False
             
-        from app import db
-        user = User.query.get(user_id)
+        return self.add_words([word], user_id) is not None
+    
+    def add_words(self, words, user_id):
+        """
+        Add words to the user's custom dictionary
         
-        if user:
-            user.add_custom_word(word)
+        words may be words or lines of text; the tokens worth checking are
+        stored, lowercase. Returns the number of words that were new, or None
+        if there is no such user.
+        """
+        if User.query.get(user_id) is None:
+            return None
+            
+        words = self.dictionary_words(words)
+        try:
+            added = UserWord.add(user_id, words)
+            db.session.commit()
+        except IntegrityError:
+            # Another request added some of the words (or the user's first one) at the same time
+            db.session.rollback()
+            added = UserWord.add(user_id, words)
             db.session.commit()
             
-            # Update cache
-            if user_id in self.user_custom_words:
-                if word not in self.user_custom_words[user_id]:
-                    self.user_custom_words[user_id].append(word)
-            else:
-                self.user_custom_words[user_id] = [word]
+        # Update cache if nobody else changed the dictionary since it was loaded; the
+        # new version leaves the memoized results of the old words behind
+        if added:
+            stamp = UserDictionaryVersion.current(user_id)
+            dictionary = self.user_custom_words.get(user_id)
+            if dictionary is not None and dictionary.stamp == stamp - 1:
+                self.user_custom_words[user_id] = dictionary.with_words(words, stamp)
                 
-            return True
-            
-        return False
+        return added
+    
+    def dictionary_words(self, texts):
+        """Return the set of words of texts that can go in a custom dictionary"""
+        words = set()
+        for text in texts:
+            words.update(word for word in self._tokenize_text(text)
+                         if self._is_valid_word(word) and len(word) <= UserWord.MAX_LENGTH)
+        return words
+    
+    def unstorable_words(self, texts):
+        """Return the set of words of texts that would be flagged but are too long for a custom dictionary"""
+        words = set()
+        for text in texts:
+            words.update(word for word in self._tokenize_text(text)
+                         if self._is_valid_word(word) and len(word) > UserWord.MAX_LENGTH)
+        return words
     
     def _tokenize_text(self, text):
         """Split text into words, ignoring punctuation"""
-        import re
         return re.findall(r'\b\w+\b', text.lower())
     
     def _is_valid_word(self, word):
@@ -95,4 +309,30 @@ class CustomSpellChecker:
         return True
 
 # Initialize the spell checker
-spell_checker = CustomSpellChecker() 
\ No newline at end of file
+spell_checker = CustomSpellChecker()
+
+def migrate_legacy_custom_words():
+    """
+    Move dictionaries kept in the legacy comma-separated users.custom_words column to user_words
+    
+    Words that are never flagged (one character, or with digits) need no
+    entry and are dropped. Words longer than UserWord.MAX_LENGTH can't move:
+    they stay in the legacy column and are logged on every run. Returns the
+    number of users migrated.
+    """
+    migrated = 0
+    for user in User.query.filter(User.custom_words.isnot(None), User.custom_words != '').all():
+        words = user.custom_words.split(',')
+        left = ','.join(sorted(spell_checker.unstorable_words(words)))
+        if left:
+            current_app.logger.warning(f"User {user.id}: {len(left.split(','))} custom word(s) longer than "
+                                       f"{UserWord.MAX_LENGTH} characters kept in users.custom_words: {left}")
+        if left == user.custom_words:
+            continue
+        
+        spell_checker.add_words(words, user.id)
+        user.custom_words = left
+        db.session.commit()
+        migrated += 1
+    
+    return migrated
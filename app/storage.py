@@ -0,0 +1,203 @@
+import codecs
+import hashlib
+import os
+import uuid
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Blob, Document
+from app.text_window import STREAM_CHUNK_BYTES
+from app.compression import compress_file, available_codecs
+
+# A file written by save_upload(), not yet in the blob store
+Upload = namedtuple('Upload', 'temp_path digest size preview')
+
+def blob_path(filename):
+    """Return the absolute path of a stored file given its path relative to UPLOAD_FOLDER"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+
+def save_upload(uploaded_file, preview_chars=500, chunk_size=STREAM_CHUNK_BYTES):
+    """
+    Write an uploaded file to a temporary file in the upload folder in a single streaming pass
+    
+    While the chunks are written they are hashed, checked to be valid UTF-8
+    and the first preview_chars characters are kept for the preview, so the
+    upload is never held in memory or read back.
+    
+    Returns an Upload (temp_path, digest, size, preview). The caller either
+    hands the file to store_blob() or removes it. Raises UnicodeDecodeError
+    (after removing the temporary file) if the file isn't UTF-8 text.
+    """
+    temp_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp')
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+    
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='strict')
+    size = 0
+    preview = ''
+    try:
+        with open(temp_path, 'wb') as f:
+            for chunk in iter(lambda: uploaded_file.stream.read(chunk_size), b''):
+                f.write(chunk)
+                digest.update(chunk)
+                text = decoder.decode(chunk, final=False)
+                if len(preview) <= preview_chars:
+                    preview += text[:preview_chars + 1 - len(preview)]
+                size += len(chunk)
+            text = decoder.decode(b'', final=True)
+            preview += text[:preview_chars + 1 - len(preview)]
+    except Exception:
+        os.remove(temp_path)
+        raise
+    
+    if len(preview) > preview_chars:
+        preview = preview[:preview_chars] + '...'
+    return Upload(temp_path, digest.hexdigest(), size, preview)
+
+def _take_reference(digest, size):
+    """
+    Increment the reference count of a blob, creating its row if needed
+    
+    The increment is one UPDATE, so concurrent uploads don't lose a
+    reference. It also waits on a deletion of the blob in progress (see
+    delete_unused_file): either that deletion then finds the blob in use, or
+    the row is gone and is created again here, with the file.
+    """
+    increment = db.update(Blob).where(Blob.digest == digest).values(ref_count=Blob.ref_count + 1)
+    if not db.session.execute(increment).rowcount:
+        db.session.add(Blob(digest=digest, size=size, ref_count=1))
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # Another upload of the same content created the row first
+            db.session.rollback()
+            db.session.execute(increment)
+    return Blob.query.populate_existing().get(digest)
+
+def compress_upload(temp_path, size):
+    """Compress a file written by save_upload() with BLOB_COMPRESSION, if set; returns the path of the file to store"""
+    codec = current_app.config['BLOB_COMPRESSION']
+    if not codec or not size:
+        return temp_path
+    if codec not in available_codecs():
+        current_app.logger.warning(f"BLOB_COMPRESSION codec {codec!r} is not available; storing the file raw")
+        return temp_path
+    
+    compressed_path = temp_path + '.z'
+    try:
+        compress_file(temp_path, compressed_path, codec, current_app.config['BLOB_FRAME_BYTES'])
+    except Exception:
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)
+        raise
+    os.remove(temp_path)
+    return compressed_path
+
+def store_blob(temp_path, digest, size):
+    """
+    Move a file written by save_upload() into the blob store and take a reference to it
+    
+    If the content is already stored, the temporary file is dropped and the
+    existing blob is shared; the reference taken keeps it from being deleted
+    from then on. With BLOB_COMPRESSION set, a new blob is written
+    compressed (see app.compression). Returns the Blob; the caller commits.
+    """
+    path = blob_path(Blob.filename_for(digest))
+    # Compress before taking the reference: that opens the write transaction, and
+    # compressing a large file inside it would hold up every other writer
+    if not os.path.exists(path):
+        temp_path = compress_upload(temp_path, size)
+    
+    blob = _take_reference(digest, size)
+    if os.path.exists(path):
+        os.remove(temp_path)
+        return blob
+    
+    # Stored raw if the blob was deleted after the check above; readers handle both
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+    return blob
+
+def release_blob(document):
+    """
+    Drop a document's reference to its stored file
+    
+    Returns the path of the file to delete once the transaction is committed
+    (see delete_unused_file), or None if other documents still use it. Files
+    stored before blobs existed belong to a single document.
+    """
+    digest = document.content_hash
+    if digest is None:
+        return document.get_file_path()
+    
+    blob = Blob.query.get(digest)
+    if blob is None:
+        return document.get_file_path()
+    
+    blob.ref_count = Blob.ref_count - 1
+    db.session.flush()
+    db.session.refresh(blob)
+    if blob.ref_count > 0:
+        return None
+    
+    # The row stays, unreferenced, until delete_unused_file() deletes it with the file
+    return document.get_file_path()
+
+def delete_unused_file(path):
+    """
+    Delete a file released by release_blob() unless the same content was uploaded again meanwhile
+    
+    The blob row is deleted only if it is still unreferenced, and the file
+    is removed before that is committed. An upload of the same content
+    increments the same row (see _take_reference), so it either keeps the
+    file from being deleted or waits for the commit and stores the file again.
+    """
+    if path is None:
+        return
+    digest = Blob.digest_from_filename(os.path.relpath(path, current_app.config['UPLOAD_FOLDER']).replace(os.sep, '/'))
+    if digest is None:
+        # A file stored before blobs existed belongs to the one document
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    
+    try:
+        unused = db.delete(Blob).where(Blob.digest == digest, Blob.ref_count == 0)
+        if db.session.execute(unused).rowcount and os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        db.session.rollback()
+        raise
+    db.session.commit()
+
+def migrate_legacy_uploads():
+    """
+    Move files uploaded before blobs existed into the blob store
+    
+    Duplicates among them collapse into one blob. Returns the number of
+    documents migrated.
+    """
+    migrated = 0
+    for document in Document.query.all():
+        if document.content_hash is not None:
+            continue
+        
+        path = document.get_file_path()
+        if not os.path.exists(path):
+            continue
+        
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        
+        # os.replace keeps the mtime, so the index manifest still matches (a blob
+        # rewritten compressed is only marked as touched by the next index sync)
+        blob = store_blob(path, digest.hexdigest(), os.path.getsize(path))
+        document.filename = blob.filename
+        db.session.commit()
+        migrated += 1
+    
+    return migrated
@@ -0,0 +1,277 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app
+from whoosh.query import Term
+from app.search import get_searcher, index_manager, TEXT_FIELDS
+from app.spell_checker import spell_checker
+from app.symspell import deletes, edit_distance
+
+# Field whose lexicon is the suggestion vocabulary (unstemmed words of every content)
+SUGGESTION_FIELD = 'words'
+
+# Query words that are looked up: plain words, not operators, field prefixes or wildcard patterns
+QUERY_WORD = re.compile(r'(?<![\w:*?~])[^\W\d_]+(?![\w:*?~])')
+OPERATORS = {'AND', 'OR', 'NOT', 'ANDNOT', 'ANDMAYBE', 'TO'}
+
+# Fields a query word is searched in, besides the text fields
+NAME_FIELDS = ('original_filename', 'filename')
+
+def usable_term(text):
+    """Terms worth suggesting: words of letters, not identifiers, hashes or numbers"""
+    return 3 <= len(text) <= 32 and text.isalpha()
+
+def searchable_word(searcher, word):
+    """True if a query for word finds a term in any searched field (the text is stemmed, names too)"""
+    reader = searcher.reader()
+    for fieldname in TEXT_FIELDS + NAME_FIELDS:
+        if fieldname not in searcher.schema:
+            continue
+        for text in searcher.schema[fieldname].process_text(word, mode='query'):
+            if (fieldname, text) in reader:
+                return True
+    return False
+
+class Lexicon:
+    """
+    Symmetric-delete dictionary of the terms of an index field, with their document frequencies
+
+    Whoosh segments are immutable, so the terms of a segment are read once,
+    when a searcher first shows it, and forgotten when a merge or rebuild
+    removes it: keeping up with a commit costs reading the lexicon of the
+    new segments only. Terms are grouped by their first prefix_length
+    characters and the deletes are generated per group, since many words
+    share a prefix.
+    """
+
+    def __init__(self, fieldname, max_distance=2, prefix_length=7):
+        self.fieldname = fieldname
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.segments = {}  # segment id -> {term: document frequency}
+        self.frequencies = {}  # term -> document frequency over all segments
+        self._prefixes = {}  # prefix -> set of terms
+        self._deletes = {}  # delete -> set of prefixes
+
+    def update(self, reader):
+        """Catch up with the segments of a reader; returns the number of segments read"""
+        live = {}
+        for leaf, _ in reader.leaf_readers():
+            segment = leaf.segment()
+            if segment is not None:
+                live[segment.segment_id()] = leaf
+
+        for segment_id in [segment_id for segment_id in self.segments if segment_id not in live]:
+            for term, frequency in self.segments.pop(segment_id).items():
+                self._remove(term, frequency)
+
+        added = 0
+        for segment_id, leaf in live.items():
+            if segment_id in self.segments:
+                continue
+            terms = {}
+            if self.fieldname in leaf.schema:
+                field = leaf.schema[self.fieldname]
+                for btext, info in leaf.iter_field(self.fieldname):
+                    text = field.from_bytes(btext)
+                    if usable_term(text):
+                        terms[text] = info.doc_frequency()
+            self.segments[segment_id] = terms
+            for term, frequency in terms.items():
+                self._add(term, frequency)
+            added += 1
+        return added
+
+    def _add(self, term, frequency):
+        if term in self.frequencies:
+            self.frequencies[term] += frequency
+            return
+        self.frequencies[term] = frequency
+        prefix = term[:self.prefix_length]
+        group = self._prefixes.get(prefix)
+        if group is None:
+            group = self._prefixes[prefix] = set()
+            for delete in deletes(prefix, self.max_distance):
+                self._deletes.setdefault(delete, set()).add(prefix)
+        group.add(term)
+
+    def _remove(self, term, frequency):
+        remaining = self.frequencies[term] - frequency
+        if remaining > 0:
+            self.frequencies[term] = remaining
+            return
+        del self.frequencies[term]
+        prefix = term[:self.prefix_length]
+        group = self._prefixes[prefix]
+        group.discard(term)
+        if not group:
+            del self._prefixes[prefix]
+            for delete in deletes(prefix, self.max_distance):
+                prefixes = self._deletes[delete]
+                prefixes.discard(prefix)
+                if not prefixes:
+                    del self._deletes[delete]
+
+    def __contains__(self, term):
+        return term in self.frequencies
+
+    def __len__(self):
+        return len(self.frequencies)
+
+    def lookup(self, word):
+        """
+        Return the terms closest to word, highest document frequency first
+
+        Only terms at the smallest edit distance found (1 up to
+        max_distance) are returned; an empty list if there are none.
+        """
+        probed = set()
+        candidates = set()
+        for distance in range(1, self.max_distance + 1):
+            for delete in deletes(word[:self.prefix_length], distance) - probed:
+                for prefix in self._deletes.get(delete, ()):
+                    candidates |= self._prefixes[prefix]
+                probed.add(delete)
+
+            closest = [term for term in candidates if edit_distance(word, term, distance) == distance]
+            if closest:
+                return sorted(closest, key=lambda term: -self.frequencies[term])
+        return []
+
+class QuerySuggester:
+    """
+    "Did you mean" corrections built from the index's own vocabulary
+
+    One Lexicon per index directory, brought up to date from the searcher
+    before each lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lexicons = {}  # index_dir -> Lexicon
+
+    def lexicon(self, index_dir, searcher):
+        """Return the lexicon of an index, up to date with searcher"""
+        with self._lock:
+            lexicon = self._lexicons.get(index_dir)
+            if lexicon is None:
+                lexicon = self._lexicons[index_dir] = Lexicon(SUGGESTION_FIELD)
+            lexicon.update(searcher.reader())
+            return lexicon
+
+    def suggest(self, index_dir, searcher, query_string, user_filter=None):
+        """
+        Return query_string with its unknown words replaced by the likeliest index terms, or None
+
+        A word is replaced by the term closest to it that has the most
+        documents, so that the corrected query finds the most hits. Only
+        terms of documents that are live and, with user_filter, visible are
+        used, so the corrected query matches something (query words are
+        OR-ed). Words found in any searched field, file names included, are
+        left alone. None when every word is known or no term is close
+        enough.
+        """
+        if SUGGESTION_FIELD not in searcher.schema:
+            return None
+        analyzer = searcher.schema[SUGGESTION_FIELD].analyzer
+        lexicon = self.lexicon(index_dir, searcher)
+        changed = False
+
+        def has_hits(term):
+            for docnum in searcher.docs_for_query(Term(SUGGESTION_FIELD, term)):
+                if user_filter is None or docnum in user_filter:
+                    return True
+            return False
+
+        def correct(match):
+            nonlocal changed
+            word = match.group(0)
+            if word in OPERATORS:
+                return word
+            tokens = [token.text for token in analyzer(word)]
+            if len(tokens) != 1 or not usable_term(tokens[0]):
+                return word  # A stop word or a word too short to correct
+            with self._lock:
+                if tokens[0] in lexicon:
+                    return word
+            if searchable_word(searcher, word):
+                return word
+            with self._lock:
+                candidates = lexicon.lookup(tokens[0])
+            for candidate in candidates:
+                if has_hits(candidate):
+                    changed = True
+                    return candidate
+            return word
+
+        corrected = QUERY_WORD.sub(correct, query_string)
+        return corrected if changed else None
+
+# Lexicons are shared by every request in this worker process
+query_suggester = QuerySuggester()
+
+def suggest_query(query_string, user_id=None):
+    """
+    Return a corrected query that is known to match, or None (see QuerySuggester.suggest)
+
+    With user_id, only terms of that user's documents are suggested, like
+    search_documents restricts the hits.
+    """
+    if not query_string:
+        return None
+    index_dir = current_app.config['WHOOSH_INDEX_DIR']
+    with get_searcher() as searcher:
+        user_filter = None
+        if user_id is not None:
+            user_filter = index_manager.owner_set(index_dir, searcher, user_id)
+            if not user_filter:
+                return None
+        return query_suggester.suggest(index_dir, searcher, query_string, user_filter)
+
+def index_vocabulary(words):
+    """Return which of words a search would find as a term of the index, misspelled or not"""
+    with get_searcher() as searcher:
+        return {word for word in words if searchable_word(searcher, word)}
+
+def check_query(query_string, user_id=None, search_user_id=None):
+    """
+    Return (spelling errors, corrected query) for a search query
+
+    The spelling errors are those of spell_checker.check_text with user_id's
+    dictionary, minus the words the index contains; the corrected query is
+    suggest_query's for the documents search_user_id searches (all if None).
+    """
+    spelling_errors = spell_checker.check_text(query_string, user_id)
+    suggested_query = suggest_query(query_string, search_user_id)
+    if spelling_errors:
+        # Domain terms (names, codes, jargon) the dictionary lacks but the documents have
+        indexed_words = index_vocabulary(spelling_errors)
+        spelling_errors = {word: suggestions for word, suggestions in spelling_errors.items()
+                           if word not in indexed_words}
+    return spelling_errors, suggested_query
+
+# Query checks that overrun their time budget finish here, after the response has gone
+_check_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='query-check')
+
+def check_query_within(budget, query_string, user_id=None, search_user_id=None):
+    """
+    Run check_query, giving up after budget seconds
+
+    Returns its result, or None if it didn't finish in time (the check
+    still completes in the background, warming the spelling caches for the
+    asynchronous request that takes over). A budget of None waits for it.
+    """
+    if budget is None:
+        return check_query(query_string, user_id, search_user_id)
+
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            return check_query(query_string, user_id, search_user_id)
+
+    future = _check_pool.submit(run)
+    try:
+        return future.result(timeout=budget)
+    except TimeoutError:
+        return None
@@ -0,0 +1,217 @@
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+
+# Magic, format version, maximum edit distance, prefix length, number of words,
+# number of delete entries, and a tag naming the dictionary the file was built from
+HEADER = struct.Struct('<4sHBBII32s')
+MAGIC = b'SYMS'
+VERSION = 1
+
+def deletes(word, max_distance):
+    """Return word and every string made by deleting up to max_distance characters from it"""
+    result = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {candidate[:i] + candidate[i + 1:] for candidate in frontier for i in range(len(candidate))}
+        result |= frontier
+    return result
+
+def delete_hash(text):
+    """32-bit hash of a delete; collisions only add candidates that the distance check drops"""
+    return zlib.crc32(text.encode('utf-8'))
+
+def edit_distance(a, b, limit):
+    """
+    Return the edit distance between a and b, or limit + 1 if it exceeds limit
+
+    Insertions, deletions, substitutions and transpositions of adjacent
+    characters count as one edit each, and edits may overlap (Damerau-
+    Levenshtein distance): this is the number of pyspellchecker's edits
+    needed to turn one word into the other.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # A common prefix and suffix don't change the distance; candidates
+    # usually differ from the word in a few characters only
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+    if not a or not b:
+        return len(a) + len(b) if len(a) + len(b) <= limit else limit + 1
+
+    # Lowrance-Wagner: rows and columns are shifted by one to leave room for a border of infinity
+    infinity = len(a) + len(b)
+    table = [[infinity] * (len(b) + 2)] + [[infinity, i] + [0] * len(b) for i in range(len(a) + 1)]
+    table[1] = [infinity] + list(range(len(b) + 1))
+    last_row = {}
+    for i in range(1, len(a) + 1):
+        last_match_column = 0
+        for j in range(1, len(b) + 1):
+            k = last_row.get(b[j - 1], 0)
+            l = last_match_column
+            if a[i - 1] == b[j - 1]:
+                cost = 0
+                last_match_column = j
+            else:
+                cost = 1
+            table[i + 1][j + 1] = min(table[i][j] + cost, table[i + 1][j] + 1, table[i][j + 1] + 1,
+                                      table[k][l] + (i - k - 1) + 1 + (j - l - 1))
+        last_row[a[i - 1]] = i
+    distance = table[len(a) + 1][len(b) + 1]
+    return distance if distance <= limit else limit + 1
+
+class _WordList:
+    """Sequence view of the sorted words of a SpellingIndex as UTF-8 bytes, for bisect"""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index.word_count
+
+    def __getitem__(self, position):
+        return self._index.word_bytes(position)
+
+class SpellingIndex:
+    """
+    Symmetric-delete spelling dictionary (SymSpell) in a memory-mapped file
+
+    For every dictionary word, the strings obtained by deleting up to
+    max_distance characters from its first prefix_length characters are
+    precomputed. Two words within max_distance edits share such a delete,
+    so the candidates for a misspelling are found by generating the deletes
+    of its own prefix (at most 29 for the defaults) and looking each one up,
+    instead of generating and testing every string within two edits of it
+    (tens of thousands for a long word). The cost per word is therefore
+    about constant; only the few candidates found are checked with a real
+    edit distance.
+
+    The file holds the sorted (delete hash << 32 | word number) entries, a
+    table of word offsets and frequencies and the sorted words themselves.
+    It is mapped read-only, so opening it costs nothing, the pages are
+    shared between worker processes and only the parts touched by lookups
+    are ever read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.max_distance, self.prefix_length, self.word_count, entry_count, source = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a spelling index of version {VERSION}")
+        self.source = source.rstrip(b'\0').decode('ascii')
+
+        view = memoryview(self._map)
+        position = HEADER.size
+        self._entries = view[position:position + 8 * entry_count].cast('Q')
+        position += 8 * entry_count
+        self._offsets = view[position:position + 4 * (self.word_count + 1)].cast('I')
+        position += 4 * (self.word_count + 1)
+        self._frequencies = view[position:position + 4 * self.word_count].cast('I')
+        position += 4 * self.word_count
+        self._words_start = position
+        self._words = _WordList(self)
+
+    @staticmethod
+    def build(path, frequencies, max_distance=2, prefix_length=7, source=''):
+        """
+        Write a spelling index for a {word: frequency} dictionary to path
+
+        The file is written under a temporary name and renamed into place,
+        so a process opening path never sees a partial file.
+        """
+        words = sorted(frequencies, key=lambda word: word.encode('utf-8'))
+        entries = set()
+        for number, word in enumerate(words):
+            for delete in deletes(word[:prefix_length], max_distance):
+                entries.add(delete_hash(delete) << 32 | number)
+        entries = array('Q', sorted(entries))
+
+        encoded = [word.encode('utf-8') for word in words]
+        offsets = array('I', [0])
+        for word in encoded:
+            offsets.append(offsets[-1] + len(word))
+        counts = array('I', [min(int(frequencies[word]), 0xFFFFFFFF) for word in words])
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, max_distance, prefix_length, len(words), len(entries),
+                                source.encode('ascii')[:32]))
+            entries.tofile(f)
+            offsets.tofile(f)
+            counts.tofile(f)
+            f.write(b''.join(encoded))
+        os.replace(temp_path, path)
+
+    def word_bytes(self, number):
+        start = self._words_start + self._offsets[number]
+        return self._map[start:self._words_start + self._offsets[number + 1]]
+
+    def word(self, number):
+        return self.word_bytes(number).decode('utf-8')
+
+    def _find(self, word):
+        target = word.encode('utf-8')
+        number = bisect_left(self._words, target)
+        if number < self.word_count and self.word_bytes(number) == target:
+            return number
+        return None
+
+    def __contains__(self, word):
+        return self._find(word) is not None
+
+    def frequency(self, word):
+        """Return the frequency of a dictionary word, or 0 if it isn't one"""
+        number = self._find(word)
+        return self._frequencies[number] if number is not None else 0
+
+    def lookup(self, word, max_distance=None):
+        """
+        Return the dictionary words closest to word, most frequent first
+
+        Only the words at the smallest edit distance found (1 up to
+        max_distance) are returned; an empty list if there are none. word
+        itself is never returned.
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        probed = set()
+        candidates = set()
+        entry_count = len(self._entries)
+        # Closer words are looked for first, with fewer deletes and fewer
+        # candidates to verify; most misspellings are one edit away
+        for distance in range(1, max_distance + 1):
+            for delete in deletes(word[:self.prefix_length], distance) - probed:
+                key = delete_hash(delete)
+                position = bisect_left(self._entries, key << 32)
+                while position < entry_count and self._entries[position] >> 32 == key:
+                    candidates.add(self._entries[position] & 0xFFFFFFFF)
+                    position += 1
+                probed.add(delete)
+
+            closest = []
+            for number in candidates:
+                if edit_distance(word, self.word(number), distance) == distance:
+                    closest.append(number)
+            if closest:
+                closest.sort(key=lambda number: -self._frequencies[number])
+                return [self.word(number) for number in closest]
+        return []
+
+    def close(self):
+        for view in ('_entries', '_offsets', '_frequencies'):
+            if hasattr(self, view):
+                getattr(self, view).release()
+        self._map.close()
+        self._file.close()
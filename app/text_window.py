@@ -0,0 +1,200 @@
+import codecs
+import mmap
+import os
+from app.compression import FramedFile, open_blob, blob_size
+
+# Number of characters between two entries of a document's checkpoint table
+CHECKPOINT_CHARS = 4096
+
+# Bytes read at a time when a file is streamed rather than loaded whole
+STREAM_CHUNK_BYTES = 256 * 1024
+
+class CheckpointBuilder:
+    """
+    Builds the checkpoint table of a text fed to it in pieces
+
+    After the last piece, length is the number of characters and
+    checkpoints() the table build_checkpoints() would return for the whole text.
+    """
+
+    def __init__(self):
+        self.length = 0
+        self.ascii = True
+        self._checkpoints = [0]
+        self._byte_offset = 0
+        self._pending = ''  # Characters since the last checkpoint
+
+    def feed(self, text):
+        self.length += len(text)
+        self.ascii = self.ascii and text.isascii()
+        pending = self._pending + text
+        start = 0
+        while len(pending) - start > CHECKPOINT_CHARS:
+            self._byte_offset += len(pending[start:start + CHECKPOINT_CHARS].encode('utf-8'))
+            self._checkpoints.append(self._byte_offset)
+            start += CHECKPOINT_CHARS
+        self._pending = pending[start:]
+
+    def checkpoints(self):
+        return None if self.ascii else self._checkpoints
+
+def build_checkpoints(content):
+    """
+    Return the byte offset of every CHECKPOINT_CHARS-th character of content
+
+    ASCII text needs no table (character and byte offsets are equal), so None
+    is returned for it.
+    """
+    builder = CheckpointBuilder()
+    builder.feed(content)
+    return builder.checkpoints()
+
+def passage_ranges(path, passage_bytes):
+    """
+    Split a UTF-8 file into passages of at most passage_bytes bytes
+
+    Passages end after the last newline that fits, or after the last space
+    or tab if a line is longer than a passage; only a passage without either
+    is cut mid-word, and then never inside a character. Returns a list of
+    (start, end) byte offsets covering the whole file. With passage_bytes 0
+    the whole file is one passage. Offsets are into the original content of
+    a compressed blob.
+    """
+    size = blob_size(path)
+    if not passage_bytes or size <= passage_bytes:
+        return [(0, size)]
+
+    ranges = []
+    start = 0
+    with open_blob(path) as f:
+        while size - start > passage_bytes:
+            f.seek(start)
+            # One byte more than a passage, to see where the next passage would begin
+            block = f.read(passage_bytes + 1)
+            head = block[:passage_bytes]
+            cut = head.rfind(b'\n') + 1 or max(head.rfind(b' '), head.rfind(b'\t')) + 1
+            if not cut:
+                # Don't start the next passage on a UTF-8 continuation byte (10xxxxxx)
+                cut = passage_bytes
+                while cut > 1 and block[cut] & 0xC0 == 0x80:
+                    cut -= 1
+            ranges.append((start, start + cut))
+            start += cut
+    ranges.append((start, size))
+    return ranges
+
+class FileText:
+    """
+    The text of a UTF-8 file, decoded a chunk at a time when iterated
+
+    Passed to the index instead of the content string so that a large file is
+    never held in memory as one string (see app.analysis). Only the path is
+    kept, so it can be pickled and sent to the processes of a multiprocess
+    writer, and it can be iterated more than once (once per indexed field).
+    start and end limit it to a byte range of the file, such as a passage.
+    Compressed blobs are decompressed as they are read.
+    """
+
+    def __init__(self, path, start=0, end=None, errors='replace'):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.errors = errors
+
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors=self.errors)
+        with open_blob(self.path) as f:
+            f.seek(self.start)
+            remaining = self.end - self.start if self.end is not None else None
+            while remaining is None or remaining > 0:
+                chunk = f.read(STREAM_CHUNK_BYTES if remaining is None else min(STREAM_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                text = decoder.decode(chunk)
+                if text:
+                    yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+    def measure(self):
+        """Return (length in characters, checkpoint table) in one pass over the file"""
+        builder = CheckpointBuilder()
+        for text in self:
+            builder.feed(text)
+        return builder.length, builder.checkpoints()
+
+class FileTextWindow:
+    """
+    Read-only, str-like view of a UTF-8 file that decodes only the slices asked for
+
+    The file is memory-mapped, and character offsets (as recorded in the index)
+    are turned into byte offsets with the checkpoint table built at indexing
+    time, so cutting a snippet out of a multi-megabyte file only decodes a few
+    kilobytes around the match. start and end restrict the view to the bytes
+    of one passage; offsets and checkpoints are then relative to its start.
+    A compressed blob is sliced through its FramedFile instead of a memory
+    map, which decompresses only the frames around the slice.
+    """
+
+    def __init__(self, path, length, checkpoints=None, start=0, end=None):
+        self.length = length
+        self.checkpoints = checkpoints
+        self._file = open_blob(path)
+        if isinstance(self._file, FramedFile):
+            self._size = self._file.size
+            self._map = self._file
+        else:
+            self._size = os.fstat(self._file.fileno()).st_size
+            # mmap can't map an empty file
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else b''
+        self._start = start
+        self._end = self._size if end is None else min(end, self._size)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('FileTextWindow only supports slicing')
+
+        start, stop, step = key.indices(self.length)
+        if start >= stop:
+            return ''
+
+        if self.checkpoints is None:
+            text = self._map[self._start + start:self._start + stop].decode('utf-8', errors='replace')
+        else:
+            # Decode from the checkpoint before start up to the checkpoint after stop
+            first = start // CHECKPOINT_CHARS
+            last = (stop + CHECKPOINT_CHARS - 1) // CHECKPOINT_CHARS
+            byte_start = self._start + self.checkpoints[first]
+            byte_stop = self._start + self.checkpoints[last] if last < len(self.checkpoints) else self._end
+            block = self._map[byte_start:byte_stop].decode('utf-8', errors='replace')
+            offset = first * CHECKPOINT_CHARS
+            text = block[start - offset:stop - offset]
+
+        return text[::step] if step != 1 else text
+
+    def find(self, sub, start=0, end=None):
+        end = self.length if end is None else end
+        index = self[start:end].find(sub)
+        return index + start if index != -1 else -1
+
+    def rfind(self, sub, start=0, end=None):
+        end = self.length if end is None else end
+        index = self[start:end].rfind(sub)
+        return index + start if index != -1 else -1
+
+    def close(self):
+        if self._size and self._map is not self._file:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
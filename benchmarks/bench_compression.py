@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Benchmark compressed blob storage: disk savings against read latency per codec
+
+Usage: python benchmarks/bench_compression.py [--docs N] [--size-kb N] [--frame-kb N] [--reads N]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from common import make_vocabulary, time_calls, summarize
+
+from app.compression import available_codecs, compress_file, blob_size
+from app.text_window import FileText, FileTextWindow
+
+def make_log(size_bytes, vocabulary, rng):
+    """Generate application-log-like text: repetitive structure with some variable fields"""
+    lines = []
+    total = 0
+    while total < size_bytes:
+        line = (f"2024-03-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+                f"{rng.randint(0, 59):02d},{rng.randint(0, 999):03d} "
+                f"{rng.choice(['INFO', 'INFO', 'INFO', 'DEBUG', 'WARN', 'ERROR'])} "
+                f"[worker-{rng.randint(1, 16)}] {rng.choice(vocabulary)}.{rng.choice(vocabulary)} "
+                f"request_id={rng.getrandbits(32):08x} status={rng.choice([200, 200, 200, 304, 404, 500])} "
+                f"elapsed_ms={rng.randint(1, 2000)} user={rng.choice(vocabulary)}\n")
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines)
+
+def run(doc_count, size_kb, frame_kb, read_count):
+    base_dir = tempfile.mkdtemp(prefix='docsearch-bench-')
+    rng = random.Random(7)
+    vocabulary = make_vocabulary(500)
+    
+    sources = []
+    for number in range(doc_count):
+        path = os.path.join(base_dir, f'doc{number}.log')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(make_log(size_kb * 1024, vocabulary, rng))
+        sources.append(path)
+    raw_size = sum(os.path.getsize(path) for path in sources)
+    
+    # Snippet-sized windows (as cut around a match) at random places in the files
+    windows = []
+    for _ in range(read_count):
+        path = rng.choice(sources)
+        start = rng.randrange(max(1, os.path.getsize(path) - 200))
+        windows.append((path, start))
+    
+    print(f"\n{doc_count} log files of {size_kb} KB, frames of {frame_kb} KB, {read_count} snippet windows:")
+    print(f"  {'codec':<8} {'on disk':>10} {'ratio':>7} {'write MB/s':>11} {'full read ms':>13} "
+          f"{'window median':>14} {'window p95':>11}")
+    for codec in ['raw'] + available_codecs():
+        if codec == 'raw':
+            stored = {path: path for path in sources}
+            write_rate = float('inf')
+        else:
+            stored = {}
+            start = time.perf_counter()
+            for path in sources:
+                stored[path] = os.path.join(base_dir, f'{os.path.basename(path)}.{codec}')
+                compress_file(path, stored[path], codec, frame_kb * 1024)
+            write_rate = raw_size / 1024 / 1024 / (time.perf_counter() - start)
+        disk_size = sum(os.path.getsize(path) for path in stored.values())
+        # The index stores each content's length; ASCII text needs no checkpoint table
+        lengths = {path: blob_size(stored[path]) for path in sources}
+        
+        # Streaming the whole file, as a rebuild or a download does
+        def read_whole(path):
+            for _ in FileText(stored[path]):
+                pass
+        full_median, _ = summarize(time_calls(read_whole, [(path,) for path in sources]))
+        
+        # Cutting a window out of a file, as a snippet does
+        def read_window(path, start):
+            with FileTextWindow(stored[path], lengths[path]) as text:
+                text[start:start + 200]
+        window_median, window_p95 = summarize(time_calls(read_window, windows))
+        
+        rate = f"{write_rate:11.1f}" if write_rate != float('inf') else f"{'-':>11}"
+        print(f"  {codec:<8} {disk_size / 1024:8.0f} kB {raw_size / disk_size:6.1f}x {rate} {full_median:13.2f} "
+              f"{window_median:11.3f} ms {window_p95:8.3f} ms")
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--docs', type=int, default=4)
+    arg_parser.add_argument('--size-kb', type=int, default=512)
+    arg_parser.add_argument('--frame-kb', type=int, default=64)
+    arg_parser.add_argument('--reads', type=int, default=200)
+    options = arg_parser.parse_args()
+    
+    run(options.docs, options.size_kb, options.frame_kb, options.reads)
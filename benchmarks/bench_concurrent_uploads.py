@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Stress test simultaneous uploads: lost index updates and throughput with and without the write queue
+
+The baseline is the write path from before the queue: every upload commits
+its own writer, with Whoosh's default merge policy. Without waiting for the
+write lock it loses updates; waiting for it keeps them all, at one commit
+per upload.
+
+Usage: python benchmarks/bench_concurrent_uploads.py [--clients N] [--uploads N] [--words N]
+"""
+import argparse
+import io
+import shutil
+import threading
+import time
+
+from common import make_app, make_vocabulary, make_corpus
+
+from whoosh.index import LockError
+
+def run_clients(client_count, upload, corpus):
+    """Run one thread per client, each uploading its share of the corpus"""
+    shares = [corpus[i::client_count] for i in range(client_count)]
+    errors = []
+    
+    def client(share):
+        try:
+            upload(share)
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=client, args=(share,)) for share in shares]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+def run_mode(label, client_count, corpus, asynchronous, direct, lock_timeout=0):
+    app, base_dir = make_app(INDEXING_ASYNC=asynchronous, INDEXING_BATCH_LATENCY=0.2)
+    
+    with app.app_context():
+        from app import db
+        from app.models import Document
+        from app.search import init_index, IndexUpdate
+        from app.indexing import indexed_document_ids, pending_count, failed_count
+        
+        start_generation = init_index().latest_generation()
+    
+    def upload_direct(share):
+        # The write path before the queue: every upload opens its own writer, waiting
+        # up to lock_timeout seconds for the lock, and commits with the default merge policy
+        with app.app_context():
+            for document, content in share:
+                row = Document(filename=document.filename, original_filename=document.original_filename,
+                               user_id=1)
+                db.session.add(row)
+                db.session.commit()
+                try:
+                    with init_index().writer(timeout=lock_timeout) as writer:
+                        update = IndexUpdate(writer)
+                        update.add(row, str(row.id), lambda: content)
+                        update.finish()
+                except LockError:
+                    # Lost: the document exists but never reaches the index
+                    pass
+    
+    def upload_queued(share):
+        client = app.test_client()
+        client.post('/auth/login', data={'username': 'admin', 'password': 'admin123'})
+        for document, content in share:
+            data = {'documents': (io.BytesIO(content.encode('utf-8')), document.original_filename)}
+            response = client.post('/documents/upload', data=data, content_type='multipart/form-data')
+            assert response.status_code == 302, response.status_code
+    
+    start = time.perf_counter()
+    run_clients(client_count, upload_direct if direct else upload_queued, corpus)
+    responded = time.perf_counter() - start
+    with app.app_context():
+        # Uploads count once they're searchable, and the background worker finishes after the last response
+        while pending_count():
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        
+        commits = init_index().latest_generation() - start_generation
+        document_ids = {document.id for document in Document.query.all()}
+        indexed = document_ids & indexed_document_ids()
+        missing = document_ids - indexed
+        failed = failed_count()
+    
+    print(f"  {label:<34} {len(corpus) / responded:8.1f} uploads/sec {len(indexed) / elapsed:8.1f} indexed/sec   "
+          f"{commits:4d} commits   {len(missing):4d} lost updates   {failed} failed tasks")
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+def run(client_count, upload_count, words_per_doc):
+    corpus = make_corpus(upload_count, make_vocabulary(5000), words_per_doc=words_per_doc)
+    
+    print(f"\n{client_count} clients uploading {upload_count} documents of {words_per_doc} words at once:")
+    run_mode('writer per upload (no waiting)', client_count, corpus, asynchronous=False, direct=True)
+    run_mode('writer per upload (waits)', client_count, corpus, asynchronous=False, direct=True, lock_timeout=600)
+    run_mode('queue, drained in the request', client_count, corpus, asynchronous=False, direct=False)
+    run_mode('queue, background worker', client_count, corpus, asynchronous=True, direct=False)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--clients', type=int, default=8)
+    arg_parser.add_argument('--uploads', type=int, default=80)
+    arg_parser.add_argument('--words', type=int, default=300)
+    options = arg_parser.parse_args()
+    
+    run(options.clients, options.uploads, options.words)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Benchmark search latency under index churn for different segment merge policies
+
+Usage: python benchmarks/bench_merge.py [--rounds N] [--checkpoints N] [--optimize-every N]
+"""
+import argparse
+import random
+import shutil
+
+from common import make_app, use_new_index, make_vocabulary, make_corpus, time_calls, summarize
+
+from whoosh.writing import NO_MERGE, MERGE_SMALL
+
+def run(rounds, checkpoints, optimize_every, adds_per_round, deletes_per_round, query_count):
+    # Cached pages would hide the cost of searching after the first run of each query
+    app, base_dir = make_app(INDEXING_ASYNC=False, SEARCH_CACHE_MAX_BYTES=0)
+    
+    with app.app_context():
+        from app.search import index_writer, IndexUpdate, search_documents, \
+            index_segment_stats, merge_index
+        
+        vocabulary = make_vocabulary(5000)
+        corpus = make_corpus(rounds * adds_per_round, vocabulary, words_per_doc=60)
+        rng = random.Random(7)
+        queries = [(word,) for word in rng.sample(vocabulary, query_count)]
+        
+        policies = [
+            ('no merging', NO_MERGE, False),
+            ('whoosh default (MERGE_SMALL)', MERGE_SMALL, False),
+            ('tiered', None, False),
+            ('tiered + nightly optimize', None, True),
+        ]
+        
+        print(f"\n{rounds} rounds of {adds_per_round} uploads and {deletes_per_round} deletes, "
+              f"one commit each; median search latency (segments) every {rounds // checkpoints} rounds:")
+        for number, (label, mergetype, nightly) in enumerate(policies):
+            use_new_index(app, number)
+            
+            def commit(apply):
+                with index_writer() as writer:
+                    if mergetype is not None:
+                        # Replaces the tiered policy set by index_writer
+                        writer.mergetype = mergetype
+                    update = IndexUpdate(writer)
+                    apply(update)
+                    update.finish()
+            
+            live = []
+            row = []
+            churn_rng = random.Random(11)
+            for round_number in range(1, rounds + 1):
+                for document, content in corpus[(round_number - 1) * adds_per_round:round_number * adds_per_round]:
+                    commit(lambda update: update.add(document, str(document.id), lambda: content))
+                    live.append(document.id)
+                for _ in range(min(deletes_per_round, len(live) - 1)):
+                    document_id = live.pop(churn_rng.randrange(len(live)))
+                    commit(lambda update: update.remove(document_id))
+                
+                if nightly and round_number % optimize_every == 0:
+                    merge_index(optimize=True)
+                if round_number % (rounds // checkpoints) == 0:
+                    median, _ = summarize(time_calls(search_documents, queries))
+                    row.append(f"{median:6.2f} ms ({index_segment_stats()['segments']:3d})")
+            
+            print(f"  {label:<30} " + "  ".join(row))
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--rounds', type=int, default=40)
+    arg_parser.add_argument('--checkpoints', type=int, default=4)
+    arg_parser.add_argument('--optimize-every', type=int, default=10, help='rounds per simulated night')
+    arg_parser.add_argument('--adds', type=int, default=3)
+    arg_parser.add_argument('--deletes', type=int, default=2)
+    arg_parser.add_argument('--queries', type=int, default=20)
+    options = arg_parser.parse_args()
+    
+    run(options.rounds, options.checkpoints, options.optimize_every, options.adds, options.deletes, options.queries)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Benchmark partial matching: the *term* wildcard scan against the n-gram infix fields
+
+Also reports what the n-gram fields cost at index time: indexing throughput
+and index size with and without them.
+
+Usage: python benchmarks/bench_partial_match.py [--docs N] [--vocab N,N,...]
+"""
+import argparse
+import random
+import shutil
+import time
+
+from common import make_app, use_new_index, make_vocabulary, make_corpus, time_calls, print_row
+
+from whoosh.qparser import MultifieldParser, OrGroup, WildcardPlugin
+
+def run(doc_count, vocab_sizes, query_count):
+    app, base_dir = make_app()
+    
+    with app.app_context():
+        from app.search import init_index, content_fields, document_fields, build_partial_match_query, index_size
+        
+        def build_index(corpus, label, ngrams):
+            """Index the corpus into a new index, with or without the n-gram fields; returns (index, seconds)"""
+            # Start every run from an empty index
+            use_new_index(app, label)
+            index = init_index()
+            start = time.perf_counter()
+            with index.writer() as writer:
+                for document, content in corpus:
+                    # Every synthetic document has distinct content; its id stands in for the hash
+                    fields = content_fields(str(document.id), document.filename, content)
+                    entry = document_fields(document, str(document.id))
+                    if not ngrams:
+                        del fields['content_ngrams'], entry['filename_ngrams']
+                    writer.add_document(**fields)
+                    writer.add_document(**entry)
+            return index, time.perf_counter() - start
+        
+        for vocab_size in vocab_sizes:
+            vocabulary = make_vocabulary(vocab_size)
+            corpus = make_corpus(doc_count, vocabulary)
+            
+            print(f"\n{doc_count} documents, vocabulary of {vocab_size} words:")
+            for label, ngrams in (("without n-gram fields", False), ("with n-gram fields", True)):
+                index, elapsed = build_index(corpus, f"{vocab_size}-{int(ngrams)}", ngrams)
+                with index.searcher() as searcher:
+                    grams = searcher.reader().field_length('content_ngrams') / doc_count
+                print(f"  {label:<32} {doc_count / elapsed:8.1f} docs/sec   "
+                      f"{index_size() / 1024 / 1024:7.2f} MB   {grams:7.0f} n-grams per document")
+            
+            # Substrings taken from the middle of random vocabulary words
+            rng = random.Random(7)
+            substrings = []
+            for word in rng.sample(vocabulary, query_count):
+                start = rng.randint(0, len(word) - 4)
+                substrings.append(word[start:start + 4])
+            # Longer than NGRAM_SIZE: several grams, checked to line up within one word
+            long_substrings = []
+            for word in rng.sample([word for word in vocabulary if len(word) >= 7], query_count):
+                start = rng.randint(0, len(word) - 7)
+                long_substrings.append(word[start:start + 7])
+            
+            parser = MultifieldParser(["content", "original_filename", "filename"], index.schema, group=OrGroup)
+            parser.add_plugin(WildcardPlugin())
+            
+            with index.searcher() as searcher:
+                def wildcard(term):
+                    searcher.search(parser.parse(f"*{term}*"), limit=20)
+                
+                def infix(term):
+                    searcher.search(build_partial_match_query(index.schema, term), limit=20)
+                
+                args = [(term,) for term in substrings]
+                long_args = [(term,) for term in long_substrings]
+                print_row("wildcard *term*", time_calls(wildcard, args))
+                print_row("n-gram infix lookup", time_calls(infix, args))
+                print_row("wildcard, 7 characters", time_calls(wildcard, long_args))
+                print_row("n-gram infix, 7 characters", time_calls(infix, long_args))
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--docs', type=int, default=500)
+    arg_parser.add_argument('--vocab', default='2000,10000,40000')
+    arg_parser.add_argument('--queries', type=int, default=50)
+    options = arg_parser.parse_args()
+    
+    run(options.docs, [int(size) for size in options.vocab.split(',')], options.queries)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Benchmark passage-level indexing: indexing memory and query latency for large files by passage size
+
+Usage: python benchmarks/bench_passages.py [--docs N] [--size-kb N] [--passage-kb N,N,...] [--writer-mb N]
+"""
+import argparse
+import os
+import random
+import shutil
+import time
+import tracemalloc
+
+from common import make_app, use_new_index, make_vocabulary, make_corpus, time_calls, print_row
+
+def run(doc_count, size_kb, passage_sizes_kb, query_count, writer_mb):
+    # Cached pages would hide the cost of searching after the first run of each query
+    app, base_dir = make_app(INDEXING_ASYNC=False, SEARCH_CACHE_MAX_BYTES=0, INDEX_WRITER_MEMORY_MB=writer_mb)
+    
+    with app.app_context():
+        from app.search import index_writer, IndexUpdate, search_documents
+        from app.text_window import FileText
+        
+        vocabulary = make_vocabulary(5000)
+        # Roughly 9 bytes per word including the separator
+        corpus = make_corpus(doc_count, vocabulary, words_per_doc=size_kb * 1024 // 9)
+        for document, content in corpus:
+            with open(os.path.join(app.config['UPLOAD_FOLDER'], document.filename), 'w', encoding='utf-8') as f:
+                f.write(content)
+        
+        rng = random.Random(7)
+        queries = [(word,) for word in rng.sample(vocabulary, query_count)]
+        
+        print(f"\n{doc_count} files of {size_kb} KB, writer buffer {writer_mb} MB, {len(queries)} queries:")
+        for passage_kb in passage_sizes_kb:
+            use_new_index(app, passage_kb)
+            
+            # Python allocations only, which is where the analysis and the posting buffer live
+            tracemalloc.start()
+            start = time.perf_counter()
+            with index_writer() as writer:
+                update = IndexUpdate(writer, passage_bytes=passage_kb * 1024)
+                for document, _ in corpus:
+                    path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+                    update.add(document, str(document.id), lambda: FileText(path))
+                update.finish()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            
+            label = f"passages of {passage_kb} KB" if passage_kb else "whole files"
+            print(f"  {label:<32} indexed in {elapsed:6.2f} s, peak memory {peak / 1024 / 1024:7.1f} MB")
+            print_row("  search with snippets", time_calls(search_documents, queries))
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--docs', type=int, default=1)
+    arg_parser.add_argument('--size-kb', type=int, default=256)
+    arg_parser.add_argument('--passage-kb', default='0,32', help='0 indexes whole files')
+    arg_parser.add_argument('--writer-mb', type=int, default=8)
+    arg_parser.add_argument('--queries', type=int, default=30)
+    options = arg_parser.parse_args()
+    
+    run(options.docs, options.size_kb, [int(size) for size in options.passage_kb.split(',')], options.queries,
+        options.writer_mb)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Benchmark full index rebuilds: one commit per document against the shadow-directory rebuild
+
+Usage: python benchmarks/bench_rebuild.py [--docs N] [--words N] [--procs N,N,...] [--duplicates RATIO]
+"""
+import argparse
+import os
+import random
+import shutil
+import time
+
+from common import make_app, use_new_index, make_vocabulary, make_corpus
+
+def run(doc_count, words_per_doc, procs_list, read_threads, duplicate_ratio):
+    app, base_dir = make_app(INDEXING_ASYNC=False)
+    
+    with app.app_context():
+        from app import db
+        from app.models import Document
+        from app.search import init_index, add_document_to_index, rebuild_index
+        from app.indexing import indexing_source
+        
+        # Rebuilds read from the database and the upload folder, like the real thing
+        corpus = make_corpus(doc_count, make_vocabulary(5000), words_per_doc=words_per_doc)
+        # Give a share of the documents the content of an earlier one (the same file uploaded twice)
+        rng = random.Random(3)
+        for position in range(1, len(corpus)):
+            if rng.random() < duplicate_ratio:
+                corpus[position] = (corpus[position][0], corpus[rng.randrange(position)][1])
+        for document, content in corpus:
+            with open(os.path.join(app.config['UPLOAD_FOLDER'], document.filename), 'w', encoding='utf-8') as f:
+                f.write(content)
+            db.session.add(Document(id=document.id, filename=document.filename,
+                                    original_filename=document.original_filename,
+                                    upload_date=document.upload_date, user_id=1))
+        db.session.commit()
+        
+        distinct = len({content for _, content in corpus})
+        print(f"\n{doc_count} documents ({distinct} distinct) of {words_per_doc} words:")
+        
+        # The previous rebuild: delete the index, then add and commit one document at a time
+        use_new_index(app, 'rebuild')
+        init_index()
+        start = time.perf_counter()
+        for document in Document.query.all():
+            content_hash, _, read_content = indexing_source(document)
+            add_document_to_index(document, content_hash, read_content)
+        elapsed = time.perf_counter() - start
+        print(f"  {'commit per document':<32} {elapsed:8.2f} s   {doc_count / elapsed:8.1f} docs/sec")
+        
+        for procs in procs_list:
+            start = time.perf_counter()
+            rebuild_index(procs=procs, read_threads=read_threads)
+            elapsed = time.perf_counter() - start
+            label = f"shadow rebuild, {procs} proc(s)"
+            print(f"  {label:<32} {elapsed:8.2f} s   {doc_count / elapsed:8.1f} docs/sec")
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--docs', type=int, default=200)
+    arg_parser.add_argument('--words', type=int, default=300)
+    arg_parser.add_argument('--procs', default=f'1,{min(4, os.cpu_count() or 1)}')
+    arg_parser.add_argument('--read-threads', type=int, default=4)
+    arg_parser.add_argument('--duplicates', type=float, default=0.0, help='share of documents that repeat earlier content')
+    options = arg_parser.parse_args()
+    
+    run(options.docs, options.words, [int(procs) for procs in options.procs.split(',')], options.read_threads,
+        options.duplicates)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Benchmark /search latency with the query spell check run always and inline, or only for queries that find little
+
+Usage: python benchmarks/bench_search_spelling.py [--docs N] [--queries N]
+"""
+import argparse
+import random
+import shutil
+import time
+
+from common import make_app, make_corpus, time_calls, print_row
+
+from spellchecker import SpellChecker
+from app.spell_checker import spell_checker
+from app.suggestions import check_query
+
+def run(doc_count, query_count):
+    rng = random.Random(5)
+    frequencies = SpellChecker().word_frequency.dictionary
+    english = sorted((word for word in frequencies if len(word) >= 5 and word.isalpha()),
+                     key=lambda word: -frequencies[word])[:3000]
+    corpus = make_corpus(doc_count, english, words_per_doc=150)
+    
+    # Most searches are for words the documents contain; some have a typo and find little
+    queries = []
+    for number in range(query_count):
+        words = rng.sample(english, 2)
+        if number % 5 == 0:
+            position = rng.randrange(1, len(words[0]) - 1)
+            words[0] = words[0][:position] + words[0][position + 1:]
+        queries.append(' '.join(words))
+    
+    modes = [
+        ('always, inline', dict(SPELLING_CHECK_BELOW_HITS=None, SPELLING_TIME_BUDGET=None)),
+        ('below 5 hits, 50 ms budget', dict(SPELLING_CHECK_BELOW_HITS=5, SPELLING_TIME_BUDGET=0.05)),
+    ]
+    clients = []
+    base_dirs = []
+    cold_starts = []
+    for label, settings in modes:
+        # Cached pages and memoized words would hide the cost of every repeated search
+        app, base_dir = make_app(INDEXING_ASYNC=False, SEARCH_CACHE_MAX_BYTES=0, SPELLING_CACHE_ENTRIES=0,
+                                 **settings)
+        with app.app_context():
+            from app.search import index_writer, IndexUpdate
+            for start in range(0, doc_count, 50):
+                with index_writer() as writer:
+                    update = IndexUpdate(writer)
+                    for document, content in corpus[start:start + 50]:
+                        update.add(document, str(document.id), lambda content=content: content)
+                    update.finish()
+        
+        client = app.test_client()
+        client.post('/auth/login', data={'username': 'admin', 'password': 'admin123'})
+        # The first search of a new server, before the spelling index file is built
+        spell_checker.index = None
+        cold_started = time.perf_counter()
+        client.get('/search', query_string={'query': queries[0]})
+        cold_starts.append(time.perf_counter() - cold_started)
+        with app.app_context():
+            spell_checker.get_index()  # Wait for a build left to the background
+        clients.append(client)
+        base_dirs.append(base_dir)
+    
+    # The modes take turns on every query, so that load on the machine affects both alike
+    latencies = [[] for _ in modes]
+    deferred = [0 for _ in modes]
+    for query in queries:
+        for number, client in enumerate(clients):
+            def search():
+                page = client.get('/search', query_string={'query': query}).get_data(as_text=True)
+                deferred[number] += 'id="query-checks"' in page
+            latencies[number].extend(time_calls(search, [()]))
+    
+    # What a check costs when it runs: the spelling index lookups and the suggestion lexicon
+    with clients[0].application.app_context():
+        check_latencies = time_calls(check_query, [(query,) for query in queries])
+    
+    print(f"\n{doc_count} documents, {query_count} two-word queries (one in five with a typo), "
+          f"result and spell-check caches off:")
+    for number, (label, _) in enumerate(modes):
+        print_row(label, latencies[number])
+        print(f"  {'':<32} first search of a new server {cold_starts[number] * 1000:8.1f} ms"
+              + (f", {deferred[number]} checks left to the results page" if deferred[number] else ""))
+    print_row('check_query() alone', check_latencies)
+    
+    for base_dir in base_dirs:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--docs', type=int, default=300)
+    arg_parser.add_argument('--queries', type=int, default=100)
+    options = arg_parser.parse_args()
+    
+    run(options.docs, options.queries)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Benchmark recovering a node: full index rebuild against snapshot restore plus incremental catch-up
+
+Usage: python benchmarks/bench_snapshot.py [--docs N] [--words N] [--new N]
+"""
+import argparse
+import os
+import shutil
+import time
+
+from common import make_app, make_vocabulary, make_corpus
+
+def run(doc_count, words_per_doc, new_count):
+    app, base_dir = make_app(INDEXING_ASYNC=False)
+    
+    with app.app_context():
+        from app import db
+        from app.models import Document
+        from app.search import rebuild_index
+        from app.snapshot import create_snapshot, restore_snapshot
+        
+        corpus = make_corpus(doc_count + new_count, make_vocabulary(5000), words_per_doc=words_per_doc)
+        
+        def add_documents(pairs):
+            for document, content in pairs:
+                with open(os.path.join(app.config['UPLOAD_FOLDER'], document.filename), 'w', encoding='utf-8') as f:
+                    f.write(content)
+                db.session.add(Document(id=document.id, filename=document.filename,
+                                        original_filename=document.original_filename,
+                                        upload_date=document.upload_date, user_id=1))
+            db.session.commit()
+        
+        add_documents(corpus[:doc_count])
+        rebuild_index()
+        
+        print(f"\n{doc_count} documents of {words_per_doc} words indexed, snapshot taken, then {new_count} uploaded:")
+        start = time.perf_counter()
+        info = create_snapshot()
+        elapsed = time.perf_counter() - start
+        print(f"  {'take snapshot':<36} {elapsed:8.2f} s   (index writes paused {info['fenced_seconds']:.3f} s)")
+        start = time.perf_counter()
+        info = create_snapshot()
+        elapsed = time.perf_counter() - start
+        print(f"  {'take another (unchanged segments)':<36} {elapsed:8.2f} s   ({info['linked_files']} of "
+              f"{info['index_files']} files hard-linked)")
+        
+        add_documents(corpus[doc_count:])
+        
+        start = time.perf_counter()
+        result = restore_snapshot(with_database=False)
+        elapsed = time.perf_counter() - start
+        print(f"  {'restore index + catch-up':<36} {elapsed:8.2f} s   ({result['applied']} documents reindexed)")
+        
+        start = time.perf_counter()
+        indexed = rebuild_index()
+        elapsed = time.perf_counter() - start
+        print(f"  {'full rebuild':<36} {elapsed:8.2f} s   ({indexed} documents reindexed)")
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--docs', type=int, default=100)
+    arg_parser.add_argument('--words', type=int, default=300)
+    arg_parser.add_argument('--new', type=int, default=5, help='documents uploaded after the snapshot')
+    options = arg_parser.parse_args()
+    
+    run(options.docs, options.words, options.new)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Benchmark snippet generation: re-tokenizing with ContextFragmenter against stored offsets and file windows
+
+Usage: python benchmarks/bench_snippets.py [--docs N] [--size-kb N,N,...]
+"""
+import argparse
+import os
+import random
+import shutil
+
+from common import make_app, use_new_index, make_vocabulary, make_corpus, time_calls, print_row
+
+from whoosh.highlight import ContextFragmenter, HtmlFormatter, PinpointFragmenter
+from whoosh.query import Term
+
+def run(doc_count, sizes_kb, query_count):
+    app, base_dir = make_app()
+    
+    with app.app_context():
+        from app.search import init_index, content_fields, pinpoint_highlight, open_document_text
+        
+        vocabulary = make_vocabulary(5000)
+        for size_kb in sizes_kb:
+            # Roughly 9 bytes per word including the separator
+            corpus = make_corpus(doc_count, vocabulary, words_per_doc=size_kb * 1024 // 9)
+            
+            use_new_index(app, size_kb)
+            index = init_index()
+            with index.writer() as writer:
+                for document, content in corpus:
+                    # Snippet windows are read from the uploaded files
+                    with open(os.path.join(app.config['UPLOAD_FOLDER'], document.filename), 'w', encoding='utf-8') as f:
+                        f.write(content)
+                    # Only content entries carry match positions; the document id stands in for the hash
+                    writer.add_document(**content_fields(str(document.id), document.filename, content))
+            
+            rng = random.Random(7)
+            words = rng.sample(vocabulary, query_count)
+            
+            formatter = HtmlFormatter(tagname="span", classname="search-highlight", between="...")
+            context_fragmenter = ContextFragmenter(surround=60)
+            pinpoint_fragmenter = PinpointFragmenter(maxchars=200, surround=60, autotrim=True, charlimit=None)
+            
+            with index.searcher() as searcher:
+                # Load the full text up front so only snippet building is timed
+                # (the re-tokenizing path needs all of it, as when it was stored)
+                hits = []
+                for word in words:
+                    results = searcher.search(Term("content", word), limit=1, terms=True)
+                    results.formatter = formatter
+                    results.fragmenter = context_fragmenter
+                    if results:
+                        hits.append((results[0], corpus[int(results[0]['content_hash']) - 1][1]))
+                
+                def retokenize(hit, text):
+                    hit.highlights("content", text=text, top=5)
+                
+                def pinpoint(hit, text):
+                    # Reads only the windows around the matches from the file
+                    with open_document_text(hit) as window:
+                        pinpoint_highlight(searcher, hit, window, [], pinpoint_fragmenter, formatter, top=5)
+                
+                print(f"\n{doc_count} documents of about {size_kb} KB, {len(hits)} queries:")
+                print_row("ContextFragmenter (retokenize)", time_calls(retokenize, hits))
+                print_row("offsets + file window (pinpoint)", time_calls(pinpoint, hits))
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--docs', type=int, default=20)
+    arg_parser.add_argument('--size-kb', default='64,512')
+    arg_parser.add_argument('--queries', type=int, default=30)
+    options = arg_parser.parse_args()
+    
+    run(options.docs, [int(size) for size in options.size_kb.split(',')], options.queries)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Benchmark spelling suggestions: pyspellchecker's edit generation against the precomputed symmetric-delete index
+
+Usage: python benchmarks/bench_spelling.py [--words N] [--unknown N] [--keystrokes N]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from common import make_app, time_calls, print_row
+
+from spellchecker import SpellChecker
+from app.spell_checker import dictionary_source, spell_checker
+from app.symspell import SpellingIndex
+
+# Frequent real-world misspellings
+COMMON_MISSPELLINGS = {
+    'recieve': 'receive', 'seperate': 'separate', 'definately': 'definitely', 'occured': 'occurred',
+    'accomodate': 'accommodate', 'untill': 'until', 'wich': 'which', 'becuase': 'because',
+    'thier': 'their', 'goverment': 'government', 'occurence': 'occurrence', 'neccessary': 'necessary',
+    'embarassment': 'embarrassment', 'begining': 'beginning', 'beleive': 'believe',
+    'existance': 'existence', 'foriegn': 'foreign', 'independant': 'independent', 'tommorow': 'tomorrow',
+    'enviroment': 'environment', 'adress': 'address', 'arguement': 'argument', 'wierd': 'weird',
+    'publically': 'publicly', 'recomend': 'recommend', 'succesful': 'successful', 'truely': 'truly',
+}
+
+KEYBOARD_ROWS = ['qwertyuiop', 'asdfghjkl', 'zxcvbnm']
+
+def neighbours(char):
+    """Keys next to char on a QWERTY keyboard"""
+    for row in KEYBOARD_ROWS:
+        position = row.find(char)
+        if position >= 0:
+            return row[max(0, position - 1):position] + row[position + 1:position + 2]
+    return char
+
+def typo(word, rng):
+    """Apply one typing error: a transposition, a dropped, doubled or neighbouring key"""
+    position = rng.randrange(len(word))
+    kind = rng.choice(['transpose', 'drop', 'double', 'neighbour'])
+    if kind == 'transpose' and position < len(word) - 1:
+        return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+    if kind == 'drop':
+        return word[:position] + word[position + 1:]
+    if kind == 'double':
+        return word[:position] + word[position] + word[position:]
+    return word[:position] + rng.choice(neighbours(word[position])) + word[position + 1:]
+
+def make_misspellings(spell, count, rng):
+    """Typos of frequent words, one error in four words having two, plus the common misspellings"""
+    frequencies = spell.word_frequency.dictionary
+    common = sorted((word for word in frequencies if len(word) >= 3 and word.isalpha()),
+                    key=lambda word: -frequencies[word])[:5000]
+    misspellings = list(COMMON_MISSPELLINGS.items())
+    while len(misspellings) < count:
+        intended = rng.choice(common)
+        word = typo(intended, rng)
+        if rng.random() < 0.25:
+            word = typo(word, rng)
+        if word not in frequencies and len(word) >= 2:
+            misspellings.append((word, intended))
+    return misspellings
+
+def make_unknown(count, rng):
+    """Tokens with no dictionary word within two edits, like identifiers, codes and jargon in a query"""
+    letters = 'bcdfghjklmnpqrstvwxz'
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(6, 14))) for _ in range(count)]
+
+def run(word_count, unknown_count):
+    base_dir = tempfile.mkdtemp(prefix='docsearch-bench-')
+    rng = random.Random(11)
+
+    start = time.perf_counter()
+    spell = SpellChecker()
+    load_seconds = time.perf_counter() - start
+    misspellings = make_misspellings(spell, word_count, rng)
+    unknown = make_unknown(unknown_count, rng)
+
+    path = os.path.join(base_dir, 'spelling.idx')
+    start = time.perf_counter()
+    SpellingIndex.build(path, spell.word_frequency.dictionary, source=dictionary_source())
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index = SpellingIndex(path)
+    open_seconds = time.perf_counter() - start
+
+    print(f"\nDictionary of {len(spell.word_frequency.dictionary)} words:")
+    print(f"  pyspellchecker load           {load_seconds * 1000:8.1f} ms (in every process)")
+    print(f"  index build                   {build_seconds * 1000:8.1f} ms (once), "
+          f"{os.path.getsize(path) / 1024 / 1024:.1f} MB on disk")
+    print(f"  index open                    {open_seconds * 1000:8.3f} ms (memory-mapped)")
+
+    for label, words in [(f"{len(misspellings)} realistic misspellings", [word for word, _ in misspellings]),
+                         (f"{len(unknown)} unknown tokens", unknown)]:
+        print(f"\n{label}:")
+        old = time_calls(lambda word: spell.candidates(word), [(word,) for word in words])
+        new = time_calls(lambda word: index.lookup(word), [(word,) for word in words])
+        print_row('pyspellchecker candidates()', old)
+        print(f"  {'':<32} max    {max(old):8.2f} ms")
+        print_row('symmetric-delete index', new)
+        print(f"  {'':<32} max    {max(new):8.2f} ms")
+        agree = sum(set(index.lookup(word)) == (spell.candidates(word) or set()) for word in words)
+        print(f"  same suggestions for {agree} of {len(words)} words")
+
+    # The index ranks suggestions by frequency; so does pyspellchecker's correction()
+    found = sum(intended in index.lookup(word)[:1] for word, intended in misspellings)
+    suggested = sum(intended in index.lookup(word) for word, intended in misspellings)
+    print(f"\nIntended word ranked first for {found} of {len(misspellings)} misspellings, "
+          f"suggested at all for {suggested}")
+
+    index.close()
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+def run_typing(misspellings, keystroke_count):
+    """Check the whole text after every keystroke, as the search box does through /api/spell-check"""
+    app, base_dir = make_app()
+    rng = random.Random(5)
+    words = [rng.choice(misspellings)[0] if rng.random() < 0.2 else rng.choice(misspellings)[1]
+             for _ in range(keystroke_count)]
+    text = ' '.join(words)[:keystroke_count]
+    prefixes = [(text[:end],) for end in range(1, len(text) + 1)]
+
+    with app.app_context():
+        spell_checker.get_index()
+        print(f"\nTyping {len(prefixes)} characters, checking the text after each one:")
+        for label, entries in [('without memo', 0), ('with memo', app.config['SPELLING_CACHE_ENTRIES'])]:
+            spell_checker.memo.clear()
+            spell_checker.memo.max_entries = entries
+            spell_checker.memo.hits = spell_checker.memo.misses = 0
+            latencies = time_calls(spell_checker.check_text, prefixes)
+            print_row(label, latencies)
+            if entries:
+                print(f"  {'':<32} {spell_checker.memo.hits} words answered from the memo, "
+                      f"{spell_checker.memo.misses} looked up")
+
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--words', type=int, default=500)
+    arg_parser.add_argument('--unknown', type=int, default=20)
+    arg_parser.add_argument('--keystrokes', type=int, default=300)
+    options = arg_parser.parse_args()
+
+    run(options.words, options.unknown)
+    run_typing(make_misspellings(SpellChecker(), 100, random.Random(11)), options.keystrokes)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Benchmark cold start: importing the application, create_app() and the first requests, each run in a new process
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--max-ms MS]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from common import make_app, make_vocabulary, make_corpus, summarize
+
+# Run in a new interpreter, so nothing is imported or cached yet; prints the time of each step
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+base_dir, mode = sys.argv[2], sys.argv[3]
+from common import make_config
+from app import create_app
+imported = time.perf_counter()
+settings = dict(INDEXING_ASYNC=False, SPELLING_TIME_BUDGET=None)
+if mode != 'lazy':
+    settings['TEMPLATE_CACHE_DIR'] = None
+if mode != 'schema':
+    settings['CREATE_SCHEMA_ON_STARTUP'] = False
+if mode == 'cold':
+    settings['SPELLING_INDEX_PATH'] = base_dir + '/cold-spelling.idx'
+app = create_app(make_config(base_dir, **settings))
+created = time.perf_counter()
+client = app.test_client()
+client.get('/auth/login')
+first_page = time.perf_counter()
+client.get('/search', query_string={'query': sys.argv[4]})
+first_search = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'first page': first_page - created, 'first search': first_search - first_page,
+                  'to first search': first_search - started}))
+'''
+
+def run(runs, max_ms):
+    # A database, search index, spelling index and compiled templates as init_db.py leaves them
+    app, base_dir = make_app(INDEXING_ASYNC=False)
+    vocabulary = make_vocabulary(2000)
+    with app.app_context():
+        from app.search import index_writer, IndexUpdate
+        from app.spell_checker import spell_checker
+        with index_writer() as writer:
+            update = IndexUpdate(writer)
+            for document, content in make_corpus(100, vocabulary, words_per_doc=150):
+                update.add(document, str(document.id), lambda content=content: content)
+            update.finish()
+        spell_checker.get_index()
+        for name in app.jinja_env.list_templates(extensions=['html']):
+            app.jinja_env.get_template(name)
+    # A misspelled word that finds nothing, so that the first search runs the spell check too
+    query = 'recieve'
+    
+    modes = [
+        ('schema and templates by init_db.py', 'lazy'),
+        ('schema at start, no template cache', 'schema'),
+        ('no spelling index or template cache', 'cold'),
+    ]
+    benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+    cold_spelling_index = os.path.join(base_dir, 'cold-spelling.idx')
+    steps = {mode: {} for _, mode in modes}
+    wall = {mode: [] for _, mode in modes}
+    # The modes take turns, so that load on the machine affects both alike
+    for _ in range(runs):
+        for _, mode in modes:
+            if mode == 'cold' and os.path.exists(cold_spelling_index):
+                os.remove(cold_spelling_index)
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', CHILD, benchmarks_dir, base_dir, mode, query],
+                                    check=True, capture_output=True, text=True).stdout
+            wall[mode].append((time.perf_counter() - started) * 1000)
+            for step, seconds in json.loads(output.splitlines()[-1]).items():
+                steps[mode].setdefault(step, []).append(seconds * 1000)
+    
+    print(f"\n{runs} cold starts per mode, medians (interpreter start included in the process total):")
+    for label, mode in modes:
+        print(f"  {label}:")
+        for step, latencies in steps[mode].items():
+            print(f"    {step:<30} {summarize(latencies)[0]:8.1f} ms")
+        print(f"    {'whole process':<30} {summarize(wall[mode])[0]:8.1f} ms")
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+    
+    to_first_search = summarize(steps[modes[0][1]]['to first search'])[0]
+    if max_ms is not None and to_first_search > max_ms:
+        print(f"\nFAIL: first search answered after {to_first_search:.1f} ms, more than {max_ms} ms")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--runs', type=int, default=10)
+    arg_parser.add_argument('--max-ms', type=float, default=None,
+                            help='exit with status 1 if the median time to the first search answer is longer')
+    options = arg_parser.parse_args()
+    
+    sys.exit(run(options.runs, options.max_ms))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Benchmark "did you mean" query suggestions from the index lexicon against whoosh's corrector and the English dictionary
+
+Usage: python benchmarks/bench_suggestions.py [--docs N] [--vocabulary N] [--queries N]
+"""
+import argparse
+import random
+import shutil
+import time
+
+from common import make_app, make_vocabulary, make_corpus, time_calls, print_row
+
+def misspell(word, rng):
+    """Drop, double, swap or replace one letter"""
+    position = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(['drop', 'double', 'swap', 'replace'])
+    if kind == 'drop':
+        return word[:position] + word[position + 1:]
+    if kind == 'double':
+        return word[:position] + word[position] + word[position:]
+    if kind == 'swap':
+        return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+    return word[:position] + rng.choice('aeiou') + word[position + 1:]
+
+def run(doc_count, vocabulary_size, query_count):
+    app, base_dir = make_app(INDEXING_ASYNC=False, SEARCH_CACHE_MAX_BYTES=0)
+    
+    with app.app_context():
+        from app.search import index_writer, IndexUpdate, get_searcher, search_documents
+        from app.suggestions import suggest_query, query_suggester
+        from app.spell_checker import spell_checker
+        
+        # Random words stand in for the hostnames, codes and jargon of a real collection
+        vocabulary = make_vocabulary(vocabulary_size)
+        corpus = make_corpus(doc_count + 10, vocabulary, words_per_doc=120)
+        for start in range(0, doc_count, 50):
+            with index_writer() as writer:
+                update = IndexUpdate(writer)
+                for document, content in corpus[start:min(start + 50, doc_count)]:
+                    update.add(document, str(document.id), lambda content=content: content)
+                update.finish()
+        
+        rng = random.Random(3)
+        intended = rng.sample(vocabulary, query_count)
+        queries = []
+        for word in intended:
+            typo = misspell(word, rng)
+            while typo in vocabulary:
+                typo = misspell(word, rng)
+            queries.append(typo)
+        
+        # The whole lexicon is read on first use; after that only new segments are
+        start = time.perf_counter()
+        suggest_query('warmup')
+        load_seconds = time.perf_counter() - start
+        with get_searcher() as searcher:
+            lexicon = query_suggester.lexicon(app.config['WHOOSH_INDEX_DIR'], searcher)
+            term_count = len(lexicon)
+        
+        with index_writer() as writer:
+            update = IndexUpdate(writer)
+            for document, content in corpus[doc_count:]:
+                update.add(document, str(document.id), lambda content=content: content)
+            update.finish()
+        start = time.perf_counter()
+        suggest_query('warmup')
+        update_seconds = time.perf_counter() - start
+        
+        print(f"\n{doc_count} documents, {term_count} suggestible terms, {query_count} misspelled queries:")
+        print(f"  lexicon loaded in {load_seconds * 1000:.1f} ms, caught up with a 10 document commit "
+              f"in {update_seconds * 1000:.1f} ms")
+        
+        def whoosh_corrector(word):
+            with get_searcher() as searcher:
+                return searcher.suggest('words', word, limit=1, maxdist=2)
+        
+        def english_dictionary(word):
+            return spell_checker.check_text(word).get(word, [])
+        
+        spell_checker.get_index()
+        rows = [
+            ('index lexicon (symmetric delete)', lambda word: [query for query in [suggest_query(word)] if query]),
+            ("whoosh corrector (lexicon scan)", whoosh_corrector),
+            ('English dictionary', english_dictionary),
+        ]
+        for label, suggest in rows:
+            latencies = time_calls(suggest, [(word,) for word in queries])
+            print_row(label, latencies)
+            first = [suggest(word)[:1] for word in queries]
+            correct = sum(suggestion == [word] for suggestion, word in zip(first, intended))
+            matching = sum(bool(suggestion) and bool(search_documents(suggestion[0], partial_match=False))
+                           for suggestion in first)
+            print(f"  {'':<32} intended word first for {correct}, suggestion finds documents for {matching}")
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--docs', type=int, default=300)
+    arg_parser.add_argument('--vocabulary', type=int, default=5000)
+    arg_parser.add_argument('--queries', type=int, default=100)
+    options = arg_parser.parse_args()
+    
+    run(options.docs, options.vocabulary, options.queries)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Benchmark custom dictionaries: the legacy comma-separated column against the user_words table
+
+Usage: python benchmarks/bench_user_dictionary.py [--words N] [--adds N] [--checks N]
+"""
+import argparse
+import random
+import shutil
+import time
+
+from common import make_app, make_vocabulary, time_calls, print_row
+
+def legacy_add(user, word):
+    """add_custom_word of the comma-separated column: split and re-join the whole list"""
+    words = user.custom_words.split(',') if user.custom_words else []
+    if word not in words:
+        words.append(word)
+        user.custom_words = ','.join(words)
+
+def run(word_count, add_count, check_count):
+    app, base_dir = make_app(INDEXING_ASYNC=False, SPELLING_CACHE_ENTRIES=0)
+    
+    with app.app_context():
+        from app import db
+        from app.models import User
+        from app.spell_checker import spell_checker, CustomSpellChecker, UserDictionary
+        from app.symspell import edit_distance
+        
+        spell_checker.get_index()
+        legacy_user = User(username='legacy', email='legacy@example.com', custom_words='')
+        legacy_user.set_password('legacy')
+        table_user = User(username='table', email='table@example.com')
+        table_user.set_password('table')
+        db.session.add_all([legacy_user, table_user])
+        db.session.commit()
+        
+        vocabulary = make_vocabulary(word_count + add_count, seed=7)
+        words, added_words = vocabulary[:word_count], vocabulary[word_count:]
+        
+        legacy_user.custom_words = ','.join(words)
+        db.session.commit()
+        start = time.perf_counter()
+        spell_checker.add_words(words, table_user.id)
+        import_seconds = time.perf_counter() - start
+        
+        # Adding one word at a time to a dictionary that already has word_count words;
+        # the two take turns so that load on the machine affects both alike
+        def add_legacy(word):
+            legacy_add(legacy_user, word)
+            db.session.commit()
+        
+        def add_table(word):
+            spell_checker.add_words([word], table_user.id)
+        
+        legacy_adds, table_adds = [], []
+        for word in added_words:
+            legacy_adds.extend(time_calls(add_legacy, [(word,)]))
+            table_adds.extend(time_calls(add_table, [(word,)]))
+        
+        # Loading the dictionary in a worker process that hasn't seen it
+        def load_legacy():
+            db.session.expire_all()
+            return UserDictionary(User.query.get(legacy_user.id).custom_words.split(','))
+        
+        def load_table():
+            return CustomSpellChecker().load_user_dictionary(table_user.id)
+        
+        legacy_loads, table_loads = [], []
+        for _ in range(10):
+            legacy_loads.extend(time_calls(load_legacy, [()]))
+            table_loads.extend(time_calls(load_table, [()]))
+        
+        # Checking text once the dictionary is cached: the table costs a version lookup per check
+        rng = random.Random(11)
+        english = ['search', 'document', 'server', 'error', 'request', 'network', 'report', 'upload', 'timeout']
+        texts = [' '.join(rng.sample(english, 3)) for _ in range(check_count)]
+        spell_checker.load_user_dictionary(table_user.id)
+        anonymous_checks, user_checks = [], []
+        for text in texts:
+            anonymous_checks.extend(time_calls(spell_checker.check_text, [(text,)]))
+            user_checks.extend(time_calls(spell_checker.check_text, [(text, table_user.id)]))
+        
+        # Suggestions for unknown words go through the custom words as well
+        dictionary = spell_checker.load_user_dictionary(table_user.id)
+        typos = [word[:2] + word[3:] for word in rng.sample(words, check_count)]
+        
+        def scan_candidates(word):
+            """The custom word part of candidates() before the bigram index: every word compared"""
+            suggestions = spell_checker.get_index().lookup(word)
+            best = edit_distance(word, suggestions[0], 2) if suggestions else 2
+            return [custom_word for custom_word in dictionary.words if 0 < edit_distance(word, custom_word, best)]
+        
+        dictionary.near('warmup', 2)  # Builds the bigram index
+        scan_latencies = time_calls(scan_candidates, [(typo,) for typo in typos[:20]])
+        candidate_latencies = time_calls(spell_checker.candidates, [(typo, dictionary) for typo in typos])
+        
+        print(f"\n{word_count} custom words:")
+        print(f"  imported through add_words in {import_seconds * 1000:.1f} ms")
+        print_row('add a word, comma-separated', legacy_adds)
+        print_row('add a word, user_words', table_adds)
+        print_row('load in a new worker, comma-sep.', legacy_loads)
+        print_row('load in a new worker, user_words', table_loads)
+        print_row('check text, no user', anonymous_checks)
+        print_row('check text, user (version check)', user_checks)
+        print_row('typo, every custom word', scan_latencies)
+        print_row('typo, bigram index', candidate_latencies)
+    
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--words', type=int, default=20000)
+    arg_parser.add_argument('--adds', type=int, default=200)
+    arg_parser.add_argument('--checks', type=int, default=200)
+    options = arg_parser.parse_args()
+    
+    run(options.words, options.adds, options.checks)
@@ -0,0 +1,93 @@
+"""Shared helpers for the benchmark scripts"""
+import os
+import random
+import shutil
+import statistics
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+# Add the project root to the path so we can import app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+
+def make_config(base_dir, **overrides):
+    """Return a configuration that keeps the database, uploads and indexes in base_dir"""
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(base_dir, 'bench.db'),
+        'UPLOAD_FOLDER': os.path.join(base_dir, 'uploads'),
+        'WHOOSH_INDEX_DIR': os.path.join(base_dir, 'whoosh_index'),
+        'SNAPSHOT_DIR': os.path.join(base_dir, 'snapshots'),
+        'SPELLING_INDEX_PATH': os.path.join(base_dir, 'spelling.idx'),
+        'TEMPLATE_CACHE_DIR': os.path.join(base_dir, 'template_cache'),
+        'WTF_CSRF_ENABLED': False,
+        'TESTING': True,
+    }
+    settings.update(overrides)
+    return type('BenchmarkConfig', (Config,), settings)
+
+def make_app(**overrides):
+    """Create an application that keeps its database, uploads and index in a temporary directory"""
+    from app import create_app
+    
+    base_dir = tempfile.mkdtemp(prefix='docsearch-bench-')
+    return create_app(make_config(base_dir, **overrides)), base_dir
+
+def use_new_index(app, label):
+    """Point the application at a new, empty index directory next to the current one and return it"""
+    index_dir = os.path.join(os.path.dirname(app.config['WHOOSH_INDEX_DIR']), f'whoosh_index-{label}')
+    shutil.rmtree(index_dir, ignore_errors=True)
+    app.config['WHOOSH_INDEX_DIR'] = index_dir
+    return index_dir
+
+def make_vocabulary(size, seed=42):
+    """Generate a vocabulary of random lowercase words"""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        length = rng.randint(4, 12)
+        words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(length)))
+    return sorted(words)
+
+def make_corpus(doc_count, vocabulary, words_per_doc=300, seed=42):
+    """Generate (document, content) pairs with random text from the vocabulary"""
+    rng = random.Random(seed)
+    corpus = []
+    for doc_id in range(1, doc_count + 1):
+        lines = []
+        for _ in range(words_per_doc // 15):
+            lines.append(' '.join(rng.choice(vocabulary) for _ in range(15)))
+        document = SimpleNamespace(
+            id=doc_id,
+            filename=f'{doc_id:08x}_doc{doc_id}.log',
+            original_filename=f'doc{doc_id}.log',
+            upload_date=datetime(2024, 1, 1),
+            user_id=1 + doc_id % 10
+        )
+        corpus.append((document, '\n'.join(lines)))
+    return corpus
+
+def time_calls(func, args_list, repeat=1):
+    """Call func once per argument tuple and return the latencies in milliseconds"""
+    latencies = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = time.perf_counter()
+            func(*args)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def summarize(latencies):
+    """Return median and p95 of a list of latencies"""
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return statistics.median(ordered), p95
+
+def print_row(label, latencies):
+    """Print a one line latency summary"""
+    median, p95 = summarize(latencies)
+    print(f"  {label:<32} median {median:8.2f} ms   p95 {p95:8.2f} ms")
@@ -4,6 +4,8 @@ import shutil
 import sys
 import time
 
+from config import Config
+
 def clean_directory(path, keep_gitkeep=True):
     """Clean a directory by removing all files and subdirectories."""
     if not os.path.exists(path):
@@ -65,9 +67,30 @@ def cleanup_project():
                     print(f"ERROR: Could not remove {file}: {str(e)}")
         
         # Clean Whoosh index directory
-        whoosh_dir = os.path.join(instance_dir, 'whoosh_index')
+        whoosh_dir = os.path.join(instance_dir, Config.WHOOSH_INDEX_DIR)
         if os.path.exists(whoosh_dir):
             clean_directory(whoosh_dir)
+        
+        # Remove what the application keeps next to the index: snapshots (each holds a full
+        # copy of the database), the spelling index, compiled templates, the shadow index of
+        # an interrupted rebuild and the rebuild and merge status files
+        artifacts = [Config.SNAPSHOT_DIR, Config.SPELLING_INDEX_PATH, Config.TEMPLATE_CACHE_DIR,
+                     Config.WHOOSH_INDEX_DIR + '.rebuild', Config.WHOOSH_INDEX_DIR + '.rebuild.json',
+                     Config.WHOOSH_INDEX_DIR + '.merge.json', Config.WHOOSH_INDEX_DIR + '.tiered-merge.json']
+        # Temporary files left by a worker that stopped while writing one of them
+        artifacts += [file for file in os.listdir(instance_dir) if file.endswith('.tmp')]
+        for name in artifacts:
+            path = os.path.join(instance_dir, name) if name else None
+            if path is None or not os.path.exists(path):
+                continue
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                print(f"Removed: {path}")
+            except Exception as e:
+                print(f"ERROR: Could not remove {path}: {str(e)}")
     
     # Clean uploads directory
     print("\nRemoving uploaded files...")
@@ -119,7 +142,7 @@ def cleanup_project():
 if __name__ == "__main__":
     print("WARNING: This script will clean up the project and remove all:")
     print(" - Database files")
-    print(" - Search index files")
+    print(" - Search index files, index snapshots and the spelling index")
     print(" - Uploaded documents")
     print(" - Cache files and compiled Python files")
     print(" - Any virtual environment directories")
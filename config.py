@@ -24,6 +24,16 @@ class Config:
         'log', 'xml', 'toml',  # Logs and data formats
         'tex', 'bib',  # LaTeX files
     }
+    # Source code and config files: indexed with identifier splitting (getUserById, max_retry_count)
+    # and without stemming instead of the English analyzer used for the other files
+    CODE_EXTENSIONS = {
+        'py', 'js', 'java', 'c', 'cpp', 'h', 'cs', 'php', 'rb', 'go', 'rs', 'sql', 'sh', 'bat', 'ps1',
+        'json', 'yaml', 'yml', 'ini', 'cfg', 'conf', 'xml', 'toml',
+    }
+    # Compress new blobs with this codec: 'gzip', 'bz2', 'lzma' or 'zstd' (needs the zstandard
+    # package); None stores them raw. Raw and compressed blobs can be mixed, and both are read transparently
+    BLOB_COMPRESSION = None
+    BLOB_FRAME_BYTES = 64 * 1024  # Compressed independently, so a snippet or range read decompresses one frame
     # Explicitly excluded extensions (even if they might contain text)
     EXCLUDED_EXTENSIONS = {'pdf', 'docx', 'doc', 'pptx', 'ppt', 'xlsx', 'xls', 'html', 'htm'}
     # No file size limit
@@ -32,6 +42,51 @@ class Config:
     # Whoosh index settings
     WHOOSH_INDEX_DIR = 'whoosh_index'  # This will be created in Flask's instance folder
     
+    # Search settings
+    SEARCH_RESULTS_PER_PAGE = 20  # Only this many hits are scored, highlighted and rendered per page
+    SEARCH_CACHE_MAX_BYTES = 32 * 1024 * 1024  # Memory budget for cached result pages per worker (0 disables)
+    # Split files into line-bounded passages of at most this many bytes, each indexed as its own
+    # entry (0 indexes every file whole). Applies to content indexed from now on; rebuild to apply it to all
+    INDEX_PASSAGE_BYTES = 64 * 1024
+    # Postings an index writer buffers before spilling them to a temporary file (per process for rebuilds).
+    # With passages, this and the passage size bound the memory used by indexing, whatever the file size
+    INDEX_WRITER_MEMORY_MB = 128
+    INDEX_MERGE_FACTOR = 10  # Segments of similar size merged into one once there are this many
+    INDEX_MERGE_MAX_DELETED = 0.25  # Share of deleted entries at which a segment is rewritten at the next commit
+    INDEX_OPTIMIZE_HOUR = 3  # Local hour of the nightly merge of the whole index (None disables it)
+    
+    # Spelling dictionary precomputed for fast suggestions (in the instance folder). Built by init_db.py
+    # (or on first use) from the pyspellchecker dictionary and memory-mapped; delete it to force a rebuild
+    SPELLING_INDEX_PATH = 'spelling.idx'
+    SPELLING_CACHE_ENTRIES = 10000  # Spell-check results memoized per worker, by user dictionary version and word
+    # Searches spell-check their query only when they find fewer documents than this (None: always),
+    # waiting at most SPELLING_TIME_BUDGET seconds; a slower check is fetched by the results page
+    SPELLING_CHECK_BELOW_HITS = 5
+    SPELLING_TIME_BUDGET = 0.05
+    
+    # Create missing tables, the admin user and migrate legacy data on every start. Off is the
+    # startup-optimized mode: init_db.py does this (run it after every upgrade) and workers only
+    # check that no table is missing
+    CREATE_SCHEMA_ON_STARTUP = True
+    
+    # Compiled templates (in the instance folder), so that a new worker loads them instead of compiling
+    # them on their first render; written by init_db.py and on first render. None disables the cache
+    TEMPLATE_CACHE_DIR = 'template_cache'
+    
+    # Snapshots of the index and database taken by snapshot.py (in the instance folder, like the index).
+    # Keep them on the same file system as the index so that index files are hard-linked, not copied
+    SNAPSHOT_DIR = 'snapshots'
+    SNAPSHOT_KEEP = 7  # Older snapshots are deleted when a new one is taken
+    
+    # Background indexing settings
+    INDEXING_ASYNC = True  # Index uploads in a background thread; False indexes them during the request
+    INDEXING_BATCH_SIZE = 100  # Maximum documents applied in one index commit
+    INDEXING_BATCH_LATENCY = 2.0  # Seconds to wait for more uploads before committing a batch
+    INDEXING_POLL_INTERVAL = 30.0  # Seconds between checks for tasks queued by other workers
+    INDEXING_LOCK_TIMEOUT = 30.0  # Seconds a sync upload or sync_index.py waits while another process writes the index
+    REBUILD_PROCS = min(4, os.cpu_count() or 1)  # Analyzer processes used by a full index rebuild
+    REBUILD_READ_THREADS = 4  # Threads reading files during a full index rebuild
+    
     # Admin settings
     ADMIN_USERNAME = 'admin'
     ADMIN_EMAIL = 'admin@example.com'
@@ -1,54 +1,47 @@
 import os
 import sys
-from datetime import datetime
-import shutil
 
 # Add the current directory to the path so we can import app
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 # Import Flask application components
-from app import create_app, db
-from app.models import User, Document
+from app import create_app, create_schema
 
-app = create_app()
-
-def init_database():
-    """Initialize the database and create admin user"""
+def init_database(app):
+    """Initialize the database, create the admin user and prebuild the indexes and templates workers load"""
     with app.app_context():
         print("Creating database...")
-        # Create database tables
-        db.create_all()
-        
-        # Check if admin user exists
-        admin = User.query.filter_by(username='admin').first()
-        if admin is None:
-            print("Creating admin user...")
-            # Create admin user
-            admin = User(
-                username='admin',
-                email='admin@example.com',
-                is_admin=True
-            )
-            admin.set_password('password')
-            db.session.add(admin)
-            db.session.commit()
-            print("Admin user created with username 'admin' and password 'password'")
+        if create_schema():
+            print(f"Admin user created with username '{app.config['ADMIN_USERNAME']}' "
+                  f"and password '{app.config['ADMIN_PASSWORD']}'")
             print("IMPORTANT: Please change this password after first login!")
         else:
             print("Admin user already exists")
         
         # Create upload directory if it doesn't exist
-        uploads_dir = os.path.join(app.root_path, 'static', 'uploads')
+        uploads_dir = app.config['UPLOAD_FOLDER']
         os.makedirs(uploads_dir, exist_ok=True)
         print(f"Created uploads directory: {uploads_dir}")
         
-        # Create Whoosh index directory if it doesn't exist
+        # Create the Whoosh index, so that the first search only opens it
+        from app.search import open_or_create_index
         index_dir = app.config['WHOOSH_INDEX_DIR']
-        os.makedirs(index_dir, exist_ok=True)
-        print(f"Created search index directory: {index_dir}")
+        open_or_create_index(index_dir).close()
+        print(f"Created search index: {index_dir}")
+        
+        # Build the spelling index, which every worker then memory-maps on first use
+        from app.spell_checker import spell_checker
+        spell_checker.get_index()
+        print(f"Built spelling index: {app.config['SPELLING_INDEX_PATH']}")
+        
+        # Compile the templates into the template cache
+        if app.config['TEMPLATE_CACHE_DIR']:
+            for name in app.jinja_env.list_templates(extensions=['html']):
+                app.jinja_env.get_template(name)
+            print(f"Compiled templates: {app.config['TEMPLATE_CACHE_DIR']}")
         
         print("Database initialization complete!")
         print("\nYou can now run the application with: python run.py")
 
 if __name__ == '__main__':
-    init_database() 
\ No newline at end of file
+    init_database(create_app(start_indexer=False, check_schema=False))
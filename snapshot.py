@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Take, list and restore point-in-time snapshots of the search index and the database
+
+Usage: python snapshot.py create [--keep N] | list | restore [NAME] [--index-only] [--no-catch-up]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# Add the current directory to the path so we can import app
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from config import Config
+from app import create_app
+from app.snapshot import create_snapshot, list_snapshots, restore_snapshot
+
+def format_size(size):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='take a snapshot (safe while the server is running)')
+    create.add_argument('--keep', type=int, help='number of snapshots to keep (default: SNAPSHOT_KEEP)')
+    commands.add_parser('list', help='list the snapshots, newest first')
+    restore = commands.add_parser('restore', help='restore a snapshot (the newest by default) and catch up')
+    restore.add_argument('name', nargs='?')
+    restore.add_argument('--index-only', action='store_true',
+                         help='restore only the index and reindex what the current database has changed since')
+    restore.add_argument('--no-catch-up', action='store_true', help="don't run the index sync after restoring")
+    options = arg_parser.parse_args()
+
+    # Apply the catch-up here rather than in a background thread that exits with the script
+    class SnapshotConfig(Config):
+        INDEXING_ASYNC = False
+    app = create_app(SnapshotConfig, start_indexer=False)
+
+    with app.app_context():
+        if options.command == 'create':
+            info = create_snapshot(keep=options.keep)
+            print(f"Snapshot {info['name']}: index generation {info['generation']}, "
+                  f"{info['index_files']} files ({format_size(info['index_bytes'])}, "
+                  f"{info['linked_files']} hard-linked), database {'copied' if info['database'] else 'not copied (not SQLite)'}")
+            print(f"Index writes were paused for {info['fenced_seconds']:.2f}s")
+
+        elif options.command == 'list':
+            snapshots = list_snapshots()
+            if not snapshots:
+                print("No snapshots.")
+            for info in snapshots:
+                created = datetime.fromtimestamp(info['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+                print(f"  {info['name']:<22} {created}  generation {info['generation']:<6} "
+                      f"{format_size(info['index_bytes']):>10}  {'with database' if info['database'] else 'index only'}")
+
+        else:
+            result = restore_snapshot(options.name, with_database=not options.index_only,
+                                      catch_up=not options.no_catch_up)
+            print(f"Restored snapshot {result['snapshot']['name']}"
+                  f"{'' if options.index_only else ' (index and database)'}.")
+            report = result['sync']
+            if report is not None:
+                print(f"Catch-up: {len(report['new'])} new, {len(report['changed'])} changed, "
+                      f"{len(report['missing']) + len(report['orphaned'])} removed, {report['unchanged']} unchanged; "
+                      f"applied {result['applied']} index updates.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Reindex only the documents whose files changed since they were indexed
+
+Usage: python sync_index.py [--dry-run] [--verbose]
+"""
+import argparse
+import os
+import sys
+
+# Add the current directory to the path so we can import app
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from config import Config
+from app import create_app
+from app.indexing import sync_index, drain_queue, pending_count
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--dry-run', action='store_true', help='only report what would change')
+    arg_parser.add_argument('--verbose', action='store_true', help='list the affected document ids')
+    options = arg_parser.parse_args()
+    
+    # Apply the queued changes here rather than in a background thread that exits with the script
+    class SyncConfig(Config):
+        INDEXING_ASYNC = False
+    app = create_app(SyncConfig, start_indexer=False)
+    
+    with app.app_context():
+        print("Checking documents against the index manifest...")
+        report = sync_index(apply=not options.dry_run)
+        
+        for outcome, description in (('new', 'New (not indexed yet)'),
+                                     ('changed', 'Changed since indexed'),
+                                     ('touched', 'Touched (same content, new mtime)'),
+                                     ('missing', 'File missing'),
+                                     ('orphaned', 'Deleted document still indexed')):
+            ids = report[outcome]
+            print(f"  {description:<36} {len(ids)}")
+            if options.verbose and ids:
+                print(f"    {', '.join(str(document_id) for document_id in ids)}")
+        print(f"  {'Unchanged':<36} {report['unchanged']}")
+        print(f"Checked in {report['seconds']:.2f}s")
+        
+        if options.dry_run:
+            print("\nDry run: nothing was changed.")
+            return
+        
+        applied = drain_queue(app.config['INDEXING_BATCH_SIZE'], timeout=app.config['INDEXING_LOCK_TIMEOUT'])
+        print(f"\nApplied {applied} index updates.")
+        
+        remaining = pending_count()
+        if remaining:
+            # The index was locked by the running server; its indexer will apply the rest
+            print(f"{remaining} updates are still queued and will be applied by the server's indexer.")
+
+if __name__ == '__main__':
+    main()